@@ -0,0 +1,61 @@
+"""Benchmark folding the constant filename arguments of the calls.
+
+It visits every file of the corpus with the DependencyVisitor, once taking
+only string literals as filename arguments and once folding constants, and
+reports the time of the visits and the filenames found. Parsing is done
+beforehand, so only the visits are timed.
+
+By default the corpus is the Python files of the standard library.
+
+Usage:
+    python benchmarks/bench_constants.py [--corpus DIR] [--repeat N]
+"""
+import argparse
+import ast
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..',
+                                'pydependencies'))
+
+import bench_scanner
+import dependencies
+
+
+class LiteralsVisitor(dependencies.DependencyVisitor):
+    """The visitor taking only string literals as filenames."""
+    def _constant(self, node):
+        return node.s if isinstance(node, ast.Str) else None
+
+
+def visit(visitor_class, trees):
+    """Return the time of the visits and the number of filenames found."""
+    found = 0
+    start = time.time()
+    for filename, tree in trees:
+        visitor = visitor_class(functions=bench_scanner.FUNCTIONS,
+                                filename=filename)
+        visitor.visit(tree)
+        found += len(visitor.filenames)
+    return time.time() - start, found
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', default=os.path.dirname(os.__file__))
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args(argv[1:])
+
+    trees = [(filename, ast.parse(source, filename)) for filename, source in
+             bench_scanner.load_corpus(options.corpus)]
+    print 'files: %d' % len(trees)
+    print '%-12s %10s %10s' % ('', 'visit (s)', 'filenames')
+    for name, visitor_class in [('literals', LiteralsVisitor),
+                                ('constants', dependencies.DependencyVisitor)]:
+        results = [visit(visitor_class, trees) for _ in xrange(options.repeat)]
+        print '%-12s %10.3f %10d' % (name, min(results)[0], results[0][1])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,100 @@
+"""Benchmark the memory used by the graph representations.
+
+It compares a dictionary of sets of paths, as returned by dependency_graph,
+with DependencyGraph, and the closure as a dictionary of sets, as returned
+by transitive_dependencies before ReachabilityMap, with the ReachabilityMap
+computed from a DependencyGraph.
+
+The size of a structure is the sum of sys.getsizeof of all the objects it
+references, each object counted once. The paths are distinct string objects,
+as when they are built by the analysis.
+
+Usage:
+    python benchmarks/bench_memory.py [--sizes 1000,5000,10000,50000]
+"""
+import argparse
+import array
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..',
+                                'pydependencies'))
+
+import bench_reachable
+import dependencies
+
+
+def path_graph(size, fan_out):
+    """Return a synthetic graph whose paths are realistic and not shared."""
+    graph = bench_reachable.synthetic_graph(size, fan_out=fan_out,
+                                            cycle_ratio=0.05)
+
+    def path(node):
+        return ''.join(['/home/user/src/project/package_%03d/' %
+                        (hash(node) % 100), node])
+
+    return dict((path(node), set(path(successor) for successor in successors))
+                for node, successors in graph.iteritems())
+
+
+def deep_size(root):
+    """Return the bytes used by root and all the objects it references."""
+    seen = set()
+    pending = [root]
+    size = 0
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, (basestring, int, long, float, array.array)):
+            continue
+        if isinstance(obj, dict):
+            pending.extend(obj.iterkeys())
+            pending.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            pending.extend(vars(obj).itervalues())
+    return size
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,5000,10000,50000')
+    parser.add_argument('--fan-out', type=int, default=5)
+    options = parser.parse_args(argv[1:])
+
+    megabyte = 1024.0 * 1024
+    print '%8s %12s %12s %14s %12s %10s' % (
+        'nodes', 'dict (MB)', 'compact (MB)', 'closure (MB)',
+        'compact (MB)', 'build (s)')
+    for size in [int(size) for size in options.sizes.split(',')]:
+        graph = path_graph(size, options.fan_out)
+        compact_graph, build_time = timed(dependencies.DependencyGraph, graph)
+        closure = compact_graph.closure()
+        assert dict(compact_graph) == dict(
+            graph, **dict((node, set()) for node in compact_graph
+                          if node not in graph))
+        # The closure as a dictionary of sets is too big for large graphs.
+        if size <= 5000:
+            dict_closure = '%14.1f' % (deep_size(
+                dict((node, closure[node]) for node in closure)) / megabyte)
+        else:
+            dict_closure = '%14s' % '-'
+        print '%8d %12.1f %12.1f %s %12.1f %10.3f' % (
+            size, deep_size(graph) / megabyte,
+            deep_size(compact_graph) / megabyte, dict_closure,
+            deep_size(closure) / megabyte, build_time)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
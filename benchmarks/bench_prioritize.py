@@ -0,0 +1,80 @@
+"""Benchmark ordering the collected tests with --deps-prioritize.
+
+It ranks fake pytest items spread over test files, with a history for every
+test, and reports the time to load the history and to order the items.
+
+Usage:
+    python benchmarks/bench_prioritize.py [--items N] [--files N]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..',
+                                'pydependencies'))
+
+import history
+
+
+class _Path(object):
+    """Stand in for the py.path.local of item.fspath."""
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return self.path
+
+
+class _Item(object):
+    def __init__(self, fspath, nodeid):
+        self.fspath = fspath
+        self.nodeid = nodeid
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args(argv[1:])
+    rng = random.Random(options.seed)
+
+    paths = [_Path('/src/tests/test_%05d.py' % i)
+             for i in xrange(options.files)]
+    items = []
+    for i in xrange(options.items):
+        path = paths[i * options.files // options.items]
+        items.append(_Item(path, '%s::test_%d' % (path, i)))
+    distances = dict((str(path), rng.randint(0, 5)) for path in paths)
+    results = dict((item.nodeid, (rng.random() < 0.01, rng.random()))
+                   for item in items)
+
+    root = tempfile.mkdtemp()
+    try:
+        with history.RunHistory(root) as run_history:
+            start = time.time()
+            run_history.update(results)
+            update = time.time() - start
+            start = time.time()
+            test_history = run_history.load()
+            load = time.time() - start
+    finally:
+        shutil.rmtree(root)
+
+    start = time.time()
+    prioritized = history.prioritize(items, distances, test_history)
+    rank = time.time() - start
+    assert len(prioritized) == len(items)
+
+    print '%d items in %d files' % (options.items, options.files)
+    print 'store the history: %8.3f s' % update
+    print 'load the history:  %8.3f s' % load
+    print 'order the items:   %8.3f s' % rank
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,85 @@
+"""Benchmark the transitive closure of synthetic dependency graphs.
+
+The graphs mimic an import graph: most edges go from a module to modules
+defined "below" it, and a fraction of them go back up creating import cycles.
+
+The previous closure algorithm, a BFS per node keeping a set per node, is run
+as baseline only up to --baseline-limit nodes as it is quadratic in memory.
+
+Usage:
+    python benchmarks/bench_reachable.py [--sizes 1000,5000,10000,50000,100000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..',
+                                'pydependencies'))
+
+import dependencies
+
+
+def synthetic_graph(size, fan_out=5, cycle_ratio=0.05, seed=0):
+    """Return a random import-like graph with the given number of nodes."""
+    rng = random.Random(seed)
+    nodes = ['pkg/module_%06d.py' % i for i in xrange(size)]
+    graph = {}
+    for i, node in enumerate(nodes):
+        successors = set()
+        for _ in xrange(rng.randint(0, 2 * fan_out)):
+            if rng.random() < cycle_ratio or i == size - 1:
+                successors.add(nodes[rng.randrange(size)])
+            else:
+                successors.add(nodes[rng.randrange(i + 1, size)])
+        graph[node] = successors
+    return graph
+
+
+def bfs_reachable(graph):
+    """The previous closure algorithm, kept as baseline."""
+    reachable = {}
+    for node in graph:
+        reachable[node] = set(graph[node])
+        reachable[node].add(node)
+        latest_nodes = reachable[node]
+        while latest_nodes:
+            new_nodes = set()
+            for n in latest_nodes:
+                new_nodes.update(graph[n])
+            new_nodes -= reachable[node]
+            reachable[node].update(new_nodes)
+            latest_nodes = new_nodes
+    return reachable
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,5000,10000,50000,100000')
+    parser.add_argument('--fan-out', type=int, default=5)
+    parser.add_argument('--cycle-ratio', type=float, default=0.05)
+    parser.add_argument('--baseline-limit', type=int, default=5000)
+    options = parser.parse_args(argv[1:])
+
+    print '%8s %12s %12s %8s' % ('nodes', 'scc (s)', 'bfs (s)', 'speedup')
+    for size in [int(size) for size in options.sizes.split(',')]:
+        graph = synthetic_graph(size, options.fan_out, options.cycle_ratio)
+        closure, scc_time = timed(dependencies._reachable, graph)
+        if size <= options.baseline_limit:
+            baseline, bfs_time = timed(bfs_reachable, graph)
+            assert baseline == closure
+            print '%8d %12.3f %12.3f %7.1fx' % (
+                size, scc_time, bfs_time, bfs_time / scc_time)
+        else:
+            print '%8d %12.3f %12s %8s' % (size, scc_time, '-', '-')
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,79 @@
+"""Benchmark reading the files ahead of their analysis on a slow filesystem.
+
+Network filesystems make every open slow while the CPU is idle. This stands
+in for one by sleeping before every open, and builds the dependency graph of
+a synthetic tree with and without reader threads.
+
+Usage:
+    python benchmarks/bench_readers.py [--files N] [--latency MS]
+                                       [--readers N,N,...]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..',
+                                'pydependencies'))
+
+import __builtin__
+
+import dependencies
+import synthetic_repo
+
+
+def _delayed_open(latency):
+    """Return an open which waits latency seconds first."""
+    builtin_open = __builtin__.open
+
+    def delayed_open(*args, **kwargs):
+        time.sleep(latency)
+        return builtin_open(*args, **kwargs)
+    return delayed_open
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--tests', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=2.0,
+                        help='milliseconds waited before each open')
+    parser.add_argument('--readers', default='0,4,16,64',
+                        help='comma separated numbers of reader threads')
+    options = parser.parse_args(argv[1:])
+
+    root = tempfile.mkdtemp()
+    try:
+        repo = synthetic_repo.generate_repo(
+            root, files=options.files, tests=options.tests,
+            templates=options.files // 10)
+        arguments = dict(start_path=root,
+                         template_path=repo['templates_path'],
+                         functions=repo['functions'])
+        expected = dependencies.dependency_graph(repo['tests'], **arguments)
+
+        builtin_open = __builtin__.open
+        __builtin__.open = _delayed_open(options.latency / 1000.0)
+        try:
+            print '%d files, %.1f ms per open' % (len(expected),
+                                                  options.latency)
+            baseline = None
+            for readers in [int(n) for n in options.readers.split(',')]:
+                start = time.time()
+                graph = dependencies.dependency_graph(
+                    repo['tests'], readers=readers, **arguments)
+                elapsed = time.time() - start
+                assert graph == expected
+                baseline = baseline or elapsed
+                print 'readers=%-3d %8.3f s %6.1fx' % (readers, elapsed,
+                                                      baseline / elapsed)
+        finally:
+            __builtin__.open = builtin_open
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,79 @@
+"""Benchmark the overhead of recording the files accessed by the tests.
+
+It simulates test files opening files in a loop, with and without the
+recorder, and reports the time per open call and the time of a flush.
+
+Usage:
+    python benchmarks/bench_recorder.py [--files N] [--opens N]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..',
+                                'pydependencies'))
+
+import recorder
+
+
+def open_files(filenames, opens):
+    start = time.time()
+    for i in xrange(opens):
+        open(filenames[i % len(filenames)]).close()
+    return time.time() - start
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=100,
+                        help='number of distinct files opened')
+    parser.add_argument('--opens', type=int, default=20000,
+                        help='number of open calls per test file')
+    parser.add_argument('--test-files', type=int, default=20)
+    options = parser.parse_args(argv[1:])
+
+    root = tempfile.mkdtemp()
+    try:
+        filenames = []
+        for i in xrange(options.files):
+            filename = os.path.join(root, 'data_%04d.txt' % i)
+            with open(filename, 'w') as f:
+                f.write('data')
+            filenames.append(filename)
+
+        baseline = sum(open_files(filenames, options.opens)
+                       for _ in xrange(options.test_files))
+
+        database = recorder.RecordedDependencies(os.path.join(root, '.cache'),
+                                                 base_path=root)
+        file_recorder = recorder.Recorder(database)
+        recording = flushing = 0
+        for i in xrange(options.test_files):
+            test_filename = os.path.join(root, 'test_%04d.py' % i)
+            file_recorder.start(test_filename)
+            recording += open_files(filenames, options.opens)
+            start = time.time()
+            file_recorder.flush(test_filename)
+            flushing += time.time() - start
+        file_recorder.close()
+    finally:
+        shutil.rmtree(root)
+
+    opens = options.opens * options.test_files
+    print 'open calls: %d, distinct files: %d, test files: %d' % (
+        opens, options.files, options.test_files)
+    print '%-12s %12s %14s' % ('', 'total (s)', 'per open (us)')
+    print '%-12s %12.3f %14.2f' % ('baseline', baseline,
+                                   1e6 * baseline / opens)
+    print '%-12s %12.3f %14.2f' % ('recording', recording,
+                                   1e6 * recording / opens)
+    print 'overhead: %.1f%%, flush: %.2f ms per test file' % (
+        100 * (recording - baseline) / baseline,
+        1e3 * flushing / options.test_files)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,96 @@
+"""Benchmark the import scanner against the full AST visitor.
+
+By default the corpus is the Python files of the standard library, which are
+real world files of all sizes and styles.
+
+Usage:
+    python benchmarks/bench_scanner.py [--corpus DIR] [--repeat N]
+"""
+import argparse
+import ast
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..',
+                                'pydependencies'))
+
+import dependencies
+
+
+FUNCTIONS = (
+    ('open', 0, None),
+    ('render', 0, None),
+    ('GzipFile', 0, None),
+    ('BZ2File', 0, None),
+    ('ZipFile', 0, None),
+    ('TarFile', 0, None),
+    ('reader', 0, None),
+    ('writer', 0, None),
+    ('DictReader', 0, None),
+    ('DictWriter', 0, None),
+)
+
+
+def load_corpus(directory):
+    """Return a list of (filename, source) of the valid Python files."""
+    corpus = []
+    for root, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+        for name in filenames:
+            if not name.endswith('.py'):
+                continue
+            filename = os.path.join(root, name)
+            with open(filename) as f:
+                source = f.read()
+            try:
+                ast.parse(source, filename)
+            except (SyntaxError, TypeError, ValueError):
+                continue
+            corpus.append((filename, source))
+    return corpus
+
+
+def full_visit(source, filename, functions):
+    visitor = dependencies.DependencyVisitor(functions=functions)
+    visitor.visit(ast.parse(source, filename))
+    return visitor
+
+
+def timed(function, corpus, repeat):
+    start = time.time()
+    for _ in xrange(repeat):
+        for filename, source in corpus:
+            function(source, filename, FUNCTIONS)
+    return (time.time() - start) / repeat
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', default=os.path.dirname(os.__file__))
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args(argv[1:])
+
+    corpus = load_corpus(options.corpus)
+    for filename, source in corpus:
+        expected = full_visit(source, filename, FUNCTIONS)
+        scanned = dependencies._scan(source, filename, FUNCTIONS)
+        assert sorted(expected.modules) == sorted(scanned.modules), filename
+        assert expected.filenames == scanned.filenames, filename
+
+    scannable = [(filename, source) for filename, source in corpus
+                 if not dependencies._may_call(source, FUNCTIONS)]
+    print 'files: %d, %d decided by the scanner' % (len(corpus),
+                                                    len(scannable))
+    print '%-20s %12s %12s %8s' % ('', 'visitor (s)', 'scanner (s)',
+                                   'speedup')
+    for name, files in [('all files', corpus),
+                        ('scanner decides', scannable)]:
+        visitor_time = timed(full_visit, files, options.repeat)
+        scanner_time = timed(dependencies._scan, files, options.repeat)
+        print '%-20s %12.3f %12.3f %7.1fx' % (
+            name, visitor_time, scanner_time, visitor_time / scanner_time)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,241 @@
+"""Benchmark every phase of the analysis on a synthetic source tree.
+
+The tree is made by synthetic_repo. Each phase runs in its own forked
+process, after its setup is done, and reports:
+
+    time: wall time of the phase in seconds
+    peak_rss_kb: peak resident memory of the process, setup included
+    stat_calls: number of os.stat, os.lstat, os.listdir and scandir calls,
+        plus the entries returned by scandir, which stand for the stat
+        calls listdir needs to tell the directories apart
+
+The results are written as JSON, so the results of two versions can be
+compared with --compare.
+
+Usage:
+    python benchmarks/bench_suite.py [--files N] [--output results.json]
+    python benchmarks/bench_suite.py --compare old.json new.json
+"""
+import argparse
+import collections
+import functools
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..',
+                                'pydependencies'))
+
+import dependencies
+import synthetic_repo
+
+
+_stat_calls = collections.Counter()
+
+
+def _counted(name, function):
+    """Return function counting its calls under name."""
+    def counted(*args, **kwargs):
+        _stat_calls[name] += 1
+        return function(*args, **kwargs)
+    return counted
+
+
+def _counted_scandir(function):
+    """Return scandir counting its calls and the entries it returns."""
+    def counted_scandir(*args, **kwargs):
+        _stat_calls['scandir'] += 1
+        for entry in function(*args, **kwargs):
+            _stat_calls['scandir_entries'] += 1
+            yield entry
+    return counted_scandir
+
+
+def _count_stat_calls():
+    """Wrap the functions touching the filesystem metadata, once."""
+    wrappers = [(os, name, functools.partial(_counted, name))
+                for name in ('stat', 'lstat', 'listdir')]
+    wrappers.append((dependencies, 'scandir', _counted_scandir))
+    for module, name, wrap in wrappers:
+        function = getattr(module, name)
+        if function is None or getattr(function, 'counted', False):
+            continue
+        wrapped = wrap(function)
+        wrapped.counted = True
+        setattr(module, name, wrapped)
+
+
+def phase_python_dependencies(repo):
+    def run():
+        for filename in repo['modules'] + repo['tests']:
+            dependencies.python_dependencies(
+                filename, start_path=repo['root'],
+                functions=repo['functions'])
+    return run
+
+
+def phase_html_dependencies(repo):
+    def run():
+        for filename in repo['templates']:
+            dependencies.html_dependencies(
+                filename, template_path=repo['templates_path'])
+    return run
+
+
+def _graph(repo):
+    return dependencies.dependency_graph(
+        repo['tests'], start_path=repo['root'],
+        template_path=repo['templates_path'], functions=repo['functions'])
+
+
+def phase_dependency_graph(repo):
+    return lambda: _graph(repo)
+
+
+def phase_reachable(repo):
+    graph = _graph(repo)
+    return lambda: dependencies._reachable(graph)
+
+
+def phase_transitive_dependencies(repo):
+    return lambda: dependencies.transitive_dependencies(
+        repo['tests'], start_path=repo['root'],
+        template_path=repo['templates_path'], functions=repo['functions'])
+
+
+class _Item(object):
+    def __init__(self, filename):
+        self.fspath = filename
+        self.nodeid = filename + '::test'
+
+
+def phase_collection_hook(repo):
+    """Run the pytest hook as py.test --affected does."""
+    import pytest_deps
+
+    parser = argparse.ArgumentParser()
+    group = parser.add_argument_group('dependencies')
+    group._addoption = group.add_argument
+    parser.getgroup = lambda *args: group
+    pytest_deps.pytest_addoption(parser)
+    options = parser.parse_args(['--affected', '--base_path', repo['root'],
+                                 '--templates_path', 'templates',
+                                 '--deps-socket', '/nonexistent'])
+    config = argparse.Namespace(option=options)
+    modified = set(repo['modules'][-len(repo['modules']) // 10:])
+    pytest_deps.get_modified_filenames = lambda *args: modified
+    items = [_Item(filename) for filename in repo['tests']]
+
+    def run():
+        pytest_deps.pytest_collection_modifyitems(None, config, list(items))
+    return run
+
+
+PHASES = collections.OrderedDict([
+    ('python_dependencies', phase_python_dependencies),
+    ('html_dependencies', phase_html_dependencies),
+    ('dependency_graph', phase_dependency_graph),
+    ('reachable', phase_reachable),
+    ('transitive_dependencies', phase_transitive_dependencies),
+    ('collection_hook', phase_collection_hook),
+])
+
+
+def _run_phase(phase, repo):
+    try:
+        run = phase(repo)
+    except ImportError as e:
+        return {'error': 'skipped: %s' % e}
+    _count_stat_calls()
+    start = time.time()
+    run()
+    elapsed = time.time() - start
+    return {'time': elapsed,
+            'peak_rss_kb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss,
+            'stat_calls': sum(_stat_calls.values())}
+
+
+def measure(phase, repo):
+    """Run a phase in a forked process and return its measures."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            result = _run_phase(phase, repo)
+        except Exception as e:
+            result = {'error': '%s: %s' % (type(e).__name__, e)}
+        with os.fdopen(write_fd, 'w') as f:
+            json.dump(result, f)
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        output = f.read()
+    os.waitpid(pid, 0)
+    return json.loads(output or '{"error": "the process died"}')
+
+
+def compare(old_filename, new_filename):
+    """Print the change of every measure between two result files."""
+    with open(old_filename) as f:
+        old = json.load(f)['phases']
+    with open(new_filename) as f:
+        new = json.load(f)['phases']
+    print '%-24s %-12s %12s %12s %8s' % ('phase', 'measure', 'old', 'new',
+                                         'change')
+    for name in sorted(new):
+        for measure_name in ('time', 'peak_rss_kb', 'stat_calls'):
+            if measure_name not in old.get(name, {}) or \
+                    measure_name not in new[name]:
+                continue
+            old_value = old[name][measure_name]
+            new_value = new[name][measure_name]
+            change = ('%+7.1f%%' % (100.0 * (new_value - old_value) /
+                                    old_value) if old_value else '-')
+            print '%-24s %-12s %12.4g %12.4g %8s' % (
+                name, measure_name, old_value, new_value, change)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    parser.add_argument('--output', help='write the JSON results to a file')
+    parser.add_argument('--phases', default=','.join(PHASES))
+    parser.add_argument('--keep', metavar='DIR',
+                        help='generate the tree in DIR and keep it')
+    for name, default in sorted(synthetic_repo.DEFAULTS.iteritems()):
+        parser.add_argument('--' + name.replace('_', '-'), dest=name,
+                            type=type(default), default=default)
+    options = parser.parse_args(argv[1:])
+    if options.compare:
+        compare(*options.compare)
+        return
+
+    parameters = dict((name, getattr(options, name))
+                      for name in synthetic_repo.DEFAULTS)
+    root = options.keep or tempfile.mkdtemp()
+    try:
+        repo = synthetic_repo.generate_repo(root, **parameters)
+        repo['root'] = os.path.abspath(root)
+        results = collections.OrderedDict()
+        for name in options.phases.split(','):
+            results[name] = measure(PHASES[name], repo)
+    finally:
+        if not options.keep:
+            shutil.rmtree(root)
+
+    output = json.dumps({'parameters': parameters, 'phases': results},
+                        indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+    print output
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,159 @@
+"""Generate synthetic source trees to benchmark the analysis on.
+
+The tree looks like a Python web project:
+
+    pkg_000/__init__.py, pkg_000/module_0000.py, ...
+    templates/template_0000.html, ...
+    data/data_0000.txt, ...
+    tests/test_0000.py, ...
+
+Modules import modules defined "below" them, plus a fraction of imports going
+back up which create import cycles. Some modules open a data file or render a
+template with literal arguments, and templates include each other in chains.
+The same parameters and seed always generate the same tree.
+
+Usage as a script:
+    python benchmarks/synthetic_repo.py OUTPUT_DIR [--files N] ...
+"""
+import argparse
+import os
+import random
+import sys
+
+
+DEFAULTS = dict(files=2000, modules_per_package=50, fan_out=4,
+                cycle_ratio=0.05, templates=200, include_depth=5,
+                open_ratio=0.2, render_ratio=0.1, tests=200,
+                test_fan_out=3, seed=0)
+
+
+def _write(filename, content):
+    directory = os.path.dirname(filename)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(filename, 'w') as f:
+        f.write(content)
+
+
+def generate_repo(root, **parameters):
+    """Write a synthetic source tree under root.
+
+    Args:
+        root: str: the output directory
+        parameters: overrides of DEFAULTS:
+            files: number of Python modules
+            modules_per_package: modules in each package
+            fan_out: average number of imports per module
+            cycle_ratio: fraction of the imports which may create a cycle
+            templates: number of Mako templates
+            include_depth: length of the template include chains
+            open_ratio: fraction of modules opening a data file
+            render_ratio: fraction of modules rendering a template
+            tests: number of test files
+            test_fan_out: average number of modules imported by a test
+
+    Returns:
+        a dict with the lists of 'modules', 'templates', 'data' and 'tests'
+        filenames and the 'functions' spec needed to find the data files and
+        templates.
+    """
+    options = dict(DEFAULTS)
+    unknown = set(parameters) - set(options)
+    if unknown:
+        raise TypeError('unknown parameters: %s' % ', '.join(sorted(unknown)))
+    options.update(parameters)
+    rng = random.Random(options['seed'])
+    root = os.path.abspath(root)
+    templates_path = os.path.join(root, 'templates')
+
+    module_names = ['pkg_%03d.module_%04d' % (
+        i // options['modules_per_package'], i)
+        for i in xrange(options['files'])]
+    modules = [os.path.join(root, name.replace('.', os.sep) + '.py')
+               for name in module_names]
+    templates = [os.path.join(templates_path, 'template_%04d.html' % i)
+                 for i in xrange(options['templates'])]
+    data = [os.path.join(root, 'data', 'data_%04d.txt' % i)
+            for i in xrange(max(1, options['files'] // 10))]
+    tests = [os.path.join(root, 'tests', 'test_%04d.py' % i)
+             for i in xrange(options['tests'])]
+
+    for package in sorted(set(name.split('.')[0] for name in module_names)):
+        _write(os.path.join(root, package, '__init__.py'), '')
+
+    size = len(module_names)
+    for i, filename in enumerate(modules):
+        lines = ['"""Synthetic module %d."""' % i]
+        imported = set()
+        for _ in xrange(rng.randint(0, 2 * options['fan_out'])):
+            if rng.random() < options['cycle_ratio'] or i == size - 1:
+                imported.add(rng.randrange(size))
+            else:
+                imported.add(rng.randrange(i + 1, size))
+        imported.discard(i)
+        for j in sorted(imported):
+            package, module = module_names[j].split('.')
+            if rng.random() < 0.5:
+                lines.append('import %s.%s' % (package, module))
+            else:
+                lines.append('from %s import %s' % (package, module))
+        lines.append('')
+        lines.append('')
+        lines.append('def function_%d(value):' % i)
+        if data and rng.random() < options['open_ratio']:
+            lines.append('    with open(%r) as f:' % rng.choice(data))
+            lines.append('        value += len(f.read())')
+        if templates and rng.random() < options['render_ratio']:
+            lines.append('    value += len(render(%r))' % os.path.basename(
+                rng.choice(templates)))
+        lines.append('    return [value * n for n in range(10)]')
+        _write(filename, '\n'.join(lines) + '\n')
+
+    depth = max(1, options['include_depth'])
+    for i, filename in enumerate(templates):
+        lines = ['<html><body>', '<p>Template %d</p>' % i]
+        # Templates form chains of include_depth templates.
+        if (i + 1) % depth and i + 1 < len(templates):
+            lines.append('<%%include file="/%s"/>' % os.path.basename(
+                templates[i + 1]))
+        lines.append('</body></html>')
+        _write(filename, '\n'.join(lines) + '\n')
+
+    for filename in data:
+        _write(filename, 'data\n')
+
+    for i, filename in enumerate(tests):
+        lines = ['import unittest', '']
+        imported = sorted(set(
+            rng.randrange(size)
+            for _ in xrange(rng.randint(1, 2 * options['test_fan_out']))))
+        for j in imported:
+            lines.append('import %s' % module_names[j])
+        lines.extend(['', '', 'class Test%d(unittest.TestCase):' % i])
+        for j in imported:
+            lines.append('    def test_%d(self):' % j)
+            lines.append('        %s.function_%d(1)' % (module_names[j], j))
+        _write(filename, '\n'.join(lines) + '\n')
+
+    functions = (('open', 0, None),
+                 ('render', 0,
+                  lambda name: os.path.join(templates_path, name.strip('/'))))
+    return dict(modules=modules, templates=templates, data=data, tests=tests,
+                functions=functions, templates_path=templates_path)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('root')
+    for name, default in sorted(DEFAULTS.iteritems()):
+        parser.add_argument('--' + name.replace('_', '-'), dest=name,
+                            type=type(default), default=default)
+    options = vars(parser.parse_args(argv[1:]))
+    repo = generate_repo(options.pop('root'), **options)
+    print '%d modules, %d templates, %d data files, %d tests' % (
+        len(repo['modules']), len(repo['templates']), len(repo['data']),
+        len(repo['tests']))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1 +1,7 @@
 from pydependencies.dependencies import transitive_dependencies, python_dependencies, html_dependencies
+from pydependencies.dependencies import python_test_dependencies
+from pydependencies.dependencies import dependency_graph, affected_by, ModuleIndex
+from pydependencies.dependencies import affected_distances
+from pydependencies.dependencies import PackageCache
+from pydependencies.dependencies import LazyDependencyGraph, DependencyGraph
+from pydependencies.dependencies import update_graph, update_reachable
@@ -0,0 +1,6 @@
+import sys
+
+from pydependencies import dependencies
+
+
+sys.exit(dependencies.main(sys.argv))
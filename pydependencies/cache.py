@@ -0,0 +1,224 @@
+"""Persistent on-disk cache of the direct dependencies of the analysed files.
+
+Parsing every reachable file is by far the most expensive part of computing the
+dependency graph, while between two runs only a handful of files change. The
+cache stores the direct dependencies of each file, as returned by
+python_dependencies and html_dependencies, in a sqlite database.
+
+An entry is considered fresh if the modification time and size of the file did
+not change. Otherwise the sha1 of the content is compared against the stored
+one, so a fresh checkout or a touch does not invalidate the whole cache.
+
+The imports of a Python file also resolve differently when modules are added
+or deleted, so its entry stores as well a digest of the listings of the
+directories its imports may be resolved in: its directory and the ones of
+its dependencies, up to start_path, and start_path itself. Each directory is
+listed at most once per DependencyCache.
+
+All entries are dropped whenever the parameters of the analysis (start_path,
+template_path, the functions spec or the template dialects) or the
+CACHE_VERSION change.
+"""
+import hashlib
+import os
+import sqlite3
+
+
+__all__ = ('DependencyCache',)
+
+DEFAULT_CACHE_PATH = '.pydependencies_cache'
+
+# Increase it whenever the output of the analysis changes for the same input.
+CACHE_VERSION = 6
+
+
+def file_digest(filename):
+    """Return the hex sha1 of the content of the given file."""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _listing_digest(directory):
+    """Return the hex sha1 of the importable names in a directory.
+
+    It is '' if the directory does not exist.
+    """
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return ''
+    # Other files can not be imported, directories are not told apart
+    # from them without a stat.
+    names = sorted(name for name in names
+                   if name.endswith('.py') or '.' not in name)
+    return hashlib.sha1('\0'.join(names)).hexdigest()
+
+
+def _callable_fingerprint(function):
+    """Return a stable representation of a post processor."""
+    if function is None:
+        return 'None'
+    code = getattr(function, '__code__', None)
+    if code is not None:
+        return repr((code.co_code, code.co_consts, code.co_names))
+    return '%s.%s' % (getattr(function, '__module__', None),
+                      getattr(function, '__name__', type(function).__name__))
+
+
+def functions_fingerprint(functions):
+    """Return a stable representation of a functions spec, as a list."""
+    return [repr((function_pattern, function_arg,
+                  _callable_fingerprint(post_processor)))
+            for function_pattern, function_arg, post_processor in functions]
+
+
+def analysis_fingerprint(start_path, template_path, functions,
+                         template_dialects=('mako',)):
+    """Return a hash identifying the parameters of the analysis."""
+    parts = [str(CACHE_VERSION), start_path, template_path,
+             ','.join(template_dialects)]
+    parts.extend(functions_fingerprint(functions))
+    return hashlib.sha1('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+class DependencyCache(object):
+    """Store the direct dependencies of files keyed by their content.
+
+    Args:
+        path: str: directory where the database is stored. It is created if
+        needed.
+        start_path: str: the start_path used for the analysis
+        template_path: str: the template_path used for the analysis
+        functions: tuple: the functions spec used for the analysis
+        template_dialects: tuple: the template dialects used for the analysis
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, start_path='.',
+                 template_path='./templates', functions=(),
+                 template_dialects=('mako',)):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.hits = 0
+        self.misses = 0
+        self._start_path = os.path.abspath(start_path)
+        self._prefix = os.path.join(self._start_path, '')
+        # Digests computed on a miss, so set does not need to compute it again.
+        self._digests = {}
+        self._listing_digests = {}
+        self._listings = {}
+        self._connection = sqlite3.connect(
+            os.path.join(path, 'dependencies.sqlite'))
+        self._connection.text_factory = str
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT)""")
+        fingerprint = analysis_fingerprint(start_path, template_path,
+                                           functions, template_dialects)
+        row = self._connection.execute(
+            "SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is None or row[0] != fingerprint:
+            # The table is created again, as its columns may have changed.
+            self._connection.execute('DROP TABLE IF EXISTS dependencies')
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)",
+                (fingerprint,))
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS dependencies (
+                path TEXT PRIMARY KEY,
+                mtime REAL,
+                size INTEGER,
+                digest TEXT,
+                directories TEXT,
+                listing TEXT,
+                dependencies TEXT)""")
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, unused_type, unused_value, unused_traceback):
+        self.close()
+
+    def _directories(self, filename, dependencies):
+        """Return the directories the imports of filename may resolve in."""
+        if not filename.endswith('.py'):
+            return []
+        directories = set([self._start_path])
+        for path in [filename] + [dependency for dependency in dependencies
+                                  if dependency.endswith('.py')]:
+            directory = os.path.dirname(path)
+            # Relative imports may go up to the parent packages.
+            if not directory.startswith(self._prefix):
+                directories.add(directory)
+            while (directory.startswith(self._prefix) and
+                   directory not in directories):
+                directories.add(directory)
+                directory = os.path.dirname(directory)
+        return sorted(directories)
+
+    def _listing(self, directories):
+        """Return the digest of the listings of '\0' joined directories."""
+        listing = self._listings.get(directories)
+        if listing is None:
+            digests = []
+            for directory in directories.split('\0'):
+                digest = self._listing_digests.get(directory)
+                if digest is None:
+                    digest = self._listing_digests[directory] = \
+                        _listing_digest(directory)
+                digests.append(digest)
+            listing = self._listings[directories] = hashlib.sha1(
+                '\0'.join(digests)).hexdigest()
+        return listing
+
+    def get(self, filename):
+        """Return the cached dependencies of filename or None if not fresh."""
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        row = self._connection.execute(
+            'SELECT mtime, size, digest, directories, listing, dependencies '
+            'FROM dependencies WHERE path = ?', (filename,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        mtime, size, digest, directories, listing, dependencies = row
+        if directories and self._listing(directories) != listing:
+            self.misses += 1
+            return None
+        if mtime != stat.st_mtime or size != stat.st_size:
+            current_digest = file_digest(filename)
+            if current_digest != digest:
+                self._digests[filename] = current_digest
+                self.misses += 1
+                return None
+            self._connection.execute(
+                'UPDATE dependencies SET mtime = ?, size = ? WHERE path = ?',
+                (stat.st_mtime, stat.st_size, filename))
+
+        self.hits += 1
+        return set(dependencies.split('\0')) if dependencies else set()
+
+    def set(self, filename, dependencies):
+        """Store the direct dependencies of filename."""
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return
+        digest = self._digests.pop(filename, None) or file_digest(filename)
+        directories = '\0'.join(self._directories(filename, dependencies))
+        self._connection.execute(
+            'INSERT OR REPLACE INTO dependencies VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (filename, stat.st_mtime, stat.st_size, digest, directories,
+             directories and self._listing(directories),
+             '\0'.join(sorted(dependencies))))
+
+    def close(self):
+        """Write the pending changes and close the database."""
+        self._connection.commit()
+        self._connection.close()
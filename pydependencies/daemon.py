@@ -0,0 +1,417 @@
+"""Daemon keeping the dependency graph in memory between test runs.
+
+Building the dependency graph on every test run is wasteful when running the
+tests many times in a row. The daemon builds it once, watches the sources for
+changes, updating the graph incrementally, and answers which test files are
+affected by a set of changed files over a Unix socket.
+
+Start it with:
+
+    python -m pydependencies serve [--socket PATH] TEST_PATHS...
+
+The filesystem is watched with inotify when available, otherwise it is polled.
+
+The protocol is one JSON object per line. A request looks like:
+
+    {"analysis": {...}, "changed": [...], "roots": [...]}
+
+and the response is either {"affected": [...], "distances": {...}} or
+{"error": "message"}. The distances map each affected root to the number of
+edges of its shortest path to a changed file. The analysis, as returned by
+describe_analysis, must be the one of the daemon, otherwise the query is
+rejected, as the daemon could miss dependencies the client expects.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import select
+import socket
+import SocketServer
+import struct
+import threading
+import time
+
+import cache
+import dependencies
+import templates
+
+
+__all__ = ('DependencyServer', 'describe_analysis', 'query_distances')
+
+DEFAULT_SOCKET_PATH = os.path.join(cache.DEFAULT_CACHE_PATH, 'daemon.sock')
+
+
+def describe_analysis(start_path, template_path='./templates', functions=(),
+                      template_dialects=templates.DEFAULT_DIALECTS,
+                      graph=None):
+    """Return the JSON encodable parameters of an analysis.
+
+    Args:
+        start_path: str: the base path of the sources
+        template_path: str: path where the templates are located
+        functions: tuple: the functions spec
+        template_dialects: tuple: the names of the template dialects
+        graph: str: the graph file the analysis starts from, if any
+    """
+    return {
+        'base_path': os.path.abspath(start_path),
+        'template_path': os.path.abspath(template_path),
+        'functions': cache.functions_fingerprint(functions),
+        'template_dialects': list(template_dialects),
+        'graph': graph and os.path.abspath(graph),
+    }
+
+
+def _is_source(filename):
+    return filename.endswith('.py') or filename.endswith('.html')
+
+
+def _walk_directories(path):
+    """Yield the directories under path, skipping the hidden ones."""
+    for directory, dirnames, unused_filenames in os.walk(path):
+        dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+        yield directory
+
+
+class PollingWatcher(object):
+    """Detect changed files by comparing snapshots of their stat."""
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for directory in _walk_directories(self.path):
+            for name in os.listdir(directory):
+                filename = os.path.join(directory, name)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                snapshot[filename] = (stat.st_mtime, stat.st_size, stat.st_ino)
+        return snapshot
+
+    def wait(self, timeout):
+        """Wait until the next poll is due."""
+        time.sleep(min(timeout, self.interval))
+
+    def read(self):
+        """Return the set of paths which changed since the previous call."""
+        snapshot = self._take_snapshot()
+        changed = set(filename for filename, stat in snapshot.iteritems()
+                      if self._snapshot.get(filename) != stat)
+        changed.update(set(self._snapshot) - set(snapshot))
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """Detect changed files with the Linux inotify API, through ctypes."""
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    IN_NONBLOCK = 0o4000
+
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+            IN_MOVED_TO | IN_CREATE | IN_DELETE)
+
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self, path):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, 'libc not found')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not supported')
+        self._fd = self._libc.inotify_init1(self.IN_CLOEXEC |
+                                            self.IN_NONBLOCK)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._directories = {}
+        for directory in _walk_directories(path):
+            self._add_watch(directory)
+
+    def _add_watch(self, directory):
+        watch = self._libc.inotify_add_watch(self._fd, directory, self.MASK)
+        if watch >= 0:
+            self._directories[watch] = directory
+
+    def wait(self, timeout):
+        """Wait until there are events to read or timeout seconds passed."""
+        select.select([self._fd], [], [], timeout)
+
+    def read(self):
+        """Return the set of paths which changed since the previous call."""
+        changed = set()
+        readable = True
+        while readable:
+            try:
+                data = os.read(self._fd, 1 << 16)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    break
+                raise
+            position = 0
+            while position < len(data):
+                watch, mask, unused_cookie, length = self._EVENT.unpack_from(
+                    data, position)
+                position += self._EVENT.size
+                name = data[position:position + length].rstrip('\0')
+                position += length
+                directory = self._directories.get(watch)
+                if mask & self.IN_IGNORED:
+                    self._directories.pop(watch, None)
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, name)
+                if mask & self.IN_ISDIR:
+                    if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                        # Files may have been created before the watch.
+                        for new_directory in _walk_directories(path):
+                            self._add_watch(new_directory)
+                            changed.update(
+                                os.path.join(new_directory, new_name)
+                                for new_name in os.listdir(new_directory))
+                else:
+                    changed.add(path)
+            # Events usually come in bursts, e.g. when checking out a branch.
+            readable, _, _ = select.select([self._fd], [], [], 0.05)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+def create_watcher(path, poll=False, interval=1.0):
+    """Return an inotify watcher, or a polling one if not available."""
+    if not poll:
+        try:
+            return InotifyWatcher(path)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(path, interval=interval)
+
+
+class DependencyServer(object):
+    """Keep the dependency graph of a set of roots up to date.
+
+    Args:
+        roots: iterable: the initial files from where the analysis starts
+        watcher: object: a PollingWatcher or InotifyWatcher of base_path
+        options: the arguments for dependency_graph. start_path must be
+        absolute.
+    """
+    def __init__(self, roots, watcher, **options):
+        self.roots = set(roots)
+        self.watcher = watcher
+        self.options = options
+        self.base_path = options['start_path']
+        self.analysis = describe_analysis(
+            options['start_path'],
+            template_path=options.get('template_path', './templates'),
+            functions=options.get('functions', ()),
+            template_dialects=options.get('template_dialects',
+                                          templates.DEFAULT_DIALECTS))
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.graph = dependencies.dependency_graph(self.roots, **options)
+
+    def _update(self, filenames):
+        """Update the graph after the given files changed."""
+        changed, added, deleted = set(), set(), set()
+        for filename in filenames:
+            if not os.path.exists(filename):
+                if filename in self.graph or filename in self.roots:
+                    deleted.add(filename)
+            elif filename in self.graph:
+                changed.add(filename)
+            elif _is_source(filename):
+                added.add(filename)
+        if not (changed or added or deleted):
+            return
+        self.roots -= deleted
+        self.graph = dependencies.update_graph(
+            self.graph, self.roots, changed=changed, added=added,
+            deleted=deleted, **self.options)
+
+    def refresh(self):
+        """Apply the changes reported by the watcher."""
+        with self._lock:
+            self._update(self.watcher.read())
+
+    def affected(self, changed_filenames, roots):
+        """Return the roots which depend on any of the changed files."""
+        return set(self.distances(changed_filenames, roots))
+
+    def distances(self, changed_filenames, roots):
+        """Return the distance to the changed files of the affected roots."""
+        with self._lock:
+            self._update(self.watcher.read())
+            # The changed files are analysed again in case their events were
+            # not processed yet.
+            self._update(set(changed_filenames) & set(self.graph))
+            new_roots = set(roots) - self.roots
+            if new_roots:
+                self.roots.update(new_roots)
+                self.graph = dependencies.dependency_graph(
+                    self.roots, known=self.graph, **self.options)
+            return dependencies.affected_distances(changed_filenames, roots,
+                                                   graph=self.graph)
+
+    def watch(self, interval=1.0):
+        """Apply the changes reported by the watcher until stopped."""
+        while not self._stopped.is_set():
+            self.watcher.wait(interval)
+            self.refresh()
+
+    def stop(self):
+        """Make watch return."""
+        self._stopped.set()
+
+    def handle(self, request):
+        """Return the response to a decoded request."""
+        analysis = request.get('analysis') or {}
+        different = sorted(key for key in set(analysis) | set(self.analysis)
+                           if analysis.get(key) != self.analysis.get(key))
+        if different:
+            return {'error': 'the daemon analyses with another %s' %
+                             ', '.join(different)}
+        distances = self.distances(request.get('changed', ()),
+                                   request.get('roots', ()))
+        return {'affected': sorted(distances), 'distances': distances}
+
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        try:
+            response = self.server.dependency_server.handle(
+                json.loads(self.rfile.readline()))
+        except Exception as e:
+            response = {'error': '%s: %s' % (type(e).__name__, e)}
+        self.wfile.write(json.dumps(response) + '\n')
+
+
+class _UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(dependency_server, socket_path=DEFAULT_SOCKET_PATH):
+    """Return a socket server answering the queries with dependency_server."""
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    directory = os.path.dirname(socket_path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    server = _UnixServer(socket_path, _RequestHandler)
+    server.dependency_server = dependency_server
+    return server
+
+
+def serve(dependency_server, socket_path=DEFAULT_SOCKET_PATH, interval=1.0):
+    """Serve the queries over a Unix socket until interrupted."""
+    server = create_server(dependency_server, socket_path)
+    watch_thread = threading.Thread(target=dependency_server.watch,
+                                    args=(interval,))
+    watch_thread.daemon = True
+    watch_thread.start()
+    try:
+        server.serve_forever()
+    finally:
+        dependency_server.stop()
+        server.server_close()
+        os.remove(socket_path)
+
+
+def query_distances(changed_filenames, roots, analysis,
+                    socket_path=DEFAULT_SOCKET_PATH, timeout=60):
+    """Ask a running daemon how far the affected roots are from the changes.
+
+    Args:
+        changed_filenames: iterable: the changed files
+        roots: iterable: the files whose distance is asked
+        analysis: dict: the parameters of the analysis expected by the
+        client, as returned by describe_analysis
+
+    Returns:
+        a dict mapping each affected root to its distance to the changed
+        files, as returned by dependencies.affected_distances.
+
+    Raises:
+        socket.error: if the daemon is not running, failed or analyses the
+        sources with other parameters.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(socket_path)
+        client.sendall(json.dumps({'analysis': analysis,
+                                   'changed': sorted(changed_filenames),
+                                   'roots': sorted(roots)}) + '\n')
+        response = json.loads(client.makefile('rb').readline() or '{}')
+    except ValueError as e:
+        raise socket.error(str(e))
+    finally:
+        client.close()
+    if 'distances' not in response:
+        raise socket.error(response.get('error', 'invalid response'))
+    return dict((str(filename), distance)
+                for filename, distance in response['distances'].iteritems())
+
+
+def serve_main(argv):
+    """Start the daemon."""
+    parser = argparse.ArgumentParser(
+        prog='python -m pydependencies serve',
+        description='Keep the dependency graph of the given files or '
+                    'directories in memory and answer queries.')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH,
+                        help='path of the Unix socket')
+    parser.add_argument('--base_path', default='.',
+                        help='base path where the source is found')
+    parser.add_argument('--templates_path', default='templates',
+                        help='path of the templates folder relative to '
+                             'base_path')
+    parser.add_argument('--template_dialects', '--template-dialects',
+                        type=templates.parse_dialects,
+                        default=','.join(templates.DEFAULT_DIALECTS),
+                        help='comma separated template languages whose '
+                             'includes are followed: mako, jinja')
+    parser.add_argument('--poll', action='store_true',
+                        help='poll the filesystem instead of using inotify')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='seconds between filesystem polls')
+    parser.add_argument('paths', nargs='*')
+    options = parser.parse_args(argv)
+
+    base_path = os.path.abspath(options.base_path)
+    roots = set(os.path.abspath(filename) for filename in
+                dependencies._expand_filenames(options.paths))
+    watcher = create_watcher(base_path, poll=options.poll,
+                             interval=options.interval)
+    dependency_server = DependencyServer(
+        roots, watcher, start_path=base_path,
+        template_path=os.path.join(base_path, options.templates_path),
+        template_dialects=options.template_dialects)
+    try:
+        serve(dependency_server, socket_path=options.socket,
+              interval=options.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
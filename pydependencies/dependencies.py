@@ -18,29 +18,492 @@ when running the tests. However, that requires a non trivial effort, as the test
 runner needs to be modified in order to store the accessed filenames.
 
 """
+import argparse
+import array
 import ast
 import collections
 import fnmatch
+import multiprocessing
+import multiprocessing.pool
 import os
 import pprint
+import Queue
 import re
+import string
 import sys
+import threading
+import time
+
+import profiling
+import templates
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 
 __all__ = ('transitive_dependencies',
+           'dependency_graph',
+           'affected_by',
+           'affected_distances',
+           'update_graph',
+           'update_reachable',
+           'LazyDependencyGraph',
+           'ModuleIndex',
+           'PackageCache',
+           'DependencyGraph',
            'python_dependencies',
+           'python_test_dependencies',
            'html_dependencies')
 
 
+# Whatever may separate the name of a called function from the parenthesis:
+# whitespace, comments and line continuations.
+_CALL_GAP = r'(?:\s|\\\r?\n|#[^\n]*\n)*\('
+
+
+def _glob_to_name_regex(pattern):
+    """Return a regex matching the identifiers matched by a glob pattern.
+
+    It returns None for patterns using character sets.
+    """
+    if '[' in pattern:
+        return None
+    return ''.join(r'\w*' if c == '*' else r'\w' if c == '?' else re.escape(c)
+                   for c in pattern)
+
+
+class FunctionMatcher(object):
+    """A functions spec compiled for matching the names of called functions.
+
+    Literal patterns are looked up in a dictionary and the glob ones are
+    first checked with a single combined regex. The result for each name is
+    memoized, so after the first call of a function the cost is a dictionary
+    lookup. It is meant to be shared between visitors and files, see
+    compile_functions.
+
+    Args:
+        functions: iterable: (function_pattern, function_arg, post_processor)
+        tuples, as accepted by DependencyVisitor.
+    """
+    def __init__(self, functions):
+        self.functions = tuple(functions)
+        self._exact = collections.defaultdict(list)
+        self._globs = []
+        for index, function in enumerate(self.functions):
+            function_pattern = function[0]
+            if any(c in function_pattern for c in '*?['):
+                self._globs.append((index, function))
+            else:
+                self._exact[function_pattern].append((index, function))
+
+        name_regexes = [_glob_to_name_regex(function[0])
+                        for _, function in self._globs]
+        if None in name_regexes:
+            self._globs_re = re.compile(r'.*\Z', re.DOTALL)
+        else:
+            self._globs_re = re.compile(r'(?:%s)\Z' % '|'.join(name_regexes))
+        name_regexes.extend(re.escape(name) for name in self._exact)
+        if None in name_regexes:
+            name_regexes = [r'[A-Za-z_]\w*']
+        self.call_re = re.compile(
+            r'\b(%s)%s' % ('|'.join(name_regexes) or '(?!)', _CALL_GAP))
+        self._matches = {}
+
+    def __iter__(self):
+        return iter(self.functions)
+
+    def __len__(self):
+        return len(self.functions)
+
+    def match(self, function_name):
+        """Return the (function_arg, post_processor) of the matching functions.
+
+        They are returned in the order of the spec.
+        """
+        matches = self._matches.get(function_name)
+        if matches is None:
+            matched = list(self._exact.get(function_name, ()))
+            if self._globs and self._globs_re.match(function_name):
+                matched.extend(
+                    (index, function) for index, function in self._globs
+                    if fnmatch.fnmatch(function_name, function[0]))
+            matches = tuple(function[1:] for _, function in sorted(matched))
+            self._matches[function_name] = matches
+        return matches
+
+    def may_call(self, source):
+        """Return whether source may contain a call to any of the functions.
+
+        Names in strings or comments are false positives, which is fine.
+        """
+        for match in self.call_re.finditer(source):
+            if self.match(match.group(1)):
+                return True
+        return False
+
+
+_function_matchers = {}
+
+
+def compile_functions(functions):
+    """Return a FunctionMatcher for functions, reusing an existing one."""
+    if isinstance(functions, FunctionMatcher):
+        return functions
+    functions = tuple(functions)
+    try:
+        matcher = _function_matchers.get(functions)
+    except TypeError:
+        # The spec is not hashable, e.g. it uses lists.
+        return FunctionMatcher(functions)
+    if matcher is None:
+        matcher = _function_matchers[functions] = FunctionMatcher(functions)
+    return matcher
+
+
+# Functions of os.path folded when all their arguments are constants.
+_PATH_FUNCTIONS = {
+    'join': os.path.join,
+    'dirname': os.path.dirname,
+    'basename': os.path.basename,
+    'normpath': os.path.normpath,
+}
+
+_FORMATTER = string.Formatter()
+
+
+def _format(template, *args):
+    """Return template.format(*args) for the positional fields only.
+
+    Fields with attribute or index lookups, conversions or nested fields
+    could run arbitrary code, e.g. '{0.__class__}', so they are not folded.
+
+    Raises:
+        ValueError: if a field is not folded.
+        IndexError: if a field has no argument.
+    """
+    parts = []
+    # The fields are numbered either all automatically or all manually.
+    next_index = 0
+    numberings = set()
+    for literal, field_name, format_spec, conversion in \
+            _FORMATTER.parse(template):
+        parts.append(literal)
+        if field_name is None:
+            continue
+        if conversion or '{' in format_spec:
+            raise ValueError(field_name)
+        if field_name == '':
+            numberings.add('automatic')
+            index = next_index
+            next_index += 1
+        elif field_name.isdigit():
+            numberings.add('manual')
+            index = int(field_name)
+        else:
+            raise ValueError(field_name)
+        if len(numberings) > 1:
+            raise ValueError(field_name)
+        parts.append(format(args[index], format_spec))
+    return ''.join(parts)
+
+
+# Names bound by something else than a single assignment of a name.
+_AMBIGUOUS = object()
+
+# Python 3 only nodes: f-strings and function arguments.
+_JoinedStr = getattr(ast, 'JoinedStr', None)
+_arg = getattr(ast, 'arg', None)
+
+
+# Nodes which bind names, or whose children are in another scope.
+_BINDING_NODES = frozenset(
+    [ast.FunctionDef, ast.ClassDef, ast.Lambda, ast.Assign, ast.Global,
+     ast.Import, ast.ImportFrom] + ([_arg] if _arg is not None else []))
+
+# Nodes without descendants which may bind a name.
+_LEAF_NODES = frozenset(
+    [ast.Str, ast.Num] +
+    [node_type for base in (ast.expr_context, ast.operator, ast.cmpop,
+                            ast.unaryop, ast.boolop)
+     for node_type in base.__subclasses__()])
+
+
+def _add_children(pending, node, scope):
+    """Add the (child, scope) of the children of node to walk to pending.
+
+    It is ast.iter_child_nodes without the leaves, inlined as it is the
+    bulk of the walk of _Constants.
+    """
+    for field in node._fields:
+        value = getattr(node, field, None)
+        if type(value) is list:
+            for child in value:
+                if isinstance(child, ast.AST) and \
+                        type(child) not in _LEAF_NODES:
+                    pending.append((child, scope))
+        elif isinstance(value, ast.AST) and type(value) not in _LEAF_NODES:
+            pending.append((value, scope))
+
+
+class _Constants(object):
+    """Fold the string expressions of a module whose value is constant.
+
+    The module is walked once, when created, to find the names of every
+    scope which are bound exactly once, by an assignment. Expressions are
+    folded on demand: strings, those names, concatenations with + and %,
+    str.format, f-strings, __file__ and the os.path functions join,
+    dirname, basename and normpath.
+
+    Args:
+        module: ast.Module: the module
+        filename: str: the filename of the module, the value of __file__
+    """
+    def __init__(self, module, filename=None):
+        self.filename = filename
+        # Maps scope nodes to their enclosing scope and to the dict of their
+        # bound names, whose values are the assigned expressions.
+        self.parents = {module: None}
+        self.bindings = {module: {}}
+        self.globals = {module: set()}
+        self._values = {}
+        self._path_functions = {}
+        pending = [(child, module) for child in module.body]
+        while pending:
+            node, scope = pending.pop()
+            node_type = type(node)
+            if node_type is ast.Name:
+                if type(node.ctx) is not ast.Load:
+                    self._add_binding(scope, node.id)
+            elif node_type in _BINDING_NODES:
+                pending.extend(self._bind(node, scope))
+            else:
+                _add_children(pending, node, scope)
+
+    def _add_scope(self, node, scope):
+        self.parents[node] = scope
+        self.bindings[node] = {}
+        self.globals[node] = set()
+
+    def _add_binding(self, scope, name, value=_AMBIGUOUS):
+        bindings = self.bindings[scope]
+        bindings[name] = value if name not in bindings else _AMBIGUOUS
+
+    def _bind(self, node, scope):
+        """Record the names bound by node and return its children to walk.
+
+        node is one of _BINDING_NODES, except ast.Name.
+
+        Returns:
+            a list of (child, scope) tuples.
+        """
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            self._add_binding(scope, node.name)
+            self._add_scope(node, scope)
+            outer = list(node.decorator_list)
+            if isinstance(node, ast.FunctionDef):
+                outer.extend(node.args.defaults)
+                for name in (node.args.vararg, node.args.kwarg):
+                    if name is not None:
+                        # Python 3 has ast.arg nodes instead of names.
+                        self._add_binding(node, getattr(name, 'arg', name))
+                inner = (list(node.args.args) +
+                         getattr(node.args, 'kwonlyargs', []) + node.body)
+            else:
+                outer.extend(node.bases)
+                inner = node.body
+            return ([(child, scope) for child in outer] +
+                    [(child, node) for child in inner])
+        if isinstance(node, ast.Lambda):
+            self._add_scope(node, scope)
+            return ([(child, scope) for child in node.args.defaults] +
+                    [(child, node) for child in node.args.args] +
+                    [(node.body, node)])
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and \
+                isinstance(node.targets[0], ast.Name):
+            self._add_binding(scope, node.targets[0].id, node.value)
+            return [(node.value, scope)]
+        if isinstance(node, ast.Global):
+            self.globals[scope].update(node.names)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            module = getattr(node, 'module', None)
+            for alias in node.names:
+                name = alias.asname or alias.name.split('.')[0]
+                self._add_binding(scope, name)
+                if module in ('os.path', 'posixpath') and \
+                        alias.name in _PATH_FUNCTIONS:
+                    self._path_functions[name] = alias.name
+        elif _arg is not None and isinstance(node, _arg):
+            self._add_binding(scope, node.arg)
+        children = []
+        _add_children(children, node, scope)
+        return children
+
+    def _lookup(self, name, scope):
+        """Return the scope where name is bound as seen from scope."""
+        current = scope
+        while current is not None:
+            if name in self.globals[current]:
+                current = self._module(current)
+            if name in self.bindings[current]:
+                return current
+            current = self.parents[current]
+            # The names of a class are not visible from its methods.
+            while isinstance(current, ast.ClassDef):
+                current = self.parents[current]
+        return None
+
+    def _module(self, scope):
+        while self.parents[scope] is not None:
+            scope = self.parents[scope]
+        return scope
+
+    def _name_value(self, name, scope):
+        """Return the constant value of a name seen from scope or None."""
+        if name == '__file__':
+            return self.filename
+        scope = self._lookup(name, scope)
+        if scope is None:
+            return None
+        key = (scope, name)
+        if key in self._values:
+            return self._values[key]
+        # Marks the name as being folded, so cycles fold to None.
+        self._values[key] = None
+        expression = self.bindings[scope][name]
+        if expression is not _AMBIGUOUS:
+            self._values[key] = self.fold(expression, scope)
+        return self._values[key]
+
+    def _is_path_module(self, node):
+        """Return whether node is os.path, or path imported from os."""
+        if isinstance(node, ast.Attribute):
+            return (node.attr == 'path' and isinstance(node.value, ast.Name)
+                    and node.value.id == 'os')
+        return isinstance(node, ast.Name) and node.id in ('path', 'posixpath')
+
+    def _fold_call(self, node, scope):
+        if node.keywords or getattr(node, 'starargs', None) or \
+                getattr(node, 'kwargs', None):
+            return None
+        func = node.func
+        function = None
+        if isinstance(func, ast.Attribute):
+            if func.attr in _PATH_FUNCTIONS and \
+                    self._is_path_module(func.value):
+                function = _PATH_FUNCTIONS[func.attr]
+            elif func.attr == 'format':
+                template = self.fold(func.value, scope)
+                if template is not None:
+                    function = lambda *args: _format(template, *args)
+        elif isinstance(func, ast.Name) and func.id in self._path_functions:
+            function = _PATH_FUNCTIONS[self._path_functions[func.id]]
+        if function is None:
+            return None
+        args = [self.fold(arg, scope) for arg in node.args]
+        if None in args:
+            return None
+        try:
+            return function(*args)
+        except (TypeError, ValueError, IndexError, KeyError, AttributeError):
+            return None
+
+    def fold(self, node, scope):
+        """Return the value of the expression node in scope or None."""
+        if isinstance(node, ast.Str):
+            return node.s
+        if isinstance(node, ast.Name):
+            return self._name_value(node.id, scope)
+        if isinstance(node, ast.BinOp):
+            left = self.fold(node.left, scope)
+            if left is None:
+                return None
+            if isinstance(node.op, ast.Add):
+                right = self.fold(node.right, scope)
+                return left + right if right is not None else None
+            if isinstance(node.op, ast.Mod):
+                if isinstance(node.right, ast.Tuple):
+                    right = tuple(self.fold(element, scope)
+                                  for element in node.right.elts)
+                    if None in right:
+                        return None
+                else:
+                    right = self.fold(node.right, scope)
+                    if right is None:
+                        return None
+                try:
+                    return left % right
+                except (TypeError, ValueError, KeyError):
+                    return None
+            return None
+        if isinstance(node, ast.Call):
+            return self._fold_call(node, scope)
+        if _JoinedStr is not None and isinstance(node, _JoinedStr):
+            parts = []
+            for value in node.values:
+                if isinstance(value, ast.FormattedValue):
+                    if value.conversion not in (None, -1) or \
+                            value.format_spec is not None:
+                        return None
+                    value = value.value
+                part = self.fold(value, scope)
+                if part is None:
+                    return None
+                parts.append(part)
+            return ''.join(parts)
+        return None
+
+
 class DependencyVisitor(ast.NodeVisitor):
-    """Record the imports and call data from functions."""
-    def __init__(self, functions=[]):
+    """Record the imports and call data from functions.
+
+    The filename arguments may be string constants, see _Constants, which
+    are folded with the module being visited. It is set when visiting an
+    ast.Module, or can be set before visiting some of its nodes.
+    """
+    def __init__(self, functions=[], filename=None):
         super(DependencyVisitor, self).__init__()
-        self.functions = functions
+        self.functions = compile_functions(functions)
         self.modules = []
         self.filenames = []
         # In Python 3 absolute import is enabled by default
-        self.absolute_import = sys.version_info == 3
+        self.absolute_import = sys.version_info[0] >= 3
+        self.filename = filename
+        self.module = None
+        # The innermost function, class or lambda being visited.
+        self._scope = None
+        # Only built when a filename argument is not a string literal.
+        self._constants = None
+
+    def visit_Module(self, node):
+        self.module = node
+        self._scope = node
+        self.generic_visit(node)
+
+    def _visit_scope(self, node):
+        scope = self._scope
+        self._scope = node
+        self.generic_visit(node)
+        self._scope = scope
+
+    visit_FunctionDef = visit_ClassDef = visit_Lambda = _visit_scope
+
+    def _constant(self, node):
+        """Return the value of a string constant expression or None."""
+        if isinstance(node, ast.Str):
+            return node.s
+        if self.module is None:
+            return None
+        if self._constants is None:
+            self._constants = _Constants(self.module, self.filename)
+        scope = self._scope
+        if scope not in self._constants.parents:
+            scope = self.module
+        return self._constants.fold(node, scope)
 
     #def generic_visit(self, node):
     #    print type(node).__name__
@@ -49,8 +512,8 @@ class DependencyVisitor(ast.NodeVisitor):
     def _extract_filename(self, function_name, args, keywords):
         """Extract a filename from a function call.
 
-        It can only extract a filename if the argument is explicitly defined,
-        that is if must be of type ast.Str.
+        It can only extract a filename if the argument is a constant, that is
+        a string literal or an expression folded by _Constants.
 
         Args:
             function_name: str: the name of the current function
@@ -60,24 +523,31 @@ class DependencyVisitor(ast.NodeVisitor):
         Returns:
             the extracted filename
         """
-        keywords = dict((k.arg, k.value) for k in keywords)
-        for function_pattern, function_arg, post_processor in self.functions:
-            if fnmatch.fnmatch(function_name, function_pattern):
-                arg = None
-                if isinstance(function_arg, basestring):
-                    arg = keywords.get(function_arg)
-                elif function_arg < len(args):
-                    arg = args[function_arg]
-                if isinstance(arg, ast.Str):
-                    if post_processor:
-                        return post_processor(arg.s)
-                    else:
-                        return arg.s
+        keywords_by_name = None
+        for function_arg, post_processor in self.functions.match(
+                function_name):
+            arg = None
+            if isinstance(function_arg, basestring):
+                if keywords_by_name is None:
+                    keywords_by_name = dict((k.arg, k.value) for k in keywords)
+                arg = keywords_by_name.get(function_arg)
+            elif function_arg < len(args):
+                arg = args[function_arg]
+            value = self._constant(arg) if arg is not None else None
+            if value is not None:
+                if post_processor:
+                    return post_processor(value)
+                else:
+                    return value
 
         return None
 
     def visit_Call(self, node):
-        """Process a call and extract the filenames if any."""
+        """Process a call and extract the filenames if any.
+
+        The function and the arguments are visited too, as they may contain
+        calls themselves.
+        """
         func = node.func
         func_name = None
         if isinstance(func, ast.Name):
@@ -86,12 +556,12 @@ class DependencyVisitor(ast.NodeVisitor):
             #print func.value, func.attr, func.ctx
             func_name = func.attr
 
-        if func_name is None:
-            return
-
-        filename = self._extract_filename(func_name, node.args, node.keywords)
-        if filename:
-            self.filenames.append(filename)
+        if func_name is not None:
+            filename = self._extract_filename(func_name, node.args,
+                                              node.keywords)
+            if filename:
+                self.filenames.append(filename)
+        self.generic_visit(node)
 
     def visit_Import(self, node):
         """Process a regular import and store the name."""
@@ -109,83 +579,683 @@ class DependencyVisitor(ast.NodeVisitor):
         So to be safe, we always add all names as submodules. In the example
         above, we would add both 'foo' and 'foo.bar' to the list.
 
+        Relative imports keep their leading dots, e.g. from ..foo import bar
+        adds '..foo' and '..foo.bar', and are resolved later against the
+        directory of the file.
+
         It also, sets the absolute_import value if it detects the statement:
             from __future__ import absolute_import
         """
-        module = node.module
+        module = _from_import_module(node)
         names = [alias.name for alias in node.names]
-        modules = [module] + ['%s.%s' % (module, name) for name in names]
+        modules = [module] + [_submodule(module, name) for name in names]
         if module == '__future__' and 'absolute_import' in names:
             self.absolute_import = True
         self.modules.extend(modules)
 
 
+def _from_import_module(node):
+    """Return the module of a from import, with the dots of its level."""
+    return '.' * (node.level or 0) + (node.module or '')
+
+
+def _submodule(module, name):
+    """Return the name of a submodule, module may be relative as '..'."""
+    if module.endswith('.'):
+        return module + name
+    return '%s.%s' % (module, name)
+
+
+def _split_relative(module):
+    """Return the level and the name of a possibly relative module."""
+    name = module.lstrip('.')
+    return len(module) - len(name), name
+
+
 def _extend_with_submodules(modules):
-    """Return a set including all the submodules of the given modules."""
+    """Return a set including all the submodules of the given modules.
+
+    The submodules of a relative module include the package it is relative
+    to, e.g. '..' for '..foo.bar', as importing it runs its __init__.py.
+    """
     all_modules = set()
     for module in modules:
-        parts = module.split('.')
+        level, name = _split_relative(module)
+        prefix = '.' * level
+        if prefix:
+            all_modules.add(prefix)
+        if not name:
+            continue
+        parts = name.split('.')
         for i in xrange(1, len(parts) + 1):
-            submodule = '.'.join(parts[:i])
+            submodule = prefix + '.'.join(parts[:i])
             all_modules.add(submodule)
 
     return all_modules
 
 
-def _get_modules_filenames(modules, start_path='.'):
+class ModuleIndex(object):
+    """Map dotted module names to their files.
+
+    The search roots are walked once, so resolving a module does not need to
+    touch the filesystem. Roots take precedence in the given order, as in
+    sys.path, and inside a root a module file takes precedence over a package
+    with the same name.
+
+    Args:
+        roots: list or str: the paths where to search the modules
+    """
+    def __init__(self, roots=('.',)):
+        if isinstance(roots, basestring):
+            roots = [roots]
+        self.roots = list(roots)
+        self._modules = {}
+        for root in self.roots:
+            for module, filename in self._walk(root).iteritems():
+                self._modules.setdefault(module, filename)
+
+    @staticmethod
+    def _walk(root):
+        """Return a dictionary with the modules found under root."""
+        packages = {}
+        modules = {}
+        visited = set()
+        pending = [(root, ())]
+        while pending:
+            directory, parts = pending.pop()
+            real_directory = os.path.realpath(directory)
+            if real_directory in visited:
+                continue
+            visited.add(real_directory)
+            for name, path, is_dir in _list_directory(directory):
+                if is_dir:
+                    if '.' not in name:
+                        pending.append((path, parts + (name,)))
+                elif name == '__init__.py':
+                    if parts:
+                        packages['.'.join(parts)] = path
+                elif name.endswith('.py') and '.' not in name[:-3]:
+                    modules['.'.join(parts + (name[:-3],))] = path
+        packages.update(modules)
+        return packages
+
+    def __contains__(self, module):
+        return module in self._modules
+
+    def get(self, module):
+        """Return the file of the given module or None if not found."""
+        return self._modules.get(module)
+
+
+def _list_directory(directory):
+    """Return a list of (name, path, is_dir) tuples with the directory entries.
+
+    It uses scandir when available to avoid a stat call per entry.
+    """
+    try:
+        if scandir is not None:
+            return [(entry.name, entry.path, entry.is_dir())
+                    for entry in scandir(directory)]
+        entries = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            entries.append((name, path, os.path.isdir(path)))
+        return entries
+    except OSError:
+        return []
+
+
+class PackageCache(object):
+    """Memoize the content of the package directories.
+
+    Each directory is listed once, the first time a module is resolved in it,
+    so the files of a package, and all the files importing from it, share
+    the listing instead of probing the filesystem for every import.
+
+    Directories without __init__.py are namespace packages (PEP 420): their
+    modules are found, but they have no file of their own.
+    """
+    def __init__(self):
+        self._listings = {}
+
+    def __len__(self):
+        """Return the number of directories listed."""
+        return len(self._listings)
+
+    def _listing(self, directory):
+        """Return the modules and subdirectories of directory as dicts."""
+        listing = self._listings.get(directory)
+        if listing is None:
+            modules = {}
+            directories = {}
+            for name, _, is_dir in _list_directory(directory or os.curdir):
+                path = os.path.join(directory, name)
+                if is_dir:
+                    if '.' not in name:
+                        directories[name] = path
+                elif name.endswith('.py') and '.' not in name[:-3]:
+                    modules[name[:-3]] = path
+            listing = self._listings[directory] = (modules, directories)
+        return listing
+
+    def is_package(self, directory):
+        """Return whether directory is a regular package."""
+        return '__init__' in self._listing(directory)[0]
+
+    def resolve(self, directory, module):
+        """Return the file of a module relative to directory or None.
+
+        As in _get_modules_filenames a module file takes precedence over a
+        package with the same name, and an empty module is the package of
+        directory itself.
+        """
+        parts = module.split('.') if module else []
+        for part in parts[:-1]:
+            directory = self._listing(directory)[1].get(part)
+            if directory is None:
+                return None
+        if not parts:
+            return self._listing(directory)[0].get('__init__')
+        modules, directories = self._listing(directory)
+        filename = modules.get(parts[-1])
+        if filename is None and parts[-1] in directories:
+            filename = self._listing(directories[parts[-1]])[0].get(
+                '__init__')
+        return filename
+
+
+def _resolve_relative(modules, filename, package_cache):
+    """Return the files of the relative modules imported by filename.
+
+    Args:
+        modules: list: the relative modules, as '.foo' or '..'
+        filename: str: the file importing them
+        package_cache: PackageCache: where the packages are looked up
+
+    Returns:
+        list of the filepaths of the modules found.
+    """
+    filenames = []
+    for module in modules:
+        level, name = _split_relative(module)
+        directory = os.path.dirname(filename)
+        for _ in xrange(level - 1):
+            directory = os.path.dirname(directory)
+        module_filename = package_cache.resolve(directory, name)
+        if module_filename:
+            filenames.append(module_filename)
+    return filenames
+
+
+def _get_modules_filenames(modules, start_path='.', module_index=None,
+                           profile=profiling.NULL_PROFILE, importer=None,
+                           package_cache=None, absolute_import=True):
     """Convert modules to file paths, skipping not found ones.
 
     Args:
         modules: list: modules to find
         start_path: str: path where to search the modules
+        module_index: ModuleIndex: if given the modules are resolved with it
+        instead of searching them in start_path
+        profile: profiling.Profile: counts the stat calls
+        importer: str: the file importing the modules. It is needed to
+        resolve the relative modules, which are skipped otherwise.
+        package_cache: PackageCache: if given the packages listed are shared
+        with other calls, and the modules not in module_index are resolved
+        with it too
+        absolute_import: bool: if False, and importer is in a package, the
+        absolute modules are searched first in that package, as Python 2
+        does for implicit relative imports
 
     Returns:
         list of filepaths representing the given modules. No error or warning
         is raised in case of non found modules.
     """
+    relative_modules = [module for module in modules
+                        if module.startswith('.')]
+    modules = [module for module in modules if not module.startswith('.')]
     filenames = []
+    if importer is not None and (relative_modules or not absolute_import):
+        cache = package_cache if package_cache is not None else PackageCache()
+        listed = len(cache)
+        filenames.extend(_resolve_relative(relative_modules, importer, cache))
+        directory = os.path.dirname(importer)
+        if not absolute_import and cache.is_package(directory):
+            absolute_modules = []
+            for module in modules:
+                module_filename = cache.resolve(directory, module)
+                if module_filename:
+                    filenames.append(module_filename)
+                else:
+                    absolute_modules.append(module)
+            modules = absolute_modules
+        profile.count('stat_calls', len(cache) - listed)
+
+    if module_index is not None:
+        filenames.extend(filename for filename in map(module_index.get,
+                                                      modules)
+                         if filename)
+        return filenames
+
+    if package_cache is not None:
+        listed = len(package_cache)
+        filenames.extend(filename for filename in
+                         (package_cache.resolve(start_path, module)
+                          for module in modules)
+                         if filename)
+        profile.count('stat_calls', len(package_cache) - listed)
+        return filenames
+
+    stat_calls = 0
     for module in modules:
         module_path = module.replace('.', os.sep)
         expected_path = os.path.join(start_path, module_path + '.py')
+        stat_calls += 1
         if os.path.exists(expected_path):
             filenames.append(expected_path)
             continue
         # Check if module is a package
         expected_path = os.path.join(start_path, module_path, '__init__.py')
+        stat_calls += 1
         if os.path.exists(expected_path):
             filenames.append(expected_path)
 
+    profile.count('stat_calls', stat_calls)
     return filenames
 
+
+def _strongly_connected_components(adjacency):
+    """Return the strongly connected components of an integer graph.
+
+    It is an iterative version of Tarjan's algorithm, so deep import chains do
+    not hit the recursion limit.
+
+    Args:
+        adjacency: list: adjacency[i] is the list of nodes linked from node i.
+
+    Returns:
+        a list of components, each one a list of nodes. The components are in
+        reverse topological order, i.e. a component only links to components
+        which appear before it.
+    """
+    size = len(adjacency)
+    index = [-1] * size
+    lowlink = [0] * size
+    on_stack = [False] * size
+    stack = []
+    components = []
+    counter = 0
+    for root in xrange(size):
+        if index[root] != -1:
+            continue
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, 0)]
+        while work:
+            node, position = work[-1]
+            successors = adjacency[node]
+            if position < len(successors):
+                work[-1] = (node, position + 1)
+                successor = successors[position]
+                if index[successor] == -1:
+                    index[successor] = lowlink[successor] = counter
+                    counter += 1
+                    stack.append(successor)
+                    on_stack[successor] = True
+                    work.append((successor, 0))
+                elif on_stack[successor] and index[successor] < lowlink[node]:
+                    lowlink[node] = index[successor]
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                if lowlink[node] < lowlink[parent]:
+                    lowlink[parent] = lowlink[node]
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+
+    return components
+
+
+def _iter_bits(bitset):
+    """Yield the position of the bits set in the given integer."""
+    bits = bin(bitset)[:1:-1]
+    position = bits.find('1')
+    while position != -1:
+        yield position
+        position = bits.find('1', position + 1)
+
+
+class ReachabilityMap(collections.Mapping):
+    """Read-only mapping from a node to the set of nodes reachable from it.
+
+    The reachable nodes are stored as integer bitsets indexed by node id. All
+    the nodes of a strongly connected component share the same integer. The
+    sets are only built when a node is looked up.
+    """
+    def __init__(self, nodes, node_ids, closures):
+        self._nodes = nodes
+        self._node_ids = node_ids
+        # closures[i] is None for the ids of nodes which were removed by
+        # update_reachable.
+        self._closures = closures
+        self._len = sum(1 for closure in closures if closure is not None)
+
+    def __getitem__(self, node):
+        return set(self._nodes[i] for i in _iter_bits(self.bitset(node)))
+
+    def __contains__(self, node):
+        node_id = self._node_ids.get(node)
+        return node_id is not None and self._closures[node_id] is not None
+
+    def __iter__(self):
+        return (self._nodes[i] for i, closure in enumerate(self._closures)
+                if closure is not None)
+
+    def __len__(self):
+        return self._len
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def bitset(self, node):
+        """Return the reachable nodes of node as an integer bitset."""
+        node_id = self._node_ids.get(node)
+        closure = None if node_id is None else self._closures[node_id]
+        if closure is None:
+            raise KeyError(node)
+        return closure
+
+    def mask(self, nodes):
+        """Return the bitset of the given nodes, ignoring unknown ones."""
+        mask = 0
+        for node in nodes:
+            node_id = self._node_ids.get(node)
+            if node_id is not None:
+                mask |= 1 << node_id
+        return mask
+
+    def reaches_any(self, node, nodes):
+        """Return whether any of the given nodes is reachable from node."""
+        return bool(self.bitset(node) & self.mask(nodes))
+
+
+def _fill_closures(node_ids, adjacency, closures):
+    """Compute the closure bitsets of the given node ids.
+
+    Args:
+        node_ids: list: the ids of the nodes whose closure is computed
+        adjacency: list or dict: adjacency[i] is the list of ids linked from i
+        closures: list: closures[i] is the bitset of the nodes reachable from
+        i. The ones of nodes linked from node_ids which are not in node_ids
+        must already be set. The ones of node_ids are set by this function.
+    """
+    local_ids = dict((node_id, i) for i, node_id in enumerate(node_ids))
+    local_adjacency = [
+        [local_ids[successor] for successor in adjacency[node_id]
+         if successor in local_ids]
+        for node_id in node_ids]
+
+    # Components are visited in reverse topological order, so any other
+    # linked component has already been computed.
+    for component in _strongly_connected_components(local_adjacency):
+        members = [node_ids[i] for i in component]
+        closure = 0
+        for member in members:
+            closure |= 1 << member
+            # Placeholder for links inside the component.
+            closures[member] = 0
+        for member in members:
+            for successor in adjacency[member]:
+                closure |= closures[successor]
+        for member in members:
+            closures[member] = closure
+
+
+def _graph_nodes(graph):
+    """Return the set of nodes of graph, including the linked only ones."""
+    return set(graph).union(*graph.values())
+
+
 def _reachable(graph):
     """Return a dictionary with all reachable nodes from the graph nodes.
 
+    The strongly connected components are condensed first, and then the
+    reachable nodes are computed once per component in reverse topological
+    order, reusing the result of the components it links to.
+
     Args:
         graph: dict: dictionary representing a graph. Keys are the nodes
-        and values is a set containing the linked nodes.
+        and values is a set containing the linked nodes. Linked nodes which
+        are not keys are considered to have no links.
 
     Returns:
-        a new dictionary with the same keys, but whose values are all the
+        a ReachabilityMap with the same nodes, but whose values are all the
         reachable nodes from the current one.
     """
-    reachable = {}
-    for node in graph:
-        reachable[node] = set(graph[node])
-        # Add ourselves in case we were not already there.
-        reachable[node].add(node)
-        latest_nodes = reachable[node]
-        while latest_nodes:
-            new_nodes = set()
-            for n in latest_nodes:
-                new_nodes.update(graph[n])
-            new_nodes -= reachable[node]
-            reachable[node].update(new_nodes)
-            latest_nodes = new_nodes
+    nodes = list(_graph_nodes(graph))
+    node_ids = dict((node, i) for i, node in enumerate(nodes))
+    adjacency = [[node_ids[successor] for successor in graph.get(node, ())]
+                 for node in nodes]
+    closures = [None] * len(nodes)
+    _fill_closures(range(len(nodes)), adjacency, closures)
+
+    return ReachabilityMap(nodes, node_ids, closures)
+
+
+class GraphNode(object):
+    """A node of a DependencyGraph: its integer id and a reference to it."""
+    __slots__ = ('graph', 'id')
+
+    def __init__(self, graph, node_id):
+        self.graph = graph
+        self.id = node_id
+
+    def __eq__(self, other):
+        return (isinstance(other, GraphNode) and self.graph is other.graph and
+                self.id == other.id)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self.id
+
+    def __repr__(self):
+        return 'GraphNode(%r)' % self.path
+
+    @property
+    def path(self):
+        return self.graph.paths[self.id]
+
+    @property
+    def dependencies(self):
+        """The GraphNode of each direct dependency."""
+        return [GraphNode(self.graph, successor)
+                for successor in self.graph.successors(self.id)]
+
+
+class DependencyGraph(collections.Mapping):
+    """Compact read-only direct dependencies graph.
+
+    Paths are interned and numbered, and the edges are stored in CSR form: the
+    successors of node i are targets[offsets[i]:offsets[i + 1]]. It is a
+    mapping from each node to the set of its direct dependencies, like the
+    dictionaries returned by dependency_graph, but the sets are only built
+    when a node is looked up. Linked only nodes are nodes without links.
+
+    Args:
+        graph: dict: the direct dependencies, as returned by dependency_graph
+    """
+    def __init__(self, graph):
+        self.paths = sorted(intern(path) if type(path) is str else path
+                            for path in _graph_nodes(graph))
+        self._ids = dict((path, i) for i, path in enumerate(self.paths))
+        self._offsets = array.array('I', [0])
+        self._targets = array.array('I')
+        for path in self.paths:
+            self._targets.extend(
+                sorted(self._ids[successor]
+                       for successor in graph.get(path, ())))
+            self._offsets.append(len(self._targets))
+
+    def __getitem__(self, path):
+        return set(self.paths[successor]
+                   for successor in self.successors(self._ids[path]))
 
-    return reachable
+    def __contains__(self, path):
+        return path in self._ids
 
+    def __iter__(self):
+        return iter(self.paths)
 
-def python_dependencies(filename, start_path='.', functions=()):
+    def __len__(self):
+        return len(self.paths)
+
+    def node(self, path):
+        """Return the GraphNode of path."""
+        return GraphNode(self, self._ids[path])
+
+    def successors(self, node_id):
+        """Return the ids of the direct dependencies of a node id."""
+        return self._targets[self._offsets[node_id]:self._offsets[node_id + 1]]
+
+    def closure(self):
+        """Return the transitive closure as a ReachabilityMap.
+
+        The path table is shared with the map.
+        """
+        closures = [None] * len(self.paths)
+        _fill_closures(xrange(len(self.paths)), _CSRAdjacency(self),
+                       closures)
+        return ReachabilityMap(self.paths, self._ids, closures)
+
+
+class _CSRAdjacency(object):
+    """Adjacency list view of a DependencyGraph, as used by _fill_closures."""
+    __slots__ = ('graph',)
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __getitem__(self, node_id):
+        return self.graph.successors(node_id)
+
+
+def update_reachable(reachable, old_graph, graph):
+    """Return the closure of graph reusing the closure of a previous version.
+
+    Only the nodes which reach a node whose links changed are computed again,
+    the closure of the others is shared with reachable.
+
+    Args:
+        reachable: ReachabilityMap: the closure of old_graph
+        old_graph: dict: the previous version of the graph
+        graph: dict: the current graph
+
+    Returns:
+        a ReachabilityMap equal to _reachable(graph).
+    """
+    all_nodes = _graph_nodes(graph)
+    changed_nodes = set(
+        node for node in all_nodes
+        if node not in reachable or
+        set(old_graph.get(node, ())) != set(graph.get(node, ())))
+
+    nodes = list(reachable._nodes)
+    node_ids = dict(reachable._node_ids)
+    closures = list(reachable._closures)
+    for node in reachable:
+        if node not in all_nodes:
+            closures[node_ids[node]] = None
+    for node in changed_nodes:
+        if node not in node_ids:
+            node_ids[node] = len(nodes)
+            nodes.append(node)
+            closures.append(None)
+
+    dirty_ids = [node_ids[node]
+                 for node in _reverse_reachable(graph, changed_nodes)]
+    adjacency = dict(
+        (node_id, [node_ids[successor]
+                   for successor in graph.get(nodes[node_id], ())])
+        for node_id in dirty_ids)
+    _fill_closures(dirty_ids, adjacency, closures)
+
+    return ReachabilityMap(nodes, node_ids, closures)
+
+
+def _may_call(source, functions):
+    """Return whether source may contain a call to any of the functions."""
+    return bool(functions) and compile_functions(functions).may_call(source)
+
+
+# Splits Python source in string literals, comments, code and import
+# statements. Import statements must start a statement, i.e. come after a
+# newline, a semicolon or the colon of a compound statement. Keywords can not
+# appear after those inside brackets, and strings are consumed whole, so this
+# does not match false import statements.
+_IMPORT_SCAN_RE = re.compile(r"""
+    (?:[^'"\#\n;:\\]|\\.)+
+  | '''(?:[^'\\]|\\.|'(?!''))*'''
+  | \"\"\"(?:[^"\\]|\\.|"(?!""))*\"\"\"
+  | '(?:[^'\\\n]|\\.)*'
+  | "(?:[^"\\\n]|\\.)*"
+  | \#[^\n]*
+  | [\n;:][ \t]*(?P<import>
+        import\b(?:[^\n;\#\\]|\\.)*
+      | from\b(?:[^\n;\#\\(]|\\.)*(?:\([^)]*\))?)
+  | .
+""", re.VERBOSE | re.DOTALL)
+
+
+def _import_statements(source):
+    """Return the source of the import statements found in source."""
+    statements = []
+    for match in _IMPORT_SCAN_RE.finditer('\n' + source):
+        statement = match.group('import')
+        if statement:
+            statements.append(statement.strip())
+    return statements
+
+
+def _scan(source, filename, functions):
+    """Return a DependencyVisitor which visited the given source.
+
+    The full AST is only visited when the source may call one of the
+    functions or when the import statements can not be parsed on their own.
+    Otherwise only the import statements are parsed, and the source is not
+    parsed at all if it does not contain an import. Note that in those cases
+    syntax errors elsewhere in the source are not reported.
+    """
+    visitor = DependencyVisitor(functions=functions, filename=filename)
+    if _may_call(source, functions):
+        visitor.visit(ast.parse(source, filename))
+        return visitor
+    if 'import' not in source:
+        return visitor
+
+    try:
+        tree = ast.parse('\n'.join(_import_statements(source)), filename)
+    except SyntaxError:
+        tree = ast.parse(source, filename)
+    visitor.visit(tree)
+    return visitor
+
+
+def python_dependencies(filename, start_path='.', functions=(),
+                        module_index=None, profile=profiling.NULL_PROFILE,
+                        package_cache=None, source=None):
     """Return the direct dependencies of a python file.
 
     It extracts the Python dependencies from the import statements. Non Python
@@ -197,13 +1267,22 @@ def python_dependencies(filename, start_path='.', functions=()):
         start_path: str: path from where we should start searching for
         dependencies
         functions: tuple: functions to check when parsing the Python file.
+        module_index: ModuleIndex: if given the imported modules are resolved
+        with it instead of searching them in start_path
+        profile: profiling.Profile: records the time reading, parsing and
+        resolving the modules
+        package_cache: PackageCache: if given the packages listed to resolve
+        the imports are shared with other calls
+        source: str: the content of the file, if it was already read
 
     Returns:
         a set with all direct dependencies, including Python and plain files.
     """
-    with open(filename) as f:
-        node = ast.parse(f.read(), filename)
-    visitor = DependencyVisitor(functions=functions)
+    if source is None:
+        with profile.phase('read'):
+            source = _read_source(filename)
+    with profile.phase('parse'):
+        visitor = _scan(source, filename, functions)
         #functions=[
             #('open', 0, None),
             #('render', 0, lambda x: os.path.join('./templates', x.strip('/'))),
@@ -217,64 +1296,884 @@ def python_dependencies(filename, start_path='.', functions=()):
             #('DictReader', 0, None),
             #('DictWriter', 0, None),
         #])
-    visitor.visit(node)
 
-    modules = visitor.modules
-    modules = _extend_with_submodules(modules)
-    modules_filenames = _get_modules_filenames(modules, start_path=start_path)
+    with profile.phase('resolve'):
+        modules = visitor.modules
+        modules = _extend_with_submodules(modules)
+        modules_filenames = _get_modules_filenames(
+            modules, start_path=start_path, module_index=module_index,
+            profile=profile, importer=filename, package_cache=package_cache,
+            absolute_import=visitor.absolute_import)
+    profile.count('python_files')
 
     return set(visitor.filenames + modules_filenames)
 
 
-HTML_INCLUDE_RE = re.compile(r'file="([^"]+)"')
+def _imported_names(node, imported):
+    """Add the names bound by an import statement to imported.
+
+    Args:
+        node: ast.Import or ast.ImportFrom: the import statement
+        imported: dict: maps each name to the list of modules it may refer to
+
+    Returns:
+        the modules imported with a star import, whose names are unknown.
+    """
+    if isinstance(node, ast.Import):
+        for alias in node.names:
+            name = alias.asname or alias.name.split('.')[0]
+            imported[name].append(alias.name)
+        return []
+    module = _from_import_module(node)
+    if any(alias.name == '*' for alias in node.names):
+        return [module]
+    for alias in node.names:
+        imported[alias.asname or alias.name].extend(
+            [module, _submodule(module, alias.name)])
+    return []
+
+
+def _referenced_names(node):
+    """Return the names used in node.
+
+    Strings are included, as fixtures may be requested by name, e.g. with
+    pytest.mark.usefixtures.
+    """
+    names = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name):
+            names.add(child.id)
+        elif isinstance(child, ast.Str) and isinstance(child.s, basestring):
+            names.add(child.s)
+    return names
+
+
+def _is_autouse_fixture(node):
+    """Return whether a definition is decorated as an autouse fixture."""
+    return any(isinstance(decorator, ast.Call) and
+               any(keyword.arg == 'autouse' for keyword in decorator.keywords)
+               for decorator in node.decorator_list)
+
 
+def python_test_dependencies(filename, start_path='.', functions=(),
+                             module_index=None, package_cache=None):
+    """Return the direct dependencies of each test of a Python test file.
 
-def html_dependencies(filename, template_path='./templates'):
+    Each top level function or class only depends on the imported names it
+    references, directly or through the top level functions and classes it
+    references or requests as fixtures, and on the autouse fixtures. The
+    remaining top level statements, and the imports not referenced by any
+    definition, are shared by all the tests, as they run on import.
+
+    Args:
+        filename: str: the filename of the test file
+        start_path: str: path from where we should start searching for
+        dependencies
+        functions: tuple: functions to check when parsing the Python file.
+        module_index: ModuleIndex: if given the imported modules are resolved
+        with it instead of searching them in start_path
+        package_cache: PackageCache: if given the packages listed to resolve
+        the imports are shared with other calls
+
+    Returns:
+        a dict mapping the name of each top level definition to its direct
+        dependencies. The dependencies shared by all tests are under None.
+
+    Raises:
+        IOError: if the test file can not be read.
+        SyntaxError: if the test file can not be parsed.
+    """
+    with open(filename) as f:
+        source = f.read()
+    if '\0' in source:
+        raise SyntaxError('source code string cannot contain null bytes',
+                          (filename, None, None, None))
+    tree = ast.parse(source, filename)
+
+    if package_cache is None:
+        package_cache = PackageCache()
+    future = DependencyVisitor()
+    imported = collections.defaultdict(list)
+    definitions = {}
+    shared_statements = []
+    shared_modules = []
+    autouse = set()
+    for statement in tree.body:
+        if isinstance(statement, ast.ImportFrom):
+            future.visit(statement)
+        if isinstance(statement, (ast.FunctionDef, ast.ClassDef)):
+            definitions[statement.name] = statement
+            if _is_autouse_fixture(statement):
+                autouse.add(statement.name)
+            continue
+        if not isinstance(statement, (ast.Import, ast.ImportFrom)):
+            shared_statements.append(statement)
+        for child in ast.walk(statement):
+            if isinstance(child, (ast.Import, ast.ImportFrom)):
+                shared_modules.extend(_imported_names(child, imported))
+
+    def direct_dependencies(nodes, names, modules):
+        visitor = DependencyVisitor(functions=functions, filename=filename)
+        visitor.module = tree
+        for node in nodes:
+            visitor.visit(node)
+        modules = list(modules) + visitor.modules
+        for name in names:
+            modules.extend(imported.get(name, ()))
+        modules_filenames = _get_modules_filenames(
+            _extend_with_submodules(modules), start_path=start_path,
+            module_index=module_index, importer=filename,
+            package_cache=package_cache,
+            absolute_import=future.absolute_import)
+        return set(visitor.filenames + modules_filenames)
+
+    names = dict((name, _referenced_names(node))
+                 for name, node in definitions.iteritems())
+    shared_names = set()
+    for statement in shared_statements:
+        shared_names.update(_referenced_names(statement))
+    used_names = shared_names.union(*names.values())
+    shared_names.update(name for name in imported if name not in used_names)
+
+    dependencies = {}
+    for name, node in definitions.iteritems():
+        dependencies[name] = direct_dependencies([node], names[name], ())
+    dependencies[None] = direct_dependencies(shared_statements, shared_names,
+                                             shared_modules)
+
+    def closure(initial_names):
+        """Return the definitions reachable from initial_names."""
+        reached = set()
+        pending = [name for name in initial_names if name in definitions]
+        while pending:
+            name = pending.pop()
+            if name not in reached:
+                reached.add(name)
+                pending.extend(referenced for referenced in names[name]
+                               if referenced in definitions)
+        return reached
+
+    test_dependencies = {}
+    for name in definitions:
+        test_dependencies[name] = set().union(
+            *[dependencies[reached]
+              for reached in closure(names[name] | autouse | set([name]))])
+    test_dependencies[None] = dependencies[None].union(
+        *[dependencies[reached] for reached in closure(shared_names)])
+    return test_dependencies
+
+
+def html_dependencies(filename, template_path='./templates',
+                      profile=profiling.NULL_PROFILE,
+                      template_dialects=templates.DEFAULT_DIALECTS,
+                      template_index=None, content=None):
     """Return the direct dependencies of a Mako template.
 
     Args:
         filename: str: the filename of the python file
         template_path: str: path where the templates are located
+        profile: profiling.Profile: records the time scanning
+        template_dialects: tuple: the names of the template dialects, see the
+        templates module
+        template_index: templates.TemplateIndex: if given the included
+        templates are resolved with it
+        content: str: the content of the template, if it was already read
 
     Returns:
         a set with all direct HTML dependencies.
     """
+    profile.count('html_files')
+    with profile.phase('html_scan'):
+        return templates.template_dependencies(
+            filename, template_path=template_path,
+            dialects=template_dialects, template_index=template_index,
+            content=content)
+
+
+def _direct_dependencies(filename, start_path='.',
+                         template_path='./templates', functions=(),
+                         module_index=None, profile=profiling.NULL_PROFILE,
+                         template_dialects=templates.DEFAULT_DIALECTS,
+                         template_index=None, package_cache=None,
+                         content=None):
+    """Return the direct dependencies of a file according to its extension.
+
+    content is the content of the file, if it was already read.
+    """
+    if filename.endswith('.py'):
+        return python_dependencies(filename, start_path=start_path,
+                                   functions=functions,
+                                   module_index=module_index,
+                                   profile=profile,
+                                   package_cache=package_cache,
+                                   source=content)
+    elif filename.endswith('.html'):
+        return html_dependencies(filename, template_path=template_path,
+                                 profile=profile,
+                                 template_dialects=template_dialects,
+                                 template_index=template_index,
+                                 content=content)
+    else:
+        return set([filename])
+
+
+# Number of files read ahead per reader thread of dependency_graph.
+READ_AHEAD = 4
+
+# Seconds between the checks of the worker processes of dependency_graph
+# while waiting for a batch.
+WORKER_CHECK_INTERVAL = 1.0
+
+_worker_options = {}
+
+
+def _init_worker(options):
+    """Store the analysis options in a worker process."""
+    global _worker_options
+    _worker_options = options
+
+
+def _read_source(filename):
+    """Return the content of a file to analyse."""
     with open(filename) as f:
-        content = f.read()
-        includes = HTML_INCLUDE_RE.findall(content)
-        normalized_includes = set()
-        for include in includes:
-            if include.startswith('..'):
-                normalized_include = os.path.normpath(os.path.join(os.path.dirname(filename), include))
-            else:
-                normalized_include = os.path.join(template_path, include.strip('/'))
-            normalized_includes.add(normalized_include)
+        return f.read()
+
+
+def _analyse_batch(filenames):
+    """Return the direct dependencies of a batch of files.
+
+    It runs in the worker processes of dependency_graph. Exceptions are
+    returned instead of raised so the parent can raise them.
+
+    Returns:
+        a list of (filename, direct dependencies, start time, seconds).
+    """
+    try:
+        results = []
+        for filename in filenames:
+            start = time.time()
+            direct_dependencies = _direct_dependencies(filename,
+                                                       **_worker_options)
+            results.append((filename, direct_dependencies, start,
+                            time.time() - start))
+        return results
+    except Exception as e:
+        return e
+
+
+def _watch_pool(pool, batches, results, stopped):
+    """Put in results the errors of the pool its callbacks miss.
+
+    Python 2 pools have no error callback: a batch whose result can not be
+    sent back never calls its callback and the batch of a killed worker is
+    lost, so dependency_graph would wait for them forever. It runs in a
+    thread until stopped is set.
+
+    Args:
+        pool: multiprocessing.Pool: the pool running the batches
+        batches: list: the AsyncResult of the batches sent to the pool
+        results: Queue.Queue: where the callback of the batches puts them
+        stopped: threading.Event: set when the pool is no longer used
+    """
+    worker_pids = set(process.pid for process in pool._pool)
+    while not stopped.wait(WORKER_CHECK_INTERVAL):
+        for batch in list(batches):
+            if batch.ready() and not batch.successful():
+                try:
+                    batch.get()
+                except Exception as e:
+                    results.put(e)
+                    return
+        # The pool replaces the workers which exited, they never exit
+        # otherwise.
+        if any(process.exitcode is not None for process in pool._pool) or \
+                set(process.pid for process in pool._pool) != worker_pids:
+            results.put(RuntimeError('a worker process of the dependency '
+                                     'analysis died'))
+            return
 
-        return normalized_includes
 
+def _is_parsed(filename):
+    """Return whether the dependencies of a file come from parsing it."""
+    return filename.endswith('.py') or filename.endswith('.html')
 
-def transitive_dependencies(filenames):
-    """Return a the transitive dependencies of the given filenames."""
+
+def dependency_graph(filenames, start_path='.', template_path='./templates',
+                     functions=(), module_index=None, cache=None, workers=1,
+                     known=None, profile=profiling.NULL_PROFILE,
+                     template_dialects=templates.DEFAULT_DIALECTS,
+                     template_index=None, readers=0):
+    """Return the direct dependencies of the files reachable from filenames.
+
+    Args:
+        filenames: iterable: the files from where to start the analysis
+        start_path: str: path from where we should start searching for
+        python dependencies
+        template_path: str: path where the templates are located
+        functions: tuple: functions to check when parsing the Python files.
+        module_index: ModuleIndex: if given the imported modules are resolved
+        with it instead of searching them in start_path
+        cache: cache.DependencyCache: if given, the direct dependencies of
+        unchanged files are read from it instead of parsing them again. It
+        must have been created with the same arguments.
+        workers: int: number of processes parsing the files. The workers are
+        forked, so functions is not required to be picklable on platforms
+        using fork.
+        known: dict: direct dependencies of files which are already known to
+        be up to date, e.g. loaded from a graph file. They are not analysed
+        again.
+        profile: profiling.Profile: records the time of each phase and file,
+        and counts the files, cache hits, nodes and edges. With workers only
+        the time of each file is recorded.
+        template_dialects: tuple: the names of the dialects of the templates,
+        see the templates module
+        template_index: templates.TemplateIndex: if given the included
+        templates are resolved with it
+        readers: int: number of threads reading the files ahead of their
+        analysis, for filesystems where reading is slow but not CPU bound,
+        e.g. network filesystems. At most READ_AHEAD files per thread are
+        read ahead. It is ignored with workers, which read their files.
+
+    Returns:
+        a dictionary whose keys are all the analysed files and whose values
+        are the set of their direct dependencies.
+    """
+    # The packages are listed once per analysis, as files may have been
+    # added or removed since the previous one.
+    options = dict(start_path=start_path, template_path=template_path,
+                   functions=compile_functions(functions),
+                   module_index=module_index,
+                   template_dialects=template_dialects,
+                   template_index=template_index,
+                   package_cache=PackageCache())
     dependencies = {}
     processed_filenames = set()
     pending_filenames = set(filenames)
-    while pending_filenames:
-        filename = pending_filenames.pop()
-        processed_filenames.add(filename)
-        if filename.endswith('.py'):
-            dependencies[filename] = python_dependencies(filename)
-        elif filename.endswith('.html'):
-            dependencies[filename] = html_dependencies(filename)
-        else:
-            dependencies[filename] = set([filename])
+    known = known or {}
+
+    def cached_dependencies(filename):
+        direct_dependencies = known.get(filename)
+        if direct_dependencies is not None:
+            profile.count('known_files')
+        elif cache:
+            with profile.phase('cache'):
+                direct_dependencies = cache.get(filename)
+            profile.count('cache_misses' if direct_dependencies is None
+                          else 'cache_hits')
+        return direct_dependencies
+
+    def add_dependencies(filename, direct_dependencies, from_cache=False):
+        if cache and not from_cache and _is_parsed(filename):
+            with profile.phase('cache'):
+                cache.set(filename, direct_dependencies)
+        dependencies[filename] = direct_dependencies
         pending_filenames.update(
-            set(dependencies[filename]) - processed_filenames)
+            set(direct_dependencies) - processed_filenames)
+
+    if workers <= 1 and readers > 0:
+        # Files to analyse wait in waiting until there is room to read them
+        # ahead, and then in reading, with their pending read, until they
+        # are analysed, in the order they were found.
+        waiting = collections.deque()
+        reading = collections.deque()
+        pool = multiprocessing.pool.ThreadPool(readers)
+        try:
+            with profile.phase('graph'):
+                while pending_filenames or waiting or reading:
+                    while pending_filenames:
+                        filename = pending_filenames.pop()
+                        processed_filenames.add(filename)
+                        direct_dependencies = cached_dependencies(filename)
+                        if direct_dependencies is not None:
+                            add_dependencies(filename, direct_dependencies,
+                                             from_cache=True)
+                        elif _is_parsed(filename):
+                            waiting.append(filename)
+                        else:
+                            add_dependencies(filename, _direct_dependencies(
+                                filename, profile=profile, **options))
+                    while waiting and len(reading) < readers * READ_AHEAD:
+                        filename = waiting.popleft()
+                        reading.append((filename, pool.apply_async(
+                            _read_source, (filename,))))
+                    if not reading:
+                        continue
+                    filename, read = reading.popleft()
+                    with profile.file(filename):
+                        with profile.phase('read'):
+                            content = read.get()
+                        direct_dependencies = _direct_dependencies(
+                            filename, profile=profile, content=content,
+                            **options)
+                    add_dependencies(filename, direct_dependencies)
+        finally:
+            pool.terminate()
+            pool.join()
+        _count_graph(dependencies, profile)
+        return dependencies
+
+    if workers <= 1:
+        with profile.phase('graph'):
+            while pending_filenames:
+                filename = pending_filenames.pop()
+                processed_filenames.add(filename)
+                direct_dependencies = cached_dependencies(filename)
+                if direct_dependencies is not None:
+                    add_dependencies(filename, direct_dependencies,
+                                     from_cache=True)
+                else:
+                    with profile.file(filename):
+                        direct_dependencies = _direct_dependencies(
+                            filename, profile=profile, **options)
+                    add_dependencies(filename, direct_dependencies)
+        _count_graph(dependencies, profile)
+        return dependencies
+
+    # Batches are sent to the pool as soon as new files are discovered and
+    # their results are merged as they arrive, so the workers are kept busy
+    # instead of waiting for a whole level of the graph to finish.
+    results = Queue.Queue()
+    in_flight = 0
+    with profile.phase('graph'):
+        pool = multiprocessing.Pool(workers, _init_worker, (options,))
+        batches = []
+        stopped = threading.Event()
+        watcher = threading.Thread(target=_watch_pool,
+                                   args=(pool, batches, results, stopped))
+        watcher.daemon = True
+        watcher.start()
+        try:
+            while pending_filenames or in_flight:
+                batch = []
+                while pending_filenames:
+                    filename = pending_filenames.pop()
+                    processed_filenames.add(filename)
+                    direct_dependencies = cached_dependencies(filename)
+                    if direct_dependencies is not None:
+                        add_dependencies(filename, direct_dependencies,
+                                         from_cache=True)
+                    elif _is_parsed(filename):
+                        batch.append(filename)
+                    else:
+                        add_dependencies(filename, _direct_dependencies(
+                            filename, **options))
+
+                batch_size = max(1, min(64, len(batch) // (workers * 4)))
+                for i in xrange(0, len(batch), batch_size):
+                    batches.append(pool.apply_async(
+                        _analyse_batch, (batch[i:i + batch_size],),
+                        callback=results.put))
+                    in_flight += 1
+
+                if in_flight:
+                    result = results.get()
+                    in_flight -= 1
+                    if isinstance(result, Exception):
+                        raise result
+                    for filename, direct_dependencies, start, seconds in \
+                            result:
+                        profile.add_time('analyse', seconds, start=start,
+                                         filename=filename)
+                        profile.add_file(filename, seconds)
+                        add_dependencies(filename, direct_dependencies)
+        finally:
+            # The watcher is not joined, it exits at its next check.
+            stopped.set()
+            pool.terminate()
+            pool.join()
+
+    _count_graph(dependencies, profile)
+    return dependencies
+
+
+def _count_graph(graph, profile):
+    """Count the nodes and edges of a direct dependencies graph."""
+    profile.count('nodes', len(graph))
+    profile.count('edges', sum(len(successors)
+                               for successors in graph.itervalues()))
+
+
+def _module_name(filename):
+    """Return the last component of the module name of a Python file."""
+    name = os.path.basename(filename)[:-len('.py')]
+    if name == '__init__':
+        name = os.path.basename(os.path.dirname(filename))
+    return name
+
 
-    return _reachable(dependencies)
+def update_graph(graph, roots, changed=(), added=(), deleted=(), **kwargs):
+    """Return the dependency graph after some files changed.
+
+    Only the changed files are analysed again, plus the Python files which
+    may have an import resolving differently due to an added or deleted
+    module: the ones mentioning its name, for the absolute imports, and the
+    ones of its directory and subdirectories, for the relative imports and
+    the implicit relative imports of Python 2. An added or deleted
+    __init__.py changes whether its directory is a package, which only
+    affects the same files. The result is equal to
+    dependency_graph(roots, **kwargs) on the current files.
+
+    Args:
+        graph: dict: the previous direct dependencies graph
+        roots: iterable: the files from where the analysis starts
+        changed: iterable: files whose content changed
+        added: iterable: files which were created
+        deleted: iterable: files which were removed
+        kwargs: the remaining arguments of dependency_graph. A module_index
+        must already reflect the added and deleted files.
+
+    Returns:
+        the new direct dependencies graph.
+    """
+    stale_filenames = set(changed) | set(added) | set(deleted)
+    modules = [filename for filename in set(added) | set(deleted)
+               if filename.endswith('.py')]
+    module_names = set(_module_name(filename) for filename in modules)
+    directories = tuple(set(os.path.join(os.path.dirname(filename), '')
+                            for filename in modules))
+    if module_names:
+        for filename in graph:
+            if not filename.endswith('.py') or filename in stale_filenames:
+                continue
+            if filename.startswith(directories):
+                stale_filenames.add(filename)
+                continue
+            try:
+                with open(filename) as f:
+                    source = f.read()
+            except IOError:
+                stale_filenames.add(filename)
+                continue
+            if any(name in source for name in module_names):
+                stale_filenames.add(filename)
+
+    known = dict((filename, direct_dependencies)
+                 for filename, direct_dependencies in graph.iteritems()
+                 if filename not in stale_filenames)
+    return dependency_graph(roots, known=known, **kwargs)
+
+
+def transitive_dependencies(filenames, **kwargs):
+    """Return a the transitive dependencies of the given filenames.
+
+    It accepts the same arguments as dependency_graph.
+
+    Returns:
+        a ReachabilityMap whose keys are all the analysed files and whose
+        values are the set of files reachable from them.
+    """
+    graph = dependency_graph(filenames, **kwargs)
+    with kwargs.get('profile', profiling.NULL_PROFILE).phase('closure'):
+        return DependencyGraph(graph).closure()
+
+
+class LazyDependencyGraph(object):
+    """A dependency graph whose files are analysed on demand.
+
+    It answers reachability questions by walking the graph from a node,
+    analysing each file only when the walk gets to it, so a question which is
+    answered early does not pay for the full closure. Every answer is
+    memoized: the closure of a node whose walk completed, and a changed file
+    reached from every node of the path of a walk which stopped early.
+
+    It accepts the same arguments as dependency_graph, except workers.
+    """
+    def __init__(self, start_path='.', template_path='./templates',
+                 functions=(), module_index=None, cache=None, known=None,
+                 profile=profiling.NULL_PROFILE,
+                 template_dialects=templates.DEFAULT_DIALECTS,
+                 template_index=None):
+        self.options = dict(start_path=start_path,
+                            template_path=template_path,
+                            functions=compile_functions(functions),
+                            module_index=module_index, profile=profile,
+                            template_dialects=template_dialects,
+                            template_index=template_index,
+                            package_cache=PackageCache())
+        self.profile = profile
+        self.cache = cache
+        self.graph = dict(known or {})
+        self._closures = {}
+        self._witnesses = {}
+
+    def dependencies(self, node):
+        """Return the direct dependencies of node, analysing it if needed."""
+        direct_dependencies = self.graph.get(node)
+        if direct_dependencies is None:
+            if self.cache:
+                direct_dependencies = self.cache.get(node)
+            if direct_dependencies is None:
+                with self.profile.file(node):
+                    direct_dependencies = _direct_dependencies(
+                        node, **self.options)
+                if self.cache and _is_parsed(node):
+                    self.cache.set(node, direct_dependencies)
+            self.graph[node] = direct_dependencies
+        return direct_dependencies
+
+    def iter_dependencies(self, node):
+        """Yield node and the files reachable from it, analysing them lazily.
+
+        Each file is yielded once, in depth first order.
+        """
+        closure = self._closures.get(node)
+        if closure is not None:
+            for reached in closure:
+                yield reached
+            return
+
+        visited = set([node])
+        yield node
+        stack = [iter(self.dependencies(node))]
+        while stack:
+            for successor in stack[-1]:
+                if successor in visited:
+                    continue
+                successor_closure = self._closures.get(successor)
+                if successor_closure is not None:
+                    for reached in successor_closure:
+                        if reached not in visited:
+                            visited.add(reached)
+                            yield reached
+                    continue
+                visited.add(successor)
+                yield successor
+                stack.append(iter(self.dependencies(successor)))
+                break
+            else:
+                stack.pop()
+        self._closures[node] = frozenset(visited)
+
+    def reaches_any(self, node, targets):
+        """Return whether any of targets is reachable from node.
+
+        node itself counts as reachable.
+        """
+        if not isinstance(targets, (set, frozenset)):
+            targets = set(targets)
+        if node in targets or self._witnesses.get(node) in targets:
+            return True
+        closure = self._closures.get(node)
+        if closure is not None:
+            return not targets.isdisjoint(closure)
+
+        visited = set([node])
+        path = [node]
+        stack = []
+        successors = self.dependencies(node)
+        while True:
+            # The direct dependencies are checked before descending into any
+            # of them, as it does not require analysing more files.
+            hits = targets.intersection(successors)
+            if hits:
+                witness = next(iter(hits))
+                for reached in path:
+                    self._witnesses[reached] = witness
+                return True
+            stack.append(iter(successors))
+            successors = None
+            while stack and successors is None:
+                for successor in stack[-1]:
+                    if successor in visited:
+                        continue
+                    visited.add(successor)
+                    witness = self._witnesses.get(successor)
+                    if witness in targets:
+                        for reached in path:
+                            self._witnesses[reached] = witness
+                        return True
+                    successor_closure = self._closures.get(successor)
+                    if successor_closure is not None:
+                        if not targets.isdisjoint(successor_closure):
+                            path.append(successor)
+                            successors = successor_closure
+                            break
+                        visited.update(successor_closure)
+                        continue
+                    path.append(successor)
+                    successors = self.dependencies(successor)
+                    break
+                else:
+                    stack.pop()
+                    path.pop()
+            if successors is None:
+                break
+        self._closures[node] = frozenset(visited)
+        return False
+
+    def affected(self, changed_filenames, roots):
+        """Return the roots which reach any of the changed files."""
+        changed_filenames = set(changed_filenames)
+        return set(root for root in roots
+                   if self.reaches_any(root, changed_filenames))
+
+    def affected_distances(self, changed_filenames, roots):
+        """Return the distance to the changed files of the affected roots.
+
+        Only the analysed part of the graph is known, so a distance may be
+        longer than the shortest path of the full graph.
+        """
+        affected = self.affected(changed_filenames, roots)
+        distances = _reverse_distances(self.graph, changed_filenames)
+        return dict((root, distances[root]) for root in affected)
+
+
+def _reverse_graph(graph):
+    """Return a dictionary mapping each node to the nodes linking to it."""
+    reverse_graph = collections.defaultdict(set)
+    for node, successors in graph.iteritems():
+        for successor in successors:
+            reverse_graph[successor].add(node)
+    return reverse_graph
+
+
+def _reverse_reachable(graph, nodes):
+    """Return the set of nodes of graph from which any of nodes is reachable.
+
+    The given nodes are included in the result.
+    """
+    reverse_graph = _reverse_graph(graph)
+    reached = set(nodes)
+    latest_nodes = reached
+    while latest_nodes:
+        new_nodes = set()
+        for node in latest_nodes:
+            new_nodes.update(reverse_graph.get(node, ()))
+        new_nodes -= reached
+        reached.update(new_nodes)
+        latest_nodes = new_nodes
+
+    return reached
+
+
+def _reverse_distances(graph, nodes):
+    """Return the distance to nodes of the nodes of graph reaching them.
+
+    The distance is the number of edges of the shortest path to any of
+    nodes, so the given nodes are included with distance 0.
+    """
+    reverse_graph = _reverse_graph(graph)
+    distances = dict.fromkeys(nodes, 0)
+    latest_nodes = list(distances)
+    distance = 0
+    while latest_nodes:
+        distance += 1
+        new_nodes = []
+        for node in latest_nodes:
+            for predecessor in reverse_graph.get(node, ()):
+                if predecessor not in distances:
+                    distances[predecessor] = distance
+                    new_nodes.append(predecessor)
+        latest_nodes = new_nodes
+
+    return distances
+
+
+def affected_distances(changed_filenames, roots, graph=None, **kwargs):
+    """Return how far each affected root is from the changed files.
+
+    It accepts the same arguments as affected_by.
+
+    Returns:
+        a dict mapping the roots which are or reach a changed file to the
+        number of edges of the shortest path to one, 0 for the changed roots.
+    """
+    roots = set(roots)
+    if graph is None:
+        graph = dependency_graph(roots, **kwargs)
+    with kwargs.get('profile', profiling.NULL_PROFILE).phase('reverse'):
+        distances = _reverse_distances(graph, changed_filenames)
+        return dict((root, distances[root]) for root in roots
+                    if root in distances)
+
+
+def affected_by(changed_filenames, roots, graph=None, **kwargs):
+    """Return the roots which depend on any of the changed files.
+
+    Instead of computing the closure of every root, it inverts the edges of
+    the dependency graph and walks it once backwards from the changed files.
+
+    Args:
+        changed_filenames: iterable: the files which changed
+        roots: iterable: the candidate files, usually the test files
+        graph: dict: the direct dependencies graph, as returned by
+        dependency_graph. If not given it is computed from roots using the
+        remaining arguments.
+
+    Returns:
+        the set of roots which are or reach a changed file.
+    """
+    roots = set(roots)
+    if graph is None:
+        graph = dependency_graph(roots, **kwargs)
+    with kwargs.get('profile', profiling.NULL_PROFILE).phase('reverse'):
+        return roots.intersection(_reverse_reachable(graph,
+                                                     changed_filenames))
+
+
+def _expand_filenames(paths):
+    """Return the given files plus the Python files under the given dirs."""
+    filenames = set()
+    for path in paths:
+        if not os.path.isdir(path):
+            filenames.add(path)
+            continue
+        for directory, dirnames, names in os.walk(path):
+            dirnames[:] = [name for name in dirnames
+                           if not name.startswith('.')]
+            filenames.update(os.path.join(directory, name) for name in names
+                             if name.endswith('.py'))
+    return filenames
+
+
+def build_graph_main(argv):
+    """Analyse the given files and write the graph with graphfile."""
+    import graphfile
+
+    parser = argparse.ArgumentParser(
+        prog='python -m pydependencies build-graph',
+        description='Write the dependency graph of the given files or '
+                    'directories to a binary file.')
+    parser.add_argument('-o', '--output', required=True,
+                        help='file where the graph is written')
+    parser.add_argument('--base_path', default='.',
+                        help='base path where the source is found')
+    parser.add_argument('--templates_path', default='templates',
+                        help='path of the templates folder relative to '
+                             'base_path')
+    parser.add_argument('--template_dialects', '--template-dialects',
+                        type=templates.parse_dialects,
+                        default=','.join(templates.DEFAULT_DIALECTS),
+                        help='comma separated template languages whose '
+                             'includes are followed: mako, jinja')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes used to parse the sources')
+    parser.add_argument('--readers', type=int, default=0,
+                        help='number of threads reading the sources ahead, '
+                             'useful on network filesystems')
+    parser.add_argument('paths', nargs='+')
+    options = parser.parse_args(argv)
+
+    base_path = os.path.abspath(options.base_path)
+    filenames = set(os.path.abspath(filename)
+                    for filename in _expand_filenames(options.paths))
+    graph = dependency_graph(
+        filenames, start_path=base_path,
+        template_path=os.path.join(base_path, options.templates_path),
+        template_dialects=options.template_dialects,
+        workers=options.workers, readers=options.readers)
+    graphfile.write_graph(options.output, graph, base_path=base_path)
 
 
 def main(argv):
-    deps = transitive_dependencies(argv[1:])
+    if len(argv) > 1 and argv[1] == 'build-graph':
+        return build_graph_main(argv[2:])
+    if len(argv) > 1 and argv[1] == 'serve':
+        import daemon
+        return daemon.serve_main(argv[2:])
+
+    # pprint only lays out the dict type itself.
+    deps = dict(transitive_dependencies(argv[1:]))
     pprint.pprint(deps)
     pprint.pprint(sorted([(k, len(v)) for k, v in deps.iteritems()],
                   key=lambda x: x[1]))
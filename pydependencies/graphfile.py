@@ -0,0 +1,200 @@
+"""Compact binary serialization of a dependency graph.
+
+It allows building the graph once, e.g. in a CI step, and sharing it with the
+processes that need it, e.g. the test shards, so they do not have to analyse
+the sources again.
+
+The file stores an interned path table, the sha1 of every file at build time,
+and the direct edges as integer arrays in CSR form (an offsets array plus a
+targets array). Everything after the header is read lazily from a memory map,
+so loading is cheap even for large graphs. The transitive closure is not
+stored, as it is quadratic in size while the users of the file update the
+graph before walking it.
+
+Paths are stored relative to the base path used when writing, and are joined
+with the base path given when loading, so the checkout may live in a different
+directory.
+
+Layout, all integers are little endian uint32:
+
+    header: magic, version, number of nodes, number of edges, size of the
+        paths blob
+    path offsets: number of nodes + 1 integers
+    paths blob: paths separated by nothing, sliced with the offsets
+    digests: 20 bytes per node, all zeros for files which did not exist
+    edge offsets: number of nodes + 1 integers
+    edge targets: number of edges integers
+"""
+import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+
+__all__ = ('write_graph', 'GraphFile')
+
+MAGIC = b'PYDG'
+VERSION = 2
+
+_HEADER = struct.Struct('<4sIIII')
+_DIGEST_SIZE = 20
+_NO_DIGEST = b'\0' * _DIGEST_SIZE
+
+
+def _raw_digest(filename):
+    """Return the raw sha1 of a file or _NO_DIGEST if it does not exist."""
+    digest = hashlib.sha1()
+    try:
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+    except IOError:
+        return _NO_DIGEST
+    return digest.digest()
+
+
+def _pack_uint32(values):
+    """Return the little endian uint32 representation of values."""
+    values = array.array('I', values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tostring()
+
+
+def _pack_csr(adjacency):
+    """Return the packed offsets and targets arrays of an adjacency list."""
+    offsets = array.array('I', [0])
+    targets = array.array('I')
+    for successors in adjacency:
+        targets.extend(sorted(successors))
+        offsets.append(len(targets))
+    return _pack_uint32(offsets), _pack_uint32(targets), len(targets)
+
+
+def write_graph(filename, graph, base_path='.'):
+    """Write a dependency graph to filename.
+
+    Args:
+        filename: str: the output file
+        graph: dict: the direct dependencies, as returned by dependency_graph
+        base_path: str: the paths are stored relative to it. Relative nodes
+        are relative to it as well.
+    """
+    nodes = sorted(set(graph).union(*graph.values()))
+    node_ids = dict((node, i) for i, node in enumerate(nodes))
+    base_path = os.path.abspath(base_path)
+
+    path_offsets = [0]
+    paths = []
+    for node in nodes:
+        path = os.path.relpath(os.path.join(base_path, node), base_path)
+        paths.append(path)
+        path_offsets.append(path_offsets[-1] + len(path))
+    paths_blob = b''.join(paths)
+
+    edges, edge_targets, num_edges = _pack_csr(
+        [node_ids[dep] for dep in graph.get(node, ())] for node in nodes)
+
+    with open(filename, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(nodes), num_edges,
+                             len(paths_blob)))
+        f.write(_pack_uint32(path_offsets))
+        f.write(paths_blob)
+        for node in nodes:
+            f.write(_raw_digest(os.path.join(base_path, node)))
+        f.write(edges)
+        f.write(edge_targets)
+
+
+class GraphFile(object):
+    """A dependency graph loaded from a file written by write_graph.
+
+    Args:
+        filename: str: the file to load
+        base_path: str: the stored paths are joined with it
+    """
+    def __init__(self, filename, base_path='.'):
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, num_nodes, num_edges,
+         paths_size) = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError('%s is not a dependency graph file of version %d'
+                             % (filename, VERSION))
+
+        position = _HEADER.size
+        path_offsets = struct.unpack_from('<%dI' % (num_nodes + 1),
+                                          self._map, position)
+        position += 4 * (num_nodes + 1)
+        paths_blob = self._map[position:position + paths_size]
+        position += paths_size
+        base_path = os.path.abspath(base_path)
+        self.paths = [
+            os.path.normpath(os.path.join(
+                base_path, paths_blob[path_offsets[i]:path_offsets[i + 1]]))
+            for i in xrange(num_nodes)]
+        self._node_ids = dict((path, i) for i, path in enumerate(self.paths))
+
+        self._digests_position = position
+        position += _DIGEST_SIZE * num_nodes
+        self._edges_position = position
+        position += 4 * (num_nodes + 1)
+        self._edge_targets_position = position
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, unused_type, unused_value, unused_traceback):
+        self.close()
+
+    def __contains__(self, path):
+        return path in self._node_ids
+
+    def __len__(self):
+        return len(self.paths)
+
+    def close(self):
+        self._map.close()
+
+    def _targets(self, node_id):
+        """Return the ids of the direct dependencies of a node id."""
+        start, end = struct.unpack_from(
+            '<II', self._map, self._edges_position + 4 * node_id)
+        return struct.unpack_from('<%dI' % (end - start), self._map,
+                                  self._edge_targets_position + 4 * start)
+
+    def dependencies(self, path):
+        """Return the set of direct dependencies of path."""
+        return set(self.paths[target]
+                   for target in self._targets(self._node_ids[path]))
+
+    def closure(self, path):
+        """Return the set of files reachable from path.
+
+        It walks the edges read from the file.
+        """
+        node_id = self._node_ids[path]
+        reachable = set([node_id])
+        pending = [node_id]
+        while pending:
+            for target in self._targets(pending.pop()):
+                if target not in reachable:
+                    reachable.add(target)
+                    pending.append(target)
+        return set(self.paths[node_id] for node_id in reachable)
+
+    def is_fresh(self, path):
+        """Return whether path has the same content as when it was written."""
+        position = self._digests_position + _DIGEST_SIZE * self._node_ids[path]
+        return self._map[position:position + _DIGEST_SIZE] == _raw_digest(path)
+
+    def to_dict(self):
+        """Return the direct dependencies as a dictionary."""
+        return dict((path, self.dependencies(path)) for path in self.paths)
+
+    def changed_paths(self):
+        """Return the set of paths whose content changed since written."""
+        return set(path for path in self.paths if not self.is_fresh(path))
@@ -0,0 +1,138 @@
+"""History of the test runs, used to run the likeliest failures first.
+
+After each run the outcome and duration of every test are stored in a sqlite
+database next to the dependencies cache. A later run with --deps-prioritize
+orders the tests so the ones most likely to fail run first:
+
+    1. test files closer to the modified files in the dependency graph, i.e.
+       the test files which changed, then the ones importing a changed
+       module directly, and so on,
+    2. test files with a higher failure rate,
+    3. faster test files.
+
+Failure rates and durations are exponential moving averages, so recent runs
+weigh more. Tests without history are assumed to fail, as new tests are the
+likeliest to. The tests of a file are kept together and in their order, so
+module and class fixtures are still set up once.
+"""
+import collections
+import os
+import sqlite3
+import sys
+
+
+__all__ = ('RunHistory', 'prioritize')
+
+DATABASE_NAME = 'history.sqlite'
+
+# Weight of the latest run in the moving averages.
+WEIGHT = 0.3
+
+# Rank of the test files whose distance to the modified files is unknown.
+UNKNOWN_DISTANCE = sys.maxint
+
+# Failure rate of the tests without history.
+NEW_TEST_FAILURE_RATE = 1.0
+
+
+class RunHistory(object):
+    """The database of the failure rate and duration of each test.
+
+    Args:
+        path: str: directory where the database is stored. It is created if
+        needed.
+    """
+    def __init__(self, path):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._connection = sqlite3.connect(os.path.join(path, DATABASE_NAME))
+        self._connection.text_factory = str
+        # It is a cache, losing the last writes on a crash is fine.
+        self._connection.execute('PRAGMA synchronous = OFF')
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS history (
+                nodeid TEXT PRIMARY KEY,
+                runs INTEGER,
+                failure_rate REAL,
+                duration REAL)""")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, unused_type, unused_value, unused_traceback):
+        self.close()
+
+    def update(self, results):
+        """Add the results of a run.
+
+        Args:
+            results: dict: maps the node id of each test which ran to a
+            (failed, duration) tuple
+        """
+        self._connection.executemany(
+            'INSERT OR IGNORE INTO history VALUES (?, 0, 0, 0)',
+            ((nodeid,) for nodeid in results))
+        self._connection.executemany(
+            'UPDATE history SET '
+            'failure_rate = CASE runs WHEN 0 THEN ? '
+            'ELSE failure_rate + ? * (? - failure_rate) END, '
+            'duration = CASE runs WHEN 0 THEN ? '
+            'ELSE duration + ? * (? - duration) END, '
+            'runs = runs + 1 '
+            'WHERE nodeid = ?',
+            ((float(failed), WEIGHT, float(failed),
+              duration, WEIGHT, duration, nodeid)
+             for nodeid, (failed, duration) in results.iteritems()))
+        self._connection.commit()
+
+    def load(self):
+        """Return a dict mapping node ids to (failure_rate, duration)."""
+        return dict(
+            (nodeid, (failure_rate, duration))
+            for nodeid, failure_rate, duration in self._connection.execute(
+                'SELECT nodeid, failure_rate, duration FROM history'))
+
+    def close(self):
+        self._connection.close()
+
+
+def prioritize(items, distances, history):
+    """Return the items in the order they should run.
+
+    Args:
+        items: list: the pytest items, in their collection order
+        distances: dict: maps test files to their distance to the modified
+        files, as returned by dependencies.affected_distances
+        history: dict: the result of RunHistory.load
+
+    Returns:
+        a new list with the items of the likeliest failing test files first.
+    """
+    items_by_file = collections.OrderedDict()
+    for item in items:
+        filename = str(item.fspath)
+        file_items = items_by_file.get(filename)
+        if file_items is None:
+            file_items = items_by_file[filename] = []
+        file_items.append(item)
+
+    new_test = (NEW_TEST_FAILURE_RATE, 0.0)
+    ranks = []
+    for position, (filename, file_items) in \
+            enumerate(items_by_file.iteritems()):
+        failure_rate = 0.0
+        duration = 0.0
+        for item in file_items:
+            item_failure_rate, item_duration = history.get(item.nodeid,
+                                                           new_test)
+            if item_failure_rate > failure_rate:
+                failure_rate = item_failure_rate
+            duration += item_duration
+        ranks.append((distances.get(filename, UNKNOWN_DISTANCE),
+                      -failure_rate, duration, position, file_items))
+    ranks.sort()
+
+    prioritized = []
+    for rank in ranks:
+        prioritized.extend(rank[-1])
+    return prioritized
@@ -0,0 +1,173 @@
+"""Timers and counters of the dependency analysis.
+
+A Profile is passed as the profile argument of dependency_graph,
+transitive_dependencies, affected_by and the functions analysing a single
+file. They record how long each phase takes (reading the files, parsing them,
+resolving the modules, computing the closure, ...), how many times things
+happen (files parsed, cache hits, stat calls, nodes, edges) and how long each
+file took to analyse.
+
+Phases nest, e.g. parse is part of analyse, so the time of a phase includes
+the time of the phases run inside it.
+
+The results can be written as JSON or in the Chrome trace event format, which
+can be opened with chrome://tracing or https://ui.perfetto.dev.
+"""
+import collections
+import json
+import os
+import time
+
+
+__all__ = ('Profile', 'NULL_PROFILE')
+
+
+class _Timer(object):
+    """Context manager adding the time spent in it to a phase."""
+    __slots__ = ('profile', 'name', 'filename', 'start')
+
+    def __init__(self, profile, name, filename=None):
+        self.profile = profile
+        self.name = name
+        self.filename = filename
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, unused_type, unused_value, unused_traceback):
+        seconds = time.time() - self.start
+        self.profile.add_time(self.name, seconds, start=self.start,
+                              filename=self.filename)
+        if self.filename is not None:
+            self.profile.add_file(self.filename, seconds)
+
+
+class Profile(object):
+    """Collect the timers and counters of an analysis.
+
+    Args:
+        trace: bool: whether to keep every timed event, as needed by
+        write_trace. Otherwise only the totals are kept.
+    """
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.times = collections.defaultdict(float)
+        self.calls = collections.Counter()
+        self.counters = collections.Counter()
+        self.file_times = {}
+        self.events = []
+
+    def phase(self, name):
+        """Return a context manager timing a phase."""
+        return _Timer(self, name)
+
+    def file(self, filename, name='analyse'):
+        """Return a context manager timing the analysis of a file."""
+        return _Timer(self, name, filename)
+
+    def add_time(self, name, seconds, start=None, filename=None):
+        """Add a measure of a phase, e.g. measured in another process."""
+        self.times[name] += seconds
+        self.calls[name] += 1
+        if self.trace:
+            self.events.append((name, start, seconds, filename))
+
+    def add_file(self, filename, seconds):
+        self.file_times[filename] = self.file_times.get(filename, 0) + seconds
+
+    def count(self, name, value=1):
+        """Increase a counter."""
+        self.counters[name] += value
+
+    def slowest_files(self, limit=10):
+        """Return the (filename, seconds) of the slowest files to analyse."""
+        return sorted(self.file_times.iteritems(),
+                      key=lambda item: (-item[1], item[0]))[:limit]
+
+    def to_dict(self, slowest=10):
+        """Return the results as a JSON serializable dictionary."""
+        return {
+            'phases': dict((name, {'seconds': seconds,
+                                   'calls': self.calls[name]})
+                           for name, seconds in self.times.iteritems()),
+            'counters': dict(self.counters),
+            'slowest_files': [{'filename': filename, 'seconds': seconds}
+                              for filename, seconds in
+                              self.slowest_files(slowest)],
+        }
+
+    def summary(self, slowest=10):
+        """Return the lines of a human readable summary."""
+        lines = ['%-24s %10s %10s' % ('phase', 'seconds', 'calls')]
+        for name, seconds in sorted(self.times.iteritems(),
+                                    key=lambda item: -item[1]):
+            lines.append('%-24s %10.3f %10d' % (name, seconds,
+                                                self.calls[name]))
+        if self.counters:
+            lines.append('')
+            lines.extend('%-24s %10d' % (name, value)
+                         for name, value in sorted(self.counters.iteritems()))
+        slowest_files = self.slowest_files(slowest)
+        if slowest_files:
+            lines.append('')
+            lines.append('slowest files:')
+            lines.extend('%10.3f %s' % (seconds, filename)
+                         for filename, seconds in slowest_files)
+        return lines
+
+    def write_json(self, filename, slowest=10):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(slowest), f, indent=2, sort_keys=True)
+
+    def write_trace(self, filename):
+        """Write the events in the Chrome trace event format.
+
+        Only the events recorded with trace enabled are written.
+        """
+        timed_events = [event for event in self.events if event[1] is not None]
+        origin = min([start for _, start, _, _ in timed_events] or [0])
+        pid = os.getpid()
+        events = []
+        for name, start, seconds, event_filename in timed_events:
+            event = {'name': name, 'cat': 'pydependencies', 'ph': 'X',
+                     'ts': int((start - origin) * 1e6),
+                     'dur': int(seconds * 1e6), 'pid': pid, 'tid': 0}
+            if event_filename is not None:
+                event['args'] = {'filename': event_filename}
+            events.append(event)
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, unused_type, unused_value, unused_traceback):
+        pass
+
+
+class _NullProfile(object):
+    """A Profile which records nothing, used when none is given."""
+    _timer = _NullTimer()
+
+    def phase(self, name):
+        return self._timer
+
+    def file(self, filename, name='analyse'):
+        return self._timer
+
+    def add_time(self, name, seconds, start=None, filename=None):
+        pass
+
+    def add_file(self, filename, seconds):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+
+NULL_PROFILE = _NullProfile()
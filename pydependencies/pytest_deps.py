@@ -6,9 +6,21 @@ not discovered.
 
 See the dependencies module for more details.
 """
-import gitlint
+import os
+import socket
 
+import pytest
+
+import cache
+import daemon
 import dependencies
+import graphfile
+import history
+import profiling
+import recorder
+import shards
+import templates
+import vcs
 
 
 def pytest_addoption(parser):
@@ -20,6 +32,13 @@ def pytest_addoption(parser):
         dest='dependencies',
         default=False,
         help='run only tests affected by the changed files')
+    group._addoption('--deps-base',
+        action='store',
+        dest='deps_base',
+        default=None,
+        help='git ref, e.g. origin/master. The files changed by the commits '
+             'since HEAD diverged from it are considered modified too, as '
+             'well as the uncommitted ones')
     group._addoption('--base_path',
         action='store',
         dest='base_path',
@@ -30,42 +49,544 @@ def pytest_addoption(parser):
         dest='templates_path',
         default='templates',
         help='path of the templates folder relative to base_path')
+    group._addoption('--deps-cache',
+        action='store_true',
+        dest='deps_cache',
+        default=False,
+        help='cache the direct dependencies of the analysed files')
+    group._addoption('--deps-cache-dir',
+        action='store',
+        dest='deps_cache_dir',
+        default=cache.DEFAULT_CACHE_PATH,
+        help='directory where the dependencies cache is stored')
+    group._addoption('--deps-module-index',
+        action='store_true',
+        dest='deps_module_index',
+        default=False,
+        help='index the modules under base_path and the templates once '
+             'instead of searching them for every import and include')
+    group._addoption('--deps-template-dialects',
+        action='store',
+        dest='deps_template_dialects',
+        type=templates.parse_dialects,
+        default=','.join(templates.DEFAULT_DIALECTS),
+        help='comma separated template languages whose includes are '
+             'followed: mako, jinja')
+    group._addoption('--deps-graph',
+        action='store',
+        dest='deps_graph',
+        default=None,
+        help='load the dependency graph from a file written by '
+             '"python -m pydependencies build-graph". Files which changed '
+             'since are analysed again')
+    group._addoption('--deps-socket',
+        action='store',
+        dest='deps_socket',
+        default=daemon.DEFAULT_SOCKET_PATH,
+        help='Unix socket of the "python -m pydependencies serve" daemon. '
+             'If the daemon is not running the sources are analysed in '
+             'process')
+    group._addoption('--deps-workers',
+        action='store',
+        dest='deps_workers',
+        type=int,
+        default=1,
+        help='number of processes used to parse the sources')
+    group._addoption('--deps-readers',
+        action='store',
+        dest='deps_readers',
+        type=int,
+        default=0,
+        help='number of threads reading the sources ahead of their analysis. '
+             'It helps on network filesystems, where reading is slow')
+    group._addoption('--deps-lazy',
+        action='store_true',
+        dest='deps_lazy',
+        default=False,
+        help='analyse the files on demand, only until each test file is '
+             'known to reach a modified file')
+    group._addoption('--deps-profile',
+        action='store_true',
+        dest='deps_profile',
+        default=False,
+        help='report where the time selecting the affected tests goes')
+    group._addoption('--deps-profile-json',
+        action='store',
+        dest='deps_profile_json',
+        default=None,
+        help='write the profile as JSON to the given file')
+    group._addoption('--deps-profile-trace',
+        action='store',
+        dest='deps_profile_trace',
+        default=None,
+        help='write the profile in the Chrome trace event format to the '
+             'given file')
+    group._addoption('--deps-profile-slowest',
+        action='store',
+        dest='deps_profile_slowest',
+        type=int,
+        default=10,
+        help='number of slowest files to analyse listed in the profile')
+    group._addoption('--deps-record',
+        action='store_true',
+        dest='deps_record',
+        default=False,
+        help='record the files each test file opens or imports while it '
+             'runs. Later --affected runs use them as extra dependencies')
+    group._addoption('--deps-prioritize',
+        action='store_true',
+        dest='deps_prioritize',
+        default=False,
+        help='run first the test files closest to the modified files, then '
+             'the ones which failed more often and the fastest ones. The '
+             'outcome and duration of the tests are stored after each run')
+    group._addoption('--deps-shard',
+        action='store',
+        dest='deps_shard',
+        type=shards.parse_shard,
+        default=None,
+        metavar='K/N',
+        help='run only the K-th of N shards of the (affected) test files, '
+             'K from 1 to N. Test files sharing dependencies are kept in '
+             'the same shard and the shards are balanced with the durations '
+             'of the previous runs. All the shards must use the same copy '
+             'of the cache directory')
+    group._addoption('--deps-granularity',
+        action='store',
+        dest='deps_granularity',
+        choices=('file', 'test'),
+        default='file',
+        help='select whole test files, or only the tests of the affected '
+             'files which reference the affected modules')
 
 
 def pytest_report_header(config):
     """Print a message in case the plugin is activated."""
+    lines = []
     if config.option.dependencies:
-        return 'Only tests affected by the changed files are being run.'
+        lines.append('Only tests affected by the changed files are being run.')
+    if getattr(config, '_deps_profile', None) is not None:
+        lines.append('The selection of the affected tests is being profiled.')
+    return lines
+
+
+def _profile(config):
+    return getattr(config, '_deps_profile', profiling.NULL_PROFILE)
+
+
+def pytest_configure(config):
+    """Start recording the accessed files and profiling if requested."""
+    if (config.option.deps_profile or config.option.deps_profile_json or
+            config.option.deps_profile_trace):
+        config._deps_profile = profiling.Profile(
+            trace=bool(config.option.deps_profile_trace))
+    if config.option.deps_record:
+        base_path = os.path.abspath(config.option.base_path)
+        database = recorder.RecordedDependencies(
+            config.option.deps_cache_dir, base_path=base_path)
+        config._deps_recorder = recorder.Recorder(
+            database, ignored_paths=[config.option.deps_cache_dir])
+    if config.option.deps_prioritize or config.option.deps_shard:
+        config._deps_results = {}
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_make_collect_report(collector):
+    """Attribute the accesses while importing a test module to it."""
+    file_recorder = getattr(collector.config, '_deps_recorder', None)
+    if (file_recorder is None or not isinstance(collector, pytest.Module) or
+            isinstance(collector, pytest.Package)):
+        yield
+        return
+    file_recorder.start(str(collector.fspath))
+    try:
+        yield
+    finally:
+        file_recorder.stop()
+
+
+def pytest_runtest_setup(item):
+    """Record the accesses of item."""
+    file_recorder = getattr(item.config, '_deps_recorder', None)
+    if file_recorder is not None:
+        file_recorder.start(str(item.fspath))
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_teardown(item, nextitem):
+    """Store the accesses of the test file after its last test."""
+    yield
+    file_recorder = getattr(item.config, '_deps_recorder', None)
+    if file_recorder is None:
+        return
+    test_filename = str(item.fspath)
+    if nextitem is None or str(nextitem.fspath) != test_filename:
+        file_recorder.flush(test_filename)
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    """Collect the outcome and duration of each test for the history."""
+    outcome = yield
+    results = getattr(item.config, '_deps_results', None)
+    if results is None:
+        return
+    report = outcome.get_result()
+    failed, duration = results.get(item.nodeid, (False, 0.0))
+    results[item.nodeid] = (failed or report.failed,
+                            duration + report.duration)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_sessionfinish(session):
+    """Store the outcome and duration of the tests which ran.
 
+    The recording stops before the other plugins write their reports, so
+    they are not attributed to the last test file.
+    """
+    file_recorder = getattr(session.config, '_deps_recorder', None)
+    if file_recorder is not None:
+        file_recorder.stop()
+    results = getattr(session.config, '_deps_results', None)
+    if results:
+        with history.RunHistory(session.config.option.deps_cache_dir) as \
+                run_history:
+            run_history.update(results)
 
-def get_modified_filenames():
-    """Return a set with the filename of the modified files."""
-    vcs, unused_root = gitlint.get_vcs_root()
-    if not vcs:
+
+def pytest_unconfigure(config):
+    """Store the recorded files of the remaining test files."""
+    file_recorder = getattr(config, '_deps_recorder', None)
+    if file_recorder is not None:
+        file_recorder.close()
+        del config._deps_recorder
+
+
+def pytest_terminal_summary(terminalreporter):
+    """Print and write the profile of the selection of the tests."""
+    config = terminalreporter.config
+    profile = getattr(config, '_deps_profile', None)
+    if profile is None:
+        return
+    slowest = config.option.deps_profile_slowest
+    if config.option.deps_profile:
+        terminalreporter.write_sep('=', 'dependencies profile')
+        for line in profile.summary(slowest):
+            terminalreporter.write_line(line)
+    if config.option.deps_profile_json:
+        profile.write_json(config.option.deps_profile_json, slowest)
+    if config.option.deps_profile_trace:
+        profile.write_trace(config.option.deps_profile_trace)
+
+
+def get_modified_filenames(base=None, path='.'):
+    """Return a set with the filename of the modified files.
+
+    Git checkouts are read directly, see the vcs module. Other version
+    control systems are read with gitlint, if installed, which does not
+    support base.
+
+    Args:
+        base: str: if given, the files changed since HEAD diverged from this
+        git ref are included
+        path: str: a path inside the checkout
+
+    Returns:
+        a set of absolute paths or None if the checkout is not supported.
+    """
+    root = vcs.git_root(path)
+    if root is not None:
+        return vcs.changed_filenames(root, base=base)
+
+    try:
+        import gitlint
+    except ImportError:
+        return None
+    other_vcs, root = gitlint.get_vcs_root()
+    if not other_vcs:
         return None
+    return set(vcs.normalize(root, filename)
+               for filename in other_vcs.modified_filenames())
+
+
+def load_graph(filename, base_path, test_filenames, modified_filenames,
+               options):
+    """Load a graph file and update it with the changes since it was written.
+
+    Args:
+        filename: str: the graph file, written by
+        "python -m pydependencies build-graph"
+        base_path: str: the base path of the sources
+        test_filenames: set: the collected test files
+        modified_filenames: set: the modified files according to the VCS.
+        They are used to find the added files.
+        options: dict: the arguments for dependency_graph
+
+    Returns:
+        the up to date direct dependencies graph.
+    """
+    with graphfile.GraphFile(filename, base_path=base_path) as graph_file:
+        graph = graph_file.to_dict()
+        stale_filenames = graph_file.changed_paths()
+
+    deleted = set(filename for filename in stale_filenames
+                  if not os.path.exists(filename))
+    added = set(filename for filename in modified_filenames
+                if filename not in graph and os.path.exists(filename))
+    return dependencies.update_graph(
+        graph, test_filenames, changed=stale_filenames - deleted,
+        added=added, deleted=deleted, **options)
+
+
+def analysis_options(config, base_path):
+    """Return the arguments of dependency_graph given by the options.
+
+    The caller must close options['cache'] if present.
+    """
+    templates_path = os.path.join(base_path, config.option.templates_path)
+    profile = _profile(config)
+    template_dialects = config.option.deps_template_dialects
+    options = dict(start_path=base_path, template_path=templates_path,
+                   workers=config.option.deps_workers,
+                   readers=config.option.deps_readers, profile=profile,
+                   template_dialects=template_dialects)
+    if config.option.deps_module_index:
+        with profile.phase('module_index'):
+            options['module_index'] = dependencies.ModuleIndex(base_path)
+            options['template_index'] = templates.TemplateIndex(
+                templates_path)
+    if config.option.deps_cache:
+        options['cache'] = cache.DependencyCache(
+            config.option.deps_cache_dir, start_path=base_path,
+            template_path=templates_path,
+            template_dialects=template_dialects)
+    return options
+
+
+def analyse_affected(config, base_path, test_filenames, modified_filenames):
+    """Return the test files affected by the modified files, in process.
 
-    return set(vcs.modified_filenames().iterkeys())
+    The dependency graph, if fully computed, is kept in config._deps_graph.
+
+    Returns:
+        a dict mapping the affected test files to their distance to the
+        modified files.
+    """
+    profile = _profile(config)
+    options = analysis_options(config, base_path)
+    try:
+        graph = None
+        if config.option.deps_graph:
+            with profile.phase('load_graph'):
+                graph = load_graph(config.option.deps_graph, base_path,
+                                   test_filenames, modified_filenames,
+                                   options)
+        elif config.option.deps_lazy:
+            del options['workers'], options['readers']
+            lazy_graph = dependencies.LazyDependencyGraph(**options)
+            return lazy_graph.affected_distances(modified_filenames,
+                                                 test_filenames)
+        else:
+            graph = dependencies.dependency_graph(test_filenames, **options)
+        config._deps_graph = graph
+        return dependencies.affected_distances(
+            modified_filenames, test_filenames, graph=graph, **options)
+    finally:
+        if 'cache' in options:
+            options['cache'].close()
+
+
+def with_recorded(distances, recorded, modified_filenames):
+    """Add the test files which accessed an affected or modified file.
+
+    A test file is one edge further from the modified files than the
+    closest file it accessed.
+
+    Args:
+        distances: dict: maps the roots affected by the modified files to
+        their distance to them
+        recorded: dict: the files accessed by each test file, as returned by
+        recorder.load_recorded
+        modified_filenames: set: the modified files, including the deleted ones
+
+    Returns:
+        distances, updated.
+    """
+    for test_filename, filenames in recorded.iteritems():
+        accessed_distances = [
+            0 if filename in modified_filenames else distances[filename]
+            for filename in filenames
+            if filename in modified_filenames or filename in distances]
+        if accessed_distances:
+            distance = min(accessed_distances) + 1
+            if distance < distances.get(test_filename, distance + 1):
+                distances[test_filename] = distance
+    return distances
+
+
+def analyse_tests(test_filenames, base_path):
+    """Return the direct dependencies of each test of the test files.
+
+    Returns:
+        a dict mapping each test file to the result of
+        dependencies.python_test_dependencies. Files which can not be parsed
+        are missing, so all their tests are selected.
+    """
+    test_dependencies = {}
+    package_cache = dependencies.PackageCache()
+    for test_filename in test_filenames:
+        try:
+            test_dependencies[test_filename] = \
+                dependencies.python_test_dependencies(
+                    test_filename, start_path=base_path,
+                    package_cache=package_cache)
+        except (EnvironmentError, SyntaxError):
+            pass
+    return test_dependencies
+
+
+def is_test_affected(item, changed_filenames, recorded, test_dependencies):
+    """Return whether a test of an affected test file is affected.
+
+    Args:
+        item: the pytest item
+        changed_filenames: set: the modified files and the affected roots
+        recorded: dict: the files recorded for each test file
+        test_dependencies: dict: the result of analyse_tests
+    """
+    test_filename = str(item.fspath)
+    file_dependencies = test_dependencies.get(test_filename)
+    if (file_dependencies is None or test_filename in changed_filenames or
+            not recorded.get(test_filename, set()).isdisjoint(
+                changed_filenames)):
+        return True
+    # A node id looks like path::Class::test_name[parameters].
+    parts = item.nodeid.split('::')
+    if len(parts) < 2:
+        return True
+    name = parts[1].split('[')[0]
+    if name not in file_dependencies:
+        return True
+    return not (file_dependencies[None].isdisjoint(changed_filenames) and
+                file_dependencies[name].isdisjoint(changed_filenames))
 
 
 def pytest_collection_modifyitems(session, config, items):
-    """Remove those tests which do not depend on the modified files."""
-    modified_filenames = get_modified_filenames()
+    """Remove those tests which do not depend on the modified files.
+
+    With --deps-prioritize the remaining tests are also reordered.
+    """
+    profile = _profile(config)
+    distances = {}
+    if config.option.dependencies:
+        with profile.phase('select'):
+            distances = _select_items(config, items, profile)
+    test_history = None
+    if config.option.deps_prioritize or config.option.deps_shard:
+        with history.RunHistory(config.option.deps_cache_dir) as run_history:
+            test_history = run_history.load()
+    if config.option.deps_shard:
+        with profile.phase('shard'):
+            _shard_items(config, items, test_history)
+    if config.option.deps_prioritize:
+        with profile.phase('prioritize'):
+            items[:] = history.prioritize(items, distances, test_history)
+
+
+def _shard_items(config, items, test_history):
+    """Keep in items only the ones of the shard given by --deps-shard."""
+    index, count = config.option.deps_shard
+    test_filenames = set(str(item.fspath) for item in items)
+    graph = getattr(config, '_deps_graph', None)
+    if graph is None or not test_filenames.issubset(graph):
+        base_path = os.path.abspath(config.option.base_path)
+        options = analysis_options(config, base_path)
+        try:
+            graph = dependencies.dependency_graph(
+                [filename for filename in test_filenames
+                 if os.path.exists(filename)], **options)
+        finally:
+            if 'cache' in options:
+                options['cache'].close()
+    closures = dependencies.DependencyGraph(graph).closure()
+    durations = {}
+    for item in items:
+        duration = test_history.get(item.nodeid)
+        if duration is not None:
+            filename = str(item.fspath)
+            durations[filename] = durations.get(filename, 0.0) + duration[1]
+    plan = shards.plan_shards(test_filenames, closures, durations, count)
+    shard_filenames = set(plan[index])
+    items[:] = [item for item in items
+                if str(item.fspath) in shard_filenames]
+
+
+def _select_items(config, items, profile):
+    """Keep in items only the ones affected by the modified files.
+
+    Returns:
+        a dict mapping the affected test files to their distance to the
+        modified files.
+    """
+    base_path = os.path.abspath(config.option.base_path)
+    with profile.phase('vcs'):
+        modified_filenames = get_modified_filenames(config.option.deps_base,
+                                                    base_path)
     if modified_filenames is None:
         print 'Only git and mercurial are supported. No tests were filtered'
-        return
+        return {}
 
     test_filenames = set(str(item.fspath) for item in items)
-    all_deps = dependencies.transitive_dependencies(test_filenames)
+    with profile.phase('recorded'):
+        recorded = recorder.load_recorded(config.option.deps_cache_dir,
+                                          base_path, test_filenames)
+    # The recorded files are analysed as well, they may depend on the
+    # modified files.
+    roots = test_filenames.union(
+        filename for filenames in recorded.itervalues()
+        for filename in filenames if os.path.exists(filename))
+    test_dependencies = {}
+    if config.option.deps_granularity == 'test':
+        with profile.phase('test_analysis'):
+            test_dependencies = analyse_tests(test_filenames, base_path)
+        roots.update(
+            filename for file_dependencies in test_dependencies.itervalues()
+            for filenames in file_dependencies.itervalues()
+            for filename in filenames if os.path.exists(filename))
+    distances = None
+    if os.path.exists(config.option.deps_socket):
+        analysis = daemon.describe_analysis(
+            base_path,
+            template_path=os.path.join(base_path,
+                                       config.option.templates_path),
+            template_dialects=config.option.deps_template_dialects,
+            graph=config.option.deps_graph)
+        try:
+            with profile.phase('daemon'):
+                distances = daemon.query_distances(
+                    modified_filenames, roots, analysis,
+                    socket_path=config.option.deps_socket)
+        except socket.error as e:
+            print 'The dependencies daemon was not used: %s' % e
+    if distances is None:
+        distances = analyse_affected(
+            config, base_path, roots, modified_filenames)
+    distances = with_recorded(distances, recorded, modified_filenames)
+    required_filenames = set(distances)
 
     # item.fspath could be None, so adding it to the list of filenames which we
     # need to check no matter what.
-    required_filenames = set(['None'])
-    for filename in test_filenames:
-        if (filename in modified_filenames or
-                all_deps[filename].intersection(modified_filenames)):
-            required_filenames.add(filename)
+    required_filenames.add('None')
 
     new_items = [item for item in items
                  if str(item.fspath) in required_filenames]
+    if test_dependencies:
+        changed_filenames = required_filenames.union(modified_filenames)
+        new_items = [item for item in new_items
+                     if is_test_affected(item, changed_filenames, recorded,
+                                         test_dependencies)]
 
+    profile.count('collected_tests', len(items))
+    profile.count('selected_tests', len(new_items))
     items[:] = new_items
+    return distances
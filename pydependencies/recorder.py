@@ -0,0 +1,276 @@
+"""Record the files each test file actually accesses while it runs.
+
+The static analysis misses files whose name is computed at runtime, e.g.
+open(os.path.join(DATA, name)), and modules imported with importlib. The
+recorder complements it: while the tests of a test file run (and while it is
+collected) every opened file and every newly imported module is recorded, and
+stored in a sqlite database next to the dependencies cache. A later run with
+--affected adds the recorded files as dependencies of their test file.
+
+Opened files are seen through an audit hook where sys.addaudithook exists
+(Python 3.8+) and otherwise by wrapping the builtin open and file, io.open
+and os.open, which codecs.open and most libraries end up calling. Imports
+are found by comparing sys.modules when the test file starts and when it is
+flushed, which sees the same modules as the import audit event at no cost per
+import statement.
+
+To keep the overhead low, the hook only adds the absolute name to the set of
+the current test file, so a test changing the working directory is recorded
+correctly. Filtering and writing happen once per test file, when the next
+test file starts.
+"""
+import io
+import os
+import sqlite3
+import sys
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+
+__all__ = ('Recorder', 'RecordedDependencies', 'load_recorded')
+
+DATABASE_NAME = 'recorded.sqlite'
+
+# The add method of the set of the test file being recorded, or None.
+_record = None
+_installed = False
+_builtin_open = builtins.open
+_builtin_file = getattr(builtins, 'file', None)
+_io_open = io.open
+_os_open = os.open
+
+
+def _audit_hook(event, args):
+    if _record is not None and event == 'open' and isinstance(args[0], str):
+        _record(os.path.abspath(args[0]))
+
+
+def _recording_open(name, *args, **kwargs):
+    if _record is not None and isinstance(name, basestring):
+        _record(os.path.abspath(name))
+    return _builtin_open(name, *args, **kwargs)
+
+
+def _recording_io_open(name, *args, **kwargs):
+    if _record is not None and isinstance(name, basestring):
+        _record(os.path.abspath(name))
+    return _io_open(name, *args, **kwargs)
+
+
+def _recording_os_open(name, *args, **kwargs):
+    if _record is not None and isinstance(name, basestring):
+        _record(os.path.abspath(name))
+    return _os_open(name, *args, **kwargs)
+
+
+if _builtin_file is not None:
+    class _FileType(type):
+        """Make the files opened before install instances of the wrapper."""
+        def __instancecheck__(cls, instance):
+            return isinstance(instance, _builtin_file)
+
+        def __subclasscheck__(cls, subclass):
+            return issubclass(subclass, _builtin_file)
+
+    class _RecordingFile(_builtin_file):
+        """The Python 2 file type, recording the files it opens."""
+        __metaclass__ = _FileType
+
+        def __init__(self, name, *args, **kwargs):
+            if _record is not None and isinstance(name, basestring):
+                _record(os.path.abspath(name))
+            _builtin_file.__init__(self, name, *args, **kwargs)
+
+
+def install():
+    """Install the hooks reporting the opened files.
+
+    An audit hook can not be removed, so it is installed once and does nothing
+    while no recorder is active.
+    """
+    global _installed
+    if _installed:
+        return
+    if hasattr(sys, 'addaudithook'):
+        sys.addaudithook(_audit_hook)
+    else:
+        builtins.open = _recording_open
+        io.open = _recording_io_open
+        os.open = _recording_os_open
+        if _builtin_file is not None:
+            builtins.file = _RecordingFile
+    _installed = True
+
+
+def uninstall():
+    """Remove the open wrappers, if they are used."""
+    global _installed
+    if _installed and not hasattr(sys, 'addaudithook'):
+        builtins.open = _builtin_open
+        io.open = _io_open
+        os.open = _os_open
+        if _builtin_file is not None:
+            builtins.file = _builtin_file
+        _installed = False
+
+
+def _source_filename(filename):
+    """Return the source of a compiled module, or filename."""
+    if filename.endswith(('.pyc', '.pyo')):
+        return filename[:-1]
+    return filename
+
+
+class RecordedDependencies(object):
+    """The database of the files accessed by each test file.
+
+    Paths are stored relative to base_path, as in graphfile.
+
+    Args:
+        path: str: directory where the database is stored. It is created if
+        needed.
+        base_path: str: the base path of the sources
+    """
+    def __init__(self, path, base_path='.'):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.base_path = os.path.abspath(base_path)
+        self._connection = sqlite3.connect(os.path.join(path, DATABASE_NAME))
+        self._connection.text_factory = str
+        # It is a cache, losing the last writes on a crash is fine.
+        self._connection.execute('PRAGMA synchronous = OFF')
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS recorded (
+                test_path TEXT PRIMARY KEY,
+                paths TEXT)""")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, unused_type, unused_value, unused_traceback):
+        self.close()
+
+    def set(self, test_filename, filenames):
+        """Replace the files recorded for a test file."""
+        self._connection.execute(
+            'INSERT OR REPLACE INTO recorded VALUES (?, ?)',
+            (os.path.relpath(test_filename, self.base_path),
+             '\0'.join(sorted(os.path.relpath(filename, self.base_path)
+                              for filename in filenames))))
+        self._connection.commit()
+
+    def load(self, test_filenames=None):
+        """Return a dict with the recorded files of each test file.
+
+        Args:
+            test_filenames: iterable: if given only these test files are loaded
+        """
+        if test_filenames is not None:
+            test_filenames = set(test_filenames)
+        recorded = {}
+        for test_path, paths in self._connection.execute(
+                'SELECT test_path, paths FROM recorded'):
+            test_filename = os.path.normpath(
+                os.path.join(self.base_path, test_path))
+            if test_filenames is not None and \
+                    test_filename not in test_filenames:
+                continue
+            recorded[test_filename] = set(
+                os.path.normpath(os.path.join(self.base_path, path))
+                for path in paths.split('\0') if path)
+        return recorded
+
+    def close(self):
+        self._connection.close()
+
+
+def load_recorded(path, base_path, test_filenames=None):
+    """Return the recorded files of each test file, or {} if none recorded."""
+    if not os.path.exists(os.path.join(path, DATABASE_NAME)):
+        return {}
+    with RecordedDependencies(path, base_path) as recorded:
+        return recorded.load(test_filenames)
+
+
+class Recorder(object):
+    """Record the files accessed by each test file and store them.
+
+    Call start with the test file whenever a test file starts being collected
+    or run, and close at the end of the session.
+
+    Args:
+        database: RecordedDependencies: where the recorded files are stored
+        ignored_paths: iterable: files under these directories are not
+        recorded, e.g. the cache directory
+    """
+    def __init__(self, database, ignored_paths=()):
+        self.database = database
+        self.base_path = database.base_path
+        self._prefix = os.path.join(self.base_path, '')
+        self._ignored = tuple(os.path.join(os.path.abspath(path), '')
+                              for path in ignored_paths)
+        self._touched = {}
+        self._modules = {}
+        self.current = None
+        install()
+
+    def start(self, test_filename):
+        """Attribute the accesses from now on to test_filename."""
+        global _record
+        if test_filename == self.current:
+            return
+        self.stop()
+        touched = self._touched.get(test_filename)
+        if touched is None:
+            touched = self._touched[test_filename] = set()
+            self._modules[test_filename] = set(sys.modules)
+        self.current = test_filename
+        _record = touched.add
+
+    def stop(self):
+        """Stop recording and add the imported modules to the current file."""
+        global _record
+        _record = None
+        if self.current is None:
+            return
+        known_modules = self._modules[self.current]
+        touched = self._touched[self.current]
+        for name, module in sys.modules.items():
+            if name not in known_modules:
+                filename = getattr(module, '__file__', None)
+                if filename:
+                    touched.add(_source_filename(filename))
+        self._modules[self.current] = set(sys.modules)
+        self.current = None
+
+    def _relevant(self, test_filename, filenames):
+        """Return the absolute paths of filenames under base_path."""
+        relevant = set()
+        for filename in filenames:
+            filename = os.path.abspath(filename)
+            if (filename.startswith(self._prefix) and
+                    not filename.startswith(self._ignored) and
+                    filename != test_filename and os.path.isfile(filename)):
+                relevant.add(filename)
+        return relevant
+
+    def flush(self, test_filename):
+        """Store the files recorded for test_filename."""
+        if test_filename == self.current:
+            self.stop()
+        touched = self._touched.pop(test_filename, None)
+        self._modules.pop(test_filename, None)
+        if touched is not None:
+            self.database.set(test_filename,
+                              self._relevant(test_filename, touched))
+
+    def close(self):
+        """Store the files recorded for the remaining test files."""
+        self.stop()
+        for test_filename in list(self._touched):
+            self.flush(test_filename)
+        self.database.close()
+        uninstall()
@@ -0,0 +1,108 @@
+"""Split the test files in shards run by different CI workers.
+
+Each worker runs py.test with --deps-shard=K/N and computes the same plan from
+the same inputs, the collected test files, the dependency graph and the
+durations of the run history, so the workers need no coordination, as long
+as they start from the same copy of the dependencies cache directory.
+
+The plan balances the estimated time of the shards. A shard pays for the
+duration of its tests and, once, for importing each file in the closures of
+its test files. Test files are placed greedily, longest first, on the shard
+whose estimated time grows the least, as long as it stays under the capacity
+of a shard, so test files sharing most of their dependencies end up in the
+same shard unless that unbalances it.
+"""
+import argparse
+
+
+__all__ = ('parse_shard', 'plan_shards')
+
+# Estimated seconds to import a file the shard did not import yet.
+MODULE_COST = 0.005
+
+# How much the estimated time of a shard may exceed the mean time of the
+# shards, to keep the test files sharing dependencies together.
+BALANCE_SLACK = 0.1
+
+
+def parse_shard(value):
+    """Return the (index, count) of a K/N shard, K starting at 1.
+
+    The index is 0 based. It raises argparse.ArgumentTypeError if value is
+    not valid, so it can be used as the type of an option.
+    """
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected K/N, e.g. 1/4, got %r' % value)
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(
+            'the shard %d is not between 1 and %d' % (index, count))
+    return index - 1, count
+
+
+def _bit_count(bitset):
+    return bin(bitset).count('1')
+
+
+def plan_shards(filenames, closures, durations, count,
+                module_cost=MODULE_COST):
+    """Return the test files of each shard.
+
+    Args:
+        filenames: iterable: the test files
+        closures: dependencies.ReachabilityMap: the transitive dependencies.
+        Test files missing from it only pay for their duration.
+        durations: dict: the estimated seconds of each test file. Missing
+        files are estimated with the median of the others.
+        count: int: the number of shards
+        module_cost: float: the estimated seconds to import a file
+
+    Returns:
+        a list of count lists of test files, each sorted.
+    """
+    filenames = sorted(set(filenames))
+    known_durations = sorted(durations[filename] for filename in filenames
+                             if filename in durations)
+    default_duration = (known_durations[len(known_durations) // 2]
+                        if known_durations else 1.0)
+    duration = dict((filename, durations.get(filename, default_duration))
+                    for filename in filenames)
+    bitsets = dict((filename, closures.bitset(filename)
+                    if filename in closures else 0)
+                   for filename in filenames)
+
+    # The mean time of the shards if every file was imported by one shard
+    # only, a lower bound of the time of the slowest shard.
+    union = 0
+    for bitset in bitsets.itervalues():
+        union |= bitset
+    mean = (sum(duration.itervalues()) +
+            _bit_count(union) * module_cost) / count
+    capacity = mean * (1 + BALANCE_SLACK)
+
+    shards = [[] for _ in xrange(count)]
+    loads = [0.0] * count
+    imported = [0] * count
+    # The longest test files first, as in the LPT scheduling heuristic.
+    for filename in sorted(filenames, key=lambda name: (-duration[name],
+                                                        name)):
+        bitset = bitsets[filename]
+        best = None
+        for shard in xrange(count):
+            new_modules = _bit_count(bitset & ~imported[shard])
+            cost = duration[filename] + new_modules * module_cost
+            load = loads[shard] + cost
+            # Shards over capacity are only used if all of them are, then
+            # the least loaded one is.
+            rank = ((load, 0, shard) if load > capacity
+                    else (-1, cost, loads[shard], shard))
+            if best is None or rank < best[0]:
+                best = (rank, load, shard)
+        unused_rank, load, shard = best
+        shards[shard].append(filename)
+        loads[shard] = load
+        imported[shard] |= bitset
+
+    return [sorted(shard) for shard in shards]
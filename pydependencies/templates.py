@@ -0,0 +1,177 @@
+"""Find the templates a template depends on.
+
+Templates are scanned through a read only memory map with a compiled regex,
+so the file is never copied into a string; only the matched paths are.
+
+The syntax of the dependencies is given by dialects. The mako dialect finds
+the file of the <%include>, <%inherit> and <%namespace> tags, quoted with
+either single or double quotes. The jinja dialect finds the templates of the
+{% include %}, {% extends %}, {% import %} and {% from %} statements. More
+dialects can be added with register_dialect.
+
+The paths are resolved as Mako does with the TemplateLookup of the project:
+paths starting with .. are relative to the directory of the template and the
+others are relative to the template path. A TemplateIndex lists the templates
+once, so resolving a path is a dictionary lookup.
+"""
+import mmap
+import os
+import re
+
+
+__all__ = ('TemplateIndex', 'parse_dialects', 'register_dialect',
+           'template_dependencies')
+
+DEFAULT_DIALECTS = ('mako',)
+
+_DIALECTS = {}
+
+
+def register_dialect(name, pattern, flags=0):
+    """Register the syntax of the dependencies of a template language.
+
+    Args:
+        name: str: the name of the dialect
+        pattern: str: a regex matching a dependency. The group named path, or
+        else the one named single_quoted, is the path of the dependency.
+        flags: int: re flags, besides re.DOTALL
+    """
+    regex = re.compile(pattern, flags | re.DOTALL)
+    if 'path' not in regex.groupindex:
+        raise ValueError('the pattern of %s has no group named path' % name)
+    _DIALECTS[name] = regex
+
+
+register_dialect('mako', r"""
+    <%(?:include|inherit|namespace)\b[^>]*?\bfile\s*=\s*
+    (?:"(?P<path>[^"]*)"|'(?P<single_quoted>[^']*)')
+""", re.VERBOSE)
+register_dialect('jinja', r"""
+    \{%-?\s*(?:include|extends|import|from)\s+
+    (?:"(?P<path>[^"]*)"|'(?P<single_quoted>[^']*)')
+""", re.VERBOSE)
+
+
+def parse_dialects(value):
+    """Return the tuple of dialect names of a comma separated list.
+
+    The names are not checked, as dialects may be registered later.
+    """
+    return tuple(name.strip() for name in value.split(',') if name.strip())
+
+
+def _dialects_regex(dialects):
+    """Return the regexes of the given dialect names."""
+    try:
+        return [_DIALECTS[name] for name in dialects]
+    except KeyError as e:
+        raise ValueError('unknown template dialect: %s' % e.args[0])
+
+
+def _scan_content(content, regexes):
+    """Return the paths matched by the regexes in content."""
+    paths = []
+    for regex in regexes:
+        for match in regex.finditer(content):
+            path = match.group('path')
+            if path is None and 'single_quoted' in regex.groupindex:
+                path = match.group('single_quoted')
+            if path is not None:
+                paths.append(path)
+    return paths
+
+
+def scan(filename, dialects=DEFAULT_DIALECTS, content=None):
+    """Return the paths of the dependencies written in a template.
+
+    Args:
+        filename: str: the filename of the template
+        dialects: tuple: the names of the dialects used to find the
+        dependencies
+        content: str: the content of the template, if it was already read.
+        Otherwise the file is memory mapped.
+    """
+    regexes = _dialects_regex(dialects)
+    if content is not None:
+        return _scan_content(content, regexes)
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        # Empty files can not be mapped.
+        if not size:
+            return []
+        content = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        try:
+            return _scan_content(content, regexes)
+        finally:
+            content.close()
+
+
+def _template_filename(template_path, path):
+    """Return the normalized filename of a path relative to template_path."""
+    return os.path.normpath(os.path.join(template_path, path.strip('/')))
+
+
+class TemplateIndex(object):
+    """Map the paths relative to the template path to the templates.
+
+    The template path is listed once, when created.
+
+    Args:
+        template_path: str: path where the templates are located
+    """
+    def __init__(self, template_path):
+        self.template_path = template_path
+        self._templates = {}
+        for directory, dirnames, filenames in os.walk(template_path):
+            dirnames[:] = [name for name in dirnames
+                           if not name.startswith('.')]
+            relative_directory = os.path.relpath(directory, template_path)
+            for name in filenames:
+                relative_path = os.path.normpath(
+                    os.path.join(relative_directory, name))
+                self._templates[relative_path] = _template_filename(
+                    template_path, relative_path)
+
+    def __contains__(self, path):
+        return os.path.normpath(path.strip('/')) in self._templates
+
+    def __len__(self):
+        return len(self._templates)
+
+    def get(self, path):
+        """Return the filename of a path relative to the template path.
+
+        Templates which do not exist are resolved as if they did.
+        """
+        filename = self._templates.get(path.strip('/'))
+        if filename is None:
+            filename = _template_filename(self.template_path, path)
+        return filename
+
+
+def template_dependencies(filename, template_path='./templates',
+                          dialects=DEFAULT_DIALECTS, template_index=None,
+                          content=None):
+    """Return the direct dependencies of a template.
+
+    Args:
+        filename: str: the filename of the template
+        template_path: str: path where the templates are located
+        dialects: tuple: the names of the dialects used to find the
+        dependencies
+        template_index: TemplateIndex: if given the paths are resolved with it
+        content: str: the content of the template, if it was already read
+
+    Returns:
+        a set with the filenames of the templates it depends on.
+    """
+    dependencies = set()
+    for path in scan(filename, dialects, content=content):
+        if path.startswith('..'):
+            dependencies.add(os.path.normpath(
+                os.path.join(os.path.dirname(filename), path)))
+        elif template_index is not None:
+            dependencies.add(template_index.get(path))
+        else:
+            dependencies.add(_template_filename(template_path, path))
+    return dependencies
@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import cache
+import dependencies
+
+
+class TestDependencyCache(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.root, 'cache')
+        self.filename = os.path.join(self.root, 'a.py')
+        with open(self.filename, 'w') as f:
+            f.write('import b\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_get_missing(self):
+        with cache.DependencyCache(self.cache_path) as deps_cache:
+            self.assertIsNone(deps_cache.get(self.filename))
+            self.assertIsNone(deps_cache.get(
+                os.path.join(self.root, 'unexistent.py')))
+
+    def test_set_get(self):
+        with cache.DependencyCache(self.cache_path) as deps_cache:
+            deps_cache.set(self.filename, set(['b.py', 'c.txt']))
+        with cache.DependencyCache(self.cache_path) as deps_cache:
+            self.assertEqual(set(['b.py', 'c.txt']),
+                             deps_cache.get(self.filename))
+            self.assertEqual(1, deps_cache.hits)
+
+    def test_set_get_empty(self):
+        with cache.DependencyCache(self.cache_path) as deps_cache:
+            deps_cache.set(self.filename, set())
+            self.assertEqual(set(), deps_cache.get(self.filename))
+
+    def test_touched_file_same_content(self):
+        with cache.DependencyCache(self.cache_path) as deps_cache:
+            deps_cache.set(self.filename, set(['b.py']))
+        os.utime(self.filename, (0, 0))
+        with cache.DependencyCache(self.cache_path) as deps_cache:
+            self.assertEqual(set(['b.py']), deps_cache.get(self.filename))
+
+    def test_modified_file(self):
+        with cache.DependencyCache(self.cache_path) as deps_cache:
+            deps_cache.set(self.filename, set(['b.py']))
+        with open(self.filename, 'w') as f:
+            f.write('import b\nimport c\n')
+        os.utime(self.filename, (0, 0))
+        with cache.DependencyCache(self.cache_path) as deps_cache:
+            self.assertIsNone(deps_cache.get(self.filename))
+            self.assertEqual(1, deps_cache.misses)
+
+    def test_invalidated_by_analysis_parameters(self):
+        with cache.DependencyCache(self.cache_path) as deps_cache:
+            deps_cache.set(self.filename, set(['b.py']))
+        with cache.DependencyCache(self.cache_path,
+                                   start_path='src') as deps_cache:
+            self.assertIsNone(deps_cache.get(self.filename))
+
+    def test_invalidated_by_functions(self):
+        functions = (('open', 0, None),)
+        with cache.DependencyCache(self.cache_path,
+                                   functions=functions) as deps_cache:
+            deps_cache.set(self.filename, set(['b.py']))
+        with cache.DependencyCache(self.cache_path,
+                                   functions=functions) as deps_cache:
+            self.assertEqual(set(['b.py']), deps_cache.get(self.filename))
+        with cache.DependencyCache(
+                self.cache_path,
+                functions=(('open', 0, lambda x: x.strip('/')),)) as deps_cache:
+            self.assertIsNone(deps_cache.get(self.filename))
+
+    def test_transitive_dependencies_uses_cache(self):
+        b_filename = os.path.join(self.root, 'b.py')
+        with open(b_filename, 'w') as f:
+            f.write('')
+        with cache.DependencyCache(self.cache_path,
+                                   start_path=self.root) as deps_cache:
+            expected_deps = dependencies.transitive_dependencies(
+                [self.filename], start_path=self.root, cache=deps_cache)
+        with mock.patch.object(dependencies, 'python_dependencies') as parse, \
+                cache.DependencyCache(self.cache_path,
+                                      start_path=self.root) as deps_cache:
+            deps = dependencies.transitive_dependencies(
+                [self.filename], start_path=self.root, cache=deps_cache)
+        self.assertFalse(parse.called)
+        self.assertEqual(expected_deps, deps)
+        self.assertEqual(set([self.filename, b_filename]),
+                         deps[self.filename])
+
+    def test_invalidated_by_added_module(self):
+        b_filename = os.path.join(self.root, 'b.py')
+        with cache.DependencyCache(self.cache_path,
+                                   start_path=self.root) as deps_cache:
+            deps = dependencies.transitive_dependencies(
+                [self.filename], start_path=self.root, cache=deps_cache)
+        self.assertEqual(set([self.filename]), deps[self.filename])
+        with open(b_filename, 'w') as f:
+            f.write('')
+        with cache.DependencyCache(self.cache_path,
+                                   start_path=self.root) as deps_cache:
+            deps = dependencies.transitive_dependencies(
+                [self.filename], start_path=self.root, cache=deps_cache)
+            # a.py is analysed again, and b.py for the first time.
+            self.assertEqual(2, deps_cache.misses)
+        self.assertEqual(set([self.filename, b_filename]),
+                         deps[self.filename])
+
+    def test_invalidated_by_deleted_package_module(self):
+        package = os.path.join(self.root, 'pkg')
+        os.makedirs(package)
+        for name in ('__init__.py', 'c.py', 'd.py'):
+            with open(os.path.join(package, name), 'w') as f:
+                f.write('')
+        with open(self.filename, 'w') as f:
+            f.write('import pkg.c\n')
+        d_filename = os.path.join(package, 'd.py')
+        with cache.DependencyCache(self.cache_path,
+                                   start_path=self.root) as deps_cache:
+            dependencies.transitive_dependencies(
+                [self.filename, d_filename], start_path=self.root,
+                cache=deps_cache)
+        os.remove(os.path.join(package, 'c.py'))
+        with cache.DependencyCache(self.cache_path,
+                                   start_path=self.root) as deps_cache:
+            self.assertIsNone(deps_cache.get(self.filename))
+            # d.py may import pkg.c implicitly.
+            self.assertIsNone(deps_cache.get(d_filename))
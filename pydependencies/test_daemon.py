@@ -0,0 +1,144 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+import daemon
+
+
+class FakeWatcher(object):
+    def __init__(self):
+        self.changes = []
+
+    def read(self):
+        changes = set().union(*self.changes)
+        self.changes = []
+        return changes
+
+
+class TestWatchers(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.filename = os.path.join(self.root, 'a.py')
+        with open(self.filename, 'w') as f:
+            f.write('')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def check_watcher(self, watcher):
+        self.assertEqual(set(), watcher.read())
+        with open(self.filename, 'w') as f:
+            f.write('import b\n')
+        new_directory = os.path.join(self.root, 'pkg')
+        os.makedirs(new_directory)
+        new_filename = os.path.join(new_directory, 'c.py')
+        with open(new_filename, 'w') as f:
+            f.write('')
+        watcher.wait(0.1)
+        self.assertTrue(set([self.filename, new_filename]) <= watcher.read())
+        os.remove(self.filename)
+        watcher.wait(0.1)
+        self.assertEqual(set([self.filename]), watcher.read())
+
+    def test_polling_watcher(self):
+        self.check_watcher(daemon.PollingWatcher(self.root, interval=0))
+
+    def test_inotify_watcher(self):
+        try:
+            watcher = daemon.InotifyWatcher(self.root)
+        except (OSError, AttributeError):
+            self.skipTest('inotify is not available')
+        try:
+            self.check_watcher(watcher)
+        finally:
+            watcher.close()
+
+
+class TestDependencyServer(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for name, content in [('test_a.py', 'import a\n'),
+                              ('test_b.py', 'import b\n'),
+                              ('a.py', ''),
+                              ('b.py', '')]:
+            self.write(name, content)
+        self.watcher = FakeWatcher()
+        self.server = daemon.DependencyServer(
+            [self.path('test_a.py')], self.watcher, start_path=self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def write(self, name, content):
+        with open(self.path(name), 'w') as f:
+            f.write(content)
+
+    def test_affected(self):
+        roots = [self.path('test_a.py'), self.path('test_b.py')]
+        self.assertEqual(set([self.path('test_b.py')]),
+                         self.server.affected([self.path('b.py')], roots))
+        self.assertIn(self.path('test_b.py'), self.server.roots)
+
+    def test_affected_after_change(self):
+        roots = [self.path('test_a.py')]
+        self.assertEqual(set(),
+                         self.server.affected([self.path('b.py')], roots))
+        self.write('a.py', 'import b\n')
+        self.watcher.changes.append(set([self.path('a.py')]))
+        self.assertEqual(set(roots),
+                         self.server.affected([self.path('b.py')], roots))
+
+    def test_changed_files_are_analysed_again(self):
+        roots = [self.path('test_a.py')]
+        self.write('a.py', 'import b\n')
+        self.assertEqual(set(roots),
+                         self.server.affected([self.path('a.py')], roots))
+        self.assertEqual(set([self.path('b.py')]),
+                         self.server.graph[self.path('a.py')])
+
+    def test_handle_other_analysis(self):
+        analysis = daemon.describe_analysis(self.root)
+        self.assertNotIn('error', self.server.handle({'analysis': analysis}))
+        for other_analysis in [
+                daemon.describe_analysis('/other'),
+                daemon.describe_analysis(self.root, template_path='/other'),
+                daemon.describe_analysis(self.root,
+                                         template_dialects=('jinja',)),
+                daemon.describe_analysis(self.root,
+                                         functions=(('open', 0, None),)),
+                daemon.describe_analysis(self.root, graph='graph.bin'),
+                {}]:
+            self.assertIn('error',
+                          self.server.handle({'analysis': other_analysis}))
+
+    def test_query_distances(self):
+        socket_path = self.path('daemon.sock')
+        server = daemon.create_server(self.server, socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            self.assertEqual(
+                {self.path('test_a.py'): 1},
+                daemon.query_distances([self.path('a.py')],
+                                       [self.path('test_a.py')],
+                                       daemon.describe_analysis(self.root),
+                                       socket_path=socket_path))
+            self.assertRaises(socket.error, daemon.query_distances, [], [],
+                              daemon.describe_analysis(
+                                  self.root, template_dialects=('jinja',)),
+                              socket_path=socket_path)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_query_distances_not_running(self):
+        self.assertRaises(socket.error, daemon.query_distances, [], [],
+                          daemon.describe_analysis(self.root),
+                          socket_path=self.path('missing.sock'))
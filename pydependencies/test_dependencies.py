@@ -1,5 +1,9 @@
 import ast
+import multiprocessing.pool
 import os.path
+import random
+import shutil
+import StringIO
 import tempfile
 import textwrap
 import unittest
@@ -26,6 +30,15 @@ class TestDependencyVisitor(unittest.TestCase):
         # A later step will filter it if it is not a module.
         self.assertEqual(['foo', 'foo.bar'], visitor.modules)
 
+    def test_relative_import(self):
+        node = ast.parse(
+            'from . import foo\nfrom ..bar import baz')
+        visitor = dependencies.DependencyVisitor()
+        visitor.visit(node)
+        self.assertEqual(['.', '.foo', '..bar', '..bar.baz'], visitor.modules)
+        self.assertEqual(set(['.', '.foo', '..', '..bar', '..bar.baz']),
+                         dependencies._extend_with_submodules(visitor.modules))
+
     def test_import(self):
         node = ast.parse(
             'import foo as bar')
@@ -83,6 +96,125 @@ class TestDependencyVisitor(unittest.TestCase):
         self.assertEqual([], visitor.filenames)
 
 
+class TestConstants(unittest.TestCase):
+    def filenames(self, source, filename=None):
+        visitor = dependencies.DependencyVisitor(
+            functions=[('open', 0, None)], filename=filename)
+        visitor.visit(ast.parse(textwrap.dedent(source)))
+        return visitor.filenames
+
+    def test_module_constant(self):
+        self.assertEqual([os.path.join('data', 'x.csv')], self.filenames("""
+            def f():
+                open(os.path.join(DATA, 'x.csv'))
+            DATA = 'data'
+            """))
+
+    def test_function_constant(self):
+        self.assertEqual(['foo'], self.filenames("""
+            def f():
+                filename = 'foo'
+                open(filename)
+            """))
+
+    def test_not_constant(self):
+        # Only the module NAME is visible from the method of A.
+        self.assertEqual(['a'], self.filenames("""
+            NAME = 'a'
+            OTHER = 'b'
+            OTHER = 'c'
+            def f(NAME):
+                open(NAME)
+                open(OTHER)
+            class A(object):
+                NAME = 'd'
+                def f(self):
+                    open(NAME)
+            a = b
+            b = a
+            open(a)
+            """))
+
+    def test_operations(self):
+        self.assertEqual(['a.txt', 'b.txt', 'c.txt', 'd/e'], self.filenames("""
+            from os.path import join as j
+            open('%s.txt' % 'a')
+            open('b' + '.txt')
+            open('{}.txt'.format('c'))
+            open(j('d', 'e'))
+            """))
+
+    def test_format_lookups(self):
+        # Attribute and index lookups are not folded.
+        self.assertEqual(['a0b'], self.filenames("""
+            NAME = '{0.foo}'
+            open(NAME.format('x'))
+            open('{0.__class__}'.format('x'))
+            open('{0[0]}'.format('x'))
+            open('{}{0}'.format('x'))
+            open('a{0}b'.format('0'))
+            """))
+
+    def test_file(self):
+        self.assertEqual(['/src/data.txt'], self.filenames("""
+            open(os.path.join(os.path.dirname(__file__), 'data.txt'))
+            """, filename='/src/module.py'))
+
+    def test_class_and_global(self):
+        self.assertEqual(['d', 'p'], self.filenames("""
+            class A(object):
+                NAME = 'd'
+                open(NAME)
+            def f():
+                global P
+                open(P)
+            P = 'p'
+            """))
+
+    def test_nested_call(self):
+        self.assertEqual(['a.txt'], self.filenames("f(open('a.txt'))"))
+
+
+class TestFunctionMatcher(unittest.TestCase):
+    def test_match_in_spec_order(self):
+        matcher = dependencies.FunctionMatcher(
+            [('*open', 1, None), ('open', 0, None), ('load', 0, None)])
+        self.assertEqual(((1, None), (0, None)), matcher.match('open'))
+        self.assertEqual(((1, None),), matcher.match('gzopen'))
+        self.assertEqual(((0, None),), matcher.match('load'))
+        self.assertEqual((), matcher.match('opener'))
+
+    def test_match_character_set(self):
+        matcher = dependencies.FunctionMatcher([('[gb]zopen', 0, None)])
+        self.assertEqual(((0, None),), matcher.match('bzopen'))
+        self.assertEqual((), matcher.match('xzopen'))
+        self.assertTrue(matcher.may_call('f = bzopen("x")'))
+        self.assertFalse(matcher.may_call('f = xzopen("x")'))
+
+    def test_may_call(self):
+        matcher = dependencies.FunctionMatcher([('*open', 0, None)])
+        self.assertTrue(matcher.may_call('gzip.gzopen  (\n"x")'))
+        self.assertFalse(matcher.may_call('opener("x")'))
+        self.assertFalse(dependencies.FunctionMatcher([]).may_call('open()'))
+
+    def test_compile_functions(self):
+        functions = (('*open', 0, None),)
+        matcher = dependencies.compile_functions(functions)
+        self.assertIs(matcher, dependencies.compile_functions(functions))
+        self.assertIs(matcher, dependencies.compile_functions(matcher))
+        self.assertEqual(functions, tuple(matcher))
+        self.assertEqual(
+            [['*open', 0, None]],
+            list(dependencies.compile_functions([['*open', 0, None]])))
+
+    def test_first_string_argument_wins(self):
+        node = ast.parse('open(name, x="foo.txt")')
+        visitor = dependencies.DependencyVisitor(
+            functions=[('open', 0, None), ('*open', 'x', str.upper)])
+        visitor.visit(node)
+        self.assertEqual(['FOO.TXT'], visitor.filenames)
+
+
 class TestDependenciesUtils(unittest.TestCase):
     def test_extend_with_submodules(self):
         extended_deps = dependencies._extend_with_submodules(
@@ -123,6 +255,37 @@ class TestDependenciesUtils(unittest.TestCase):
         }
         self.assertEqual(expected_nodes, reachable_nodes)
 
+    def test_reachable_with_components(self):
+        graph = {
+            'a': set('bc'),
+            'b': set('a'),
+            'c': set('de'),
+            'd': set('c'),
+            'e': set('f'),
+        }
+        reachable_nodes = dependencies._reachable(graph)
+        expected_nodes = {
+            'a': set('abcdef'),
+            'b': set('abcdef'),
+            'c': set('cdef'),
+            'd': set('cdef'),
+            'e': set('ef'),
+            'f': set('f'),
+        }
+        self.assertEqual(expected_nodes, reachable_nodes)
+        self.assertTrue(reachable_nodes.reaches_any('d', ['f', 'unknown']))
+        self.assertFalse(reachable_nodes.reaches_any('e', ['a', 'c']))
+
+    def test_strongly_connected_components(self):
+        adjacency = [[1], [2], [0, 3], [], [3]]
+        components = dependencies._strongly_connected_components(adjacency)
+        self.assertEqual([[3], [2, 1, 0], [4]], components)
+
+    def test_iter_bits(self):
+        self.assertEqual([], list(dependencies._iter_bits(0)))
+        self.assertEqual([0, 3, 64],
+                         list(dependencies._iter_bits(1 | 8 | 1 << 64)))
+
     def test_get_modules_filenames(self):
         filenames = {
             os.path.join('start', 'foo.py'): False,
@@ -145,6 +308,13 @@ class TestDependenciesUtils(unittest.TestCase):
                 start_path='start')
         self.assertItemsEqual(expected_filenames, filenames)
 
+    def test_get_modules_filenames_with_index(self):
+        index = mock.Mock()
+        index.get.side_effect = {'foo': 'start/foo.py'}.get
+        filenames = dependencies._get_modules_filenames(
+            ['foo', 'unexistent'], start_path='start', module_index=index)
+        self.assertEqual(['start/foo.py'], filenames)
+
     def test_html_dependencies(self):
         content = """
         <html>
@@ -206,7 +376,574 @@ class TestDependenciesUtils(unittest.TestCase):
             'a.txt': []
         }
         expected_deps = dependencies._reachable(deps)
-        with mock.patch('dependencies.python_dependencies', side_effect=lambda x: set(deps.get(x, []))), \
-                mock.patch('dependencies.html_dependencies', side_effect=lambda x: set(deps.get(x, []))):
+        with mock.patch.object(dependencies, 'python_dependencies', side_effect=lambda x, **kwargs: set(deps.get(x, []))), \
+                mock.patch.object(dependencies, 'html_dependencies', side_effect=lambda x, **kwargs: set(deps.get(x, []))):
             transitive_deps = dependencies.transitive_dependencies(filenames)
         self.assertEqual(expected_deps, transitive_deps)
+
+    def test_dependency_graph(self):
+        deps = {
+            'a.py': ['b.py', 'a.txt'],
+            'b.py': ['a.py'],
+            'a.txt': [],
+        }
+        with mock.patch.object(dependencies, 'python_dependencies', side_effect=lambda x, **kwargs: set(deps.get(x, []))):
+            graph = dependencies.dependency_graph(['a.py'])
+        expected_graph = {
+            'a.py': set(['b.py', 'a.txt']),
+            'b.py': set(['a.py']),
+            'a.txt': set(['a.txt']),
+        }
+        self.assertEqual(expected_graph, graph)
+
+    def test_affected_by(self):
+        graph = {
+            'test_a.py': set(['a.py']),
+            'test_b.py': set(['b.py']),
+            'test_c.py': set(['c.py']),
+            'a.py': set(['b.py']),
+            'b.py': set(['a.py', 'b.txt']),
+            'c.py': set(),
+            'b.txt': set(['b.txt']),
+        }
+        roots = ['test_a.py', 'test_b.py', 'test_c.py']
+        self.assertEqual(
+            set(['test_a.py', 'test_b.py']),
+            dependencies.affected_by(['b.txt'], roots, graph=graph))
+        self.assertEqual(
+            set(['test_c.py']),
+            dependencies.affected_by(['test_c.py'], roots, graph=graph))
+        self.assertEqual(
+            set(), dependencies.affected_by(['unknown.py'], roots, graph=graph))
+        self.assertEqual(
+            {'test_a.py': 3, 'test_b.py': 2},
+            dependencies.affected_distances(['b.txt'], roots, graph=graph))
+        self.assertEqual(
+            {'test_c.py': 0},
+            dependencies.affected_distances(['test_c.py'], roots, graph=graph))
+
+
+class TestDependencyGraph(unittest.TestCase):
+    graph = {
+        'a': set(['b', 'c']),
+        'b': set(['a']),
+        'c': set(['d']),
+        'e': set(),
+    }
+
+    def test_mapping(self):
+        compact_graph = dependencies.DependencyGraph(self.graph)
+        expected = dict(self.graph, d=set())
+        self.assertEqual(expected, dict(compact_graph))
+        self.assertEqual(len(expected), len(compact_graph))
+        self.assertIn('d', compact_graph)
+        self.assertNotIn('f', compact_graph)
+        self.assertRaises(KeyError, compact_graph.__getitem__, 'f')
+
+    def test_nodes(self):
+        compact_graph = dependencies.DependencyGraph(self.graph)
+        node = compact_graph.node('a')
+        self.assertEqual('a', node.path)
+        self.assertEqual(['b', 'c'],
+                         [successor.path for successor in node.dependencies])
+        self.assertEqual(node, compact_graph.node('a'))
+        self.assertIn(node, node.dependencies[0].dependencies)
+
+    def test_closure(self):
+        closure = dependencies.DependencyGraph(self.graph).closure()
+        self.assertEqual(dict(dependencies._reachable(self.graph)),
+                         dict(closure))
+        self.assertEqual(repr(dict(closure)), repr(closure))
+
+
+def _unpicklable_dependencies(filename, **unused_options):
+    return set([lambda: filename])
+
+
+def _exit_worker(filename, **unused_options):
+    os._exit(1)
+
+
+class TestDependencyGraphTree(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        sources = {
+            'test_a.py': 'import a\nimport pkg.c\n',
+            'a.py': 'import b\nopen("data.txt")\n',
+            'b.py': 'import a\n',
+            'pkg/__init__.py': '',
+            'pkg/c.py': 'from pkg import d\n',
+            'pkg/d.py': '',
+        }
+        for name, content in sources.iteritems():
+            filename = os.path.join(self.root, name)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'w') as f:
+                f.write(content)
+        self.roots = [os.path.join(self.root, 'test_a.py')]
+        self.options = dict(start_path=self.root,
+                            functions=(('open', 0, None),))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_parallel_equals_serial(self):
+        graph = dependencies.dependency_graph(self.roots, **self.options)
+        self.assertEqual(7, len(graph))
+        parallel_graph = dependencies.dependency_graph(
+            self.roots, workers=3, **self.options)
+        self.assertEqual(graph, parallel_graph)
+
+    def test_readers_equals_serial(self):
+        graph = dependencies.dependency_graph(self.roots, **self.options)
+        with mock.patch.object(dependencies, 'READ_AHEAD', 1):
+            read_ahead_graph = dependencies.dependency_graph(
+                self.roots, readers=2, **self.options)
+        self.assertEqual(graph, read_ahead_graph)
+
+    def test_readers_error(self):
+        with mock.patch.object(dependencies, '_read_source',
+                               side_effect=IOError('read failed')):
+            self.assertRaises(IOError, dependencies.dependency_graph,
+                              self.roots, readers=2, **self.options)
+
+    def test_parallel_error(self):
+        with open(os.path.join(self.root, 'b.py'), 'w') as f:
+            f.write('import (\n')
+        self.assertRaises(SyntaxError, dependencies.dependency_graph,
+                          self.roots, workers=2, **self.options)
+
+    def test_parallel_unpicklable_result(self):
+        with mock.patch.object(dependencies, 'WORKER_CHECK_INTERVAL', 0.1), \
+                mock.patch.object(dependencies, '_direct_dependencies',
+                                  _unpicklable_dependencies):
+            self.assertRaises(multiprocessing.pool.MaybeEncodingError,
+                              dependencies.dependency_graph,
+                              self.roots, workers=2, **self.options)
+
+    def test_parallel_killed_worker(self):
+        with mock.patch.object(dependencies, 'WORKER_CHECK_INTERVAL', 0.1), \
+                mock.patch.object(dependencies, '_direct_dependencies',
+                                  _exit_worker):
+            self.assertRaises(RuntimeError, dependencies.dependency_graph,
+                              self.roots, workers=2, **self.options)
+
+    def test_main(self):
+        with mock.patch('sys.stdout', new_callable=StringIO.StringIO) as out:
+            dependencies.main(['pydependencies'] + self.roots)
+        # The closures are printed as a dict, followed by their sizes.
+        deps = eval(out.getvalue().split('\n[')[0], {'set': set})
+        self.assertIn(self.roots[0], deps[self.roots[0]])
+
+    def test_module_index(self):
+        modules = ['a', 'b', 'pkg', 'pkg.c', 'pkg.d', 'pkg.unexistent',
+                   'unexistent', 'test_a']
+        index = dependencies.ModuleIndex(self.root)
+        self.assertEqual(
+            dependencies._get_modules_filenames(modules, start_path=self.root),
+            dependencies._get_modules_filenames(modules, module_index=index))
+        self.assertIn('pkg.d', index)
+        self.assertNotIn('pkg.unexistent', index)
+
+    def test_module_index_roots_precedence(self):
+        other_root = os.path.join(self.root, 'pkg')
+        index = dependencies.ModuleIndex([other_root, self.root])
+        self.assertEqual(os.path.join(other_root, 'c.py'), index.get('c'))
+        self.assertEqual(os.path.join(self.root, 'a.py'), index.get('a'))
+        self.assertEqual(os.path.join(self.root, 'pkg', '__init__.py'),
+                         index.get('pkg'))
+
+    def test_module_index_module_before_package(self):
+        os.makedirs(os.path.join(self.root, 'a'))
+        with open(os.path.join(self.root, 'a', '__init__.py'), 'w'):
+            pass
+        index = dependencies.ModuleIndex(self.root)
+        self.assertEqual(os.path.join(self.root, 'a.py'), index.get('a'))
+
+    def test_dependency_graph_with_index(self):
+        graph = dependencies.dependency_graph(self.roots, **self.options)
+        index = dependencies.ModuleIndex(self.root)
+        with mock.patch('os.path.exists') as exists:
+            indexed_graph = dependencies.dependency_graph(
+                self.roots, module_index=index, **self.options)
+        self.assertFalse(exists.called)
+        self.assertEqual(graph, indexed_graph)
+
+    def test_lazy_iter_dependencies(self):
+        expected = dependencies.transitive_dependencies(self.roots,
+                                                        **self.options)
+        lazy_graph = dependencies.LazyDependencyGraph(**self.options)
+        reached = list(lazy_graph.iter_dependencies(self.roots[0]))
+        self.assertEqual(len(set(reached)), len(reached))
+        self.assertEqual(expected[self.roots[0]], set(reached))
+        self.assertEqual(expected[self.roots[0]],
+                         set(lazy_graph.iter_dependencies(self.roots[0])))
+
+    def test_lazy_reaches_any(self):
+        lazy_graph = dependencies.LazyDependencyGraph(**self.options)
+        a, b = os.path.join(self.root, 'a.py'), os.path.join(self.root, 'b.py')
+        with mock.patch.object(dependencies, '_direct_dependencies',
+                               wraps=dependencies._direct_dependencies) as \
+                direct_dependencies:
+            self.assertTrue(lazy_graph.reaches_any(self.roots[0], [a]))
+            # The target is a direct dependency, so only the root is parsed.
+            self.assertEqual(1, direct_dependencies.call_count)
+            self.assertTrue(lazy_graph.reaches_any(b, [a]))
+            self.assertFalse(lazy_graph.reaches_any(
+                self.roots[0], [os.path.join(self.root, 'other.py')]))
+            call_count = direct_dependencies.call_count
+            # The closure of the root is memoized.
+            self.assertFalse(lazy_graph.reaches_any(
+                self.roots[0], [os.path.join(self.root, 'another.py')]))
+            self.assertTrue(lazy_graph.reaches_any(self.roots[0],
+                                                   ['data.txt']))
+            self.assertEqual(call_count, direct_dependencies.call_count)
+
+    def test_lazy_affected(self):
+        changed = [os.path.join(self.root, 'pkg/d.py')]
+        roots = self.roots + [os.path.join(self.root, 'b.py')]
+        lazy_graph = dependencies.LazyDependencyGraph(**self.options)
+        self.assertEqual(
+            dependencies.affected_by(changed, roots, **self.options),
+            lazy_graph.affected(changed, roots))
+        self.assertEqual(
+            dependencies.affected_distances(changed, roots, **self.options),
+            lazy_graph.affected_distances(changed, roots))
+
+
+class TestRelativeImports(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        sources = {
+            'helpers.py': '',
+            'top.py': '',
+            'app/__init__.py': '',
+            'app/helpers.py': '',
+            'app/models.py': 'import helpers\nimport top\n',
+            'app/absolute.py': 'from __future__ import absolute_import\n'
+                               'import helpers\n',
+            'app/views.py': 'from . import models\n'
+                            'from .lib.util import helper\n'
+                            'from .. import top\n',
+            'app/lib/util.py': 'from ..models import Model\n',
+            'ns/other.py': 'import ns.mod\n',
+            'ns/mod.py': '',
+        }
+        for name, content in sources.iteritems():
+            filename = os.path.join(self.root, name)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'w') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def test_explicit_relative(self):
+        self.assertEqual(
+            set([self.path('app/__init__.py'), self.path('app/models.py'),
+                 self.path('app/lib/util.py'), self.path('top.py')]),
+            dependencies.python_dependencies(self.path('app/views.py'),
+                                             start_path=self.root))
+        self.assertEqual(
+            set([self.path('app/__init__.py'), self.path('app/models.py')]),
+            dependencies.python_dependencies(self.path('app/lib/util.py'),
+                                             start_path=self.root))
+
+    def test_implicit_relative(self):
+        self.assertEqual(
+            set([self.path('app/helpers.py'), self.path('top.py')]),
+            dependencies.python_dependencies(self.path('app/models.py'),
+                                             start_path=self.root))
+        self.assertEqual(
+            set([self.path('helpers.py')]),
+            dependencies.python_dependencies(self.path('app/absolute.py'),
+                                             start_path=self.root))
+
+    def test_namespace_package(self):
+        self.assertEqual(
+            set([self.path('ns/mod.py')]),
+            dependencies.python_dependencies(self.path('ns/other.py'),
+                                             start_path=self.root))
+
+    def test_package_cache(self):
+        package_cache = dependencies.PackageCache()
+        roots = [self.path('app/views.py'), self.path('ns/other.py')]
+        expected = dict(
+            (filename, dependencies.python_dependencies(
+                filename, start_path=self.root))
+            for filename in dependencies.dependency_graph(
+                roots, start_path=self.root))
+        with mock.patch('os.path.exists') as exists:
+            graph = dict(
+                (filename, dependencies.python_dependencies(
+                    filename, start_path=self.root,
+                    package_cache=package_cache))
+                for filename in expected)
+        self.assertFalse(exists.called)
+        self.assertEqual(expected, graph)
+        # The root and the app, lib and ns packages.
+        self.assertEqual(4, len(package_cache))
+        index = dependencies.ModuleIndex(self.root)
+        self.assertEqual(expected, dependencies.dependency_graph(
+            roots, start_path=self.root, module_index=index))
+
+
+class TestPythonTestDependencies(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for name in ('a.py', 'b.py', 'c.py', 'd.py', 'shared.py', 'unused.py',
+                     'pkg/__init__.py', 'pkg/e.py'):
+            filename = self.path(name)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'w') as f:
+                f.write('')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def test_dependencies(self):
+        test_filename = self.path('test_x.py')
+        with open(test_filename, 'w') as f:
+            f.write(textwrap.dedent('''\
+                import pytest
+                import a
+                import b as bee
+                from pkg import e
+                import shared
+                import unused
+
+                VALUE = shared.VALUE
+
+                @pytest.fixture
+                def fixture_b():
+                    return bee.make()
+
+                @pytest.fixture(autouse=True)
+                def setup():
+                    e.setup()
+
+                def helper():
+                    import d
+                    open("data.txt")
+
+                def test_a():
+                    assert a.f()
+
+                def test_b(fixture_b):
+                    helper()
+
+                class TestC(object):
+                    def test_c(self):
+                        pass
+                '''))
+        dependencies_by_name = dependencies.python_test_dependencies(
+            test_filename, start_path=self.root,
+            functions=(('open', 0, None),))
+        pkg = set([self.path('pkg/__init__.py'), self.path('pkg/e.py')])
+        self.assertEqual(set([self.path('shared.py'), self.path('unused.py')]),
+                         dependencies_by_name[None])
+        self.assertEqual(pkg | set([self.path('a.py')]),
+                         dependencies_by_name['test_a'])
+        self.assertEqual(
+            pkg | set([self.path('b.py'), self.path('d.py'), 'data.txt']),
+            dependencies_by_name['test_b'])
+        self.assertEqual(pkg, dependencies_by_name['TestC'])
+
+
+class TestUpdateGraph(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.rng = random.Random(0)
+        self.modules = ['m%d' % i for i in xrange(8)]
+        for module in self.modules:
+            self.write(module)
+        self.roots = [os.path.join(self.root, 'm0.py'),
+                      os.path.join(self.root, 'm1.py')]
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self, module):
+        return os.path.join(self.root, module + '.py')
+
+    def write(self, module):
+        # Imports may refer to modules which do not exist yet.
+        imports = self.rng.sample(self.modules + ['n%d' % i for i in xrange(4)],
+                                  self.rng.randint(0, 3))
+        with open(self.path(module), 'w') as f:
+            f.write(''.join('import %s\n' % name for name in imports))
+
+    def write_file(self, name, content):
+        filename = os.path.join(self.root, name)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            f.write(content)
+
+    def random_edit(self):
+        """Apply a random edit and return the changed, added, deleted files."""
+        existing = [module for module in self.modules
+                    if os.path.exists(self.path(module))]
+        action = self.rng.choice(['change', 'add', 'delete'])
+        if action == 'add':
+            module = 'n%d' % self.rng.randrange(4)
+            if module not in self.modules:
+                self.modules.append(module)
+                self.write(module)
+                return [], [self.path(module)], []
+        elif action == 'delete':
+            module = self.rng.choice(existing)
+            if self.path(module) not in self.roots:
+                os.remove(self.path(module))
+                return [], [], [self.path(module)]
+        module = self.rng.choice(existing)
+        self.write(module)
+        return [self.path(module)], [], []
+
+    def test_random_edits_equal_full_rebuild(self):
+        for _ in xrange(5):
+            graph = dependencies.dependency_graph(self.roots,
+                                                  start_path=self.root)
+            reachable = dependencies._reachable(graph)
+            for _ in xrange(10):
+                changed, added, deleted = self.random_edit()
+                new_graph = dependencies.update_graph(
+                    graph, self.roots, changed=changed, added=added,
+                    deleted=deleted, start_path=self.root)
+                expected_graph = dependencies.dependency_graph(
+                    self.roots, start_path=self.root)
+                self.assertEqual(expected_graph, new_graph)
+
+                reachable = dependencies.update_reachable(
+                    reachable, graph, new_graph)
+                self.assertEqual(dependencies._reachable(expected_graph),
+                                 reachable)
+                graph = new_graph
+
+    def test_package_edits_equal_full_rebuild(self):
+        sources = {
+            'helpers.py': '',
+            'pkg/a.py': 'import helpers\nfrom .sub import x\n',
+            'pkg/helpers.py': '',
+            'pkg/sub.py': '',
+            'pkg/inner/__init__.py': '',
+            'pkg/inner/b.py': 'from .. import helpers\nimport c\n',
+        }
+        for name, content in sources.iteritems():
+            self.write_file(name, content)
+        roots = [os.path.join(self.root, 'pkg', 'a.py'),
+                 os.path.join(self.root, 'pkg', 'inner', 'b.py')]
+        edits = [
+            ('add', 'pkg/__init__.py'),
+            ('add', 'pkg/inner/c.py'),
+            ('delete', 'pkg/helpers.py'),
+            ('delete', 'pkg/__init__.py'),
+            ('add', 'pkg/helpers.py'),
+        ]
+        graph = dependencies.dependency_graph(roots, start_path=self.root)
+        for action, name in edits:
+            filename = os.path.join(self.root, name)
+            if action == 'add':
+                self.write_file(name, '')
+                added, deleted = [filename], []
+            else:
+                os.remove(filename)
+                added, deleted = [], [filename]
+            graph = dependencies.update_graph(
+                graph, roots, added=added, deleted=deleted,
+                start_path=self.root)
+            self.assertEqual(
+                dependencies.dependency_graph(roots, start_path=self.root),
+                graph, (action, name))
+
+    def test_update_reachable_reuses_unchanged_closures(self):
+        graph = {'a': set('b'), 'b': set('c'), 'c': set(), 'd': set('c')}
+        reachable = dependencies._reachable(graph)
+        new_graph = dict(graph, b=set('e'), e=set())
+        new_reachable = dependencies.update_reachable(reachable, graph,
+                                                      new_graph)
+        self.assertEqual(dependencies._reachable(new_graph), new_reachable)
+        self.assertIs(reachable.bitset('d'), new_reachable.bitset('d'))
+
+
+class TestScan(unittest.TestCase):
+    FUNCTIONS = (('open', 0, None), ('*File', 0, None), ('reader', 'f', None))
+
+    SOURCES = [
+        '',
+        'x = 1\n',
+        'import os\n',
+        'import os.path as p, sys\n',
+        'from foo import (bar,\n    baz as b)  # comment\n',
+        'from foo import *\n',
+        'from __future__ import absolute_import\n',
+        'from . import x\nfrom ..y import (z,\n    w)\n',
+        'def f():\n    try:\n        import a\n    except ImportError:\n'
+        '        import b\n    else:\n        import c\n    finally:\n'
+        '        import d\n',
+        'class A(object):\n    if True: import e\n    with x:\n'
+        '        from f import g\n',
+        '"""import h"""\nopen("foo.txt")\n',
+        'import i\nx.open  # comment\\\n("foo.txt")\n',
+        'import j\ngzip.GzipFile(\n    "foo.gz")\n',
+        'import k\nreader(f="foo.csv")\n',
+        'import l\nopener("foo.txt")\n',
+        'import m\nprint "open(x)"\n',
+    ]
+
+    def check_agreement(self, source):
+        visitor = dependencies.DependencyVisitor(functions=self.FUNCTIONS)
+        visitor.visit(ast.parse(source))
+        scanned = dependencies._scan(source, '<test>', self.FUNCTIONS)
+        self.assertEqual(sorted(visitor.modules), sorted(scanned.modules))
+        self.assertEqual(sorted(visitor.filenames), sorted(scanned.filenames))
+        self.assertEqual(visitor.absolute_import, scanned.absolute_import)
+
+    def test_agreement(self):
+        for source in self.SOURCES:
+            self.check_agreement(source)
+
+    def test_agreement_stdlib(self):
+        directory = os.path.dirname(os.__file__)
+        for name in sorted(os.listdir(directory))[:40]:
+            if name.endswith('.py'):
+                with open(os.path.join(directory, name)) as f:
+                    self.check_agreement(f.read())
+
+    def test_may_call(self):
+        self.assertTrue(dependencies._may_call('x.open (1)', self.FUNCTIONS))
+        self.assertTrue(dependencies._may_call('GzipFile # c\n(', self.FUNCTIONS))
+        self.assertFalse(dependencies._may_call('opener(1)', self.FUNCTIONS))
+        self.assertFalse(dependencies._may_call('open = 1', self.FUNCTIONS))
+        self.assertFalse(dependencies._may_call('open(1)', ()))
+
+    def test_import_statements(self):
+        source = textwrap.dedent("""
+            import a, b as c  # import d
+            x = 1; from e import (f,
+                                  g)
+            if x: import h
+            s = \'\'\'
+            import i
+            \'\'\'
+            t = "import j"; raise E \\
+                from k
+        """)
+        self.assertEqual(['import a, b as c', 'from e import (f,\n'
+                          '                      g)', 'import h'],
+                         dependencies._import_statements(source))
+
+    def test_no_parse_without_imports(self):
+        with mock.patch('ast.parse') as parse:
+            visitor = dependencies._scan('x = (', '<test>', self.FUNCTIONS)
+        self.assertFalse(parse.called)
+        self.assertEqual([], visitor.modules)
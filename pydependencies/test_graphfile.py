@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import dependencies
+import graphfile
+
+
+class TestGraphFile(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.source = os.path.join(self.root, 'src')
+        sources = {
+            'test_a.py': 'import a\n',
+            'a.py': 'import b\nopen("%s")\n' % os.path.join(self.root, 'src',
+                                                              'data.txt'),
+            'b.py': 'import a\n',
+            'data.txt': 'data',
+        }
+        os.makedirs(self.source)
+        for name, content in sources.iteritems():
+            with open(os.path.join(self.source, name), 'w') as f:
+                f.write(content)
+        self.graph = dependencies.dependency_graph(
+            [self.path('test_a.py')], start_path=self.source,
+            functions=(('open', 0, None),))
+        self.graph_filename = os.path.join(self.root, 'graph.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self, name, root=None):
+        return os.path.join(root or self.source, name)
+
+    def test_write_and_load(self):
+        graphfile.write_graph(self.graph_filename, self.graph,
+                              base_path=self.source)
+        closure = dependencies._reachable(self.graph)
+        with graphfile.GraphFile(self.graph_filename,
+                                 base_path=self.source) as graph_file:
+            self.assertEqual(len(self.graph), len(graph_file))
+            for path in self.graph:
+                self.assertIn(path, graph_file)
+                self.assertEqual(self.graph[path],
+                                 graph_file.dependencies(path))
+                self.assertEqual(closure[path], graph_file.closure(path))
+            self.assertEqual(self.graph, graph_file.to_dict())
+            self.assertEqual(set(), graph_file.changed_paths())
+
+    def test_relative_nodes(self):
+        relative_graph = dict(
+            (os.path.relpath(path, self.source),
+             set(os.path.relpath(dep, self.source) for dep in deps))
+            for path, deps in self.graph.iteritems())
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            graphfile.write_graph(self.graph_filename, relative_graph,
+                                  base_path=self.source)
+        finally:
+            os.chdir(cwd)
+        with graphfile.GraphFile(self.graph_filename,
+                                 base_path=self.source) as graph_file:
+            self.assertEqual(self.graph, graph_file.to_dict())
+            self.assertEqual(set(), graph_file.changed_paths())
+
+    def test_changed_paths(self):
+        graphfile.write_graph(self.graph_filename, self.graph,
+                              base_path=self.source)
+        with open(self.path('b.py'), 'w') as f:
+            f.write('')
+        os.remove(self.path('data.txt'))
+        with graphfile.GraphFile(self.graph_filename,
+                                 base_path=self.source) as graph_file:
+            changed_paths = graph_file.changed_paths()
+        self.assertEqual(set([self.path('b.py'), self.path('data.txt')]),
+                         changed_paths)
+
+    def test_load_in_other_base_path(self):
+        graphfile.write_graph(self.graph_filename, self.graph,
+                              base_path=self.source)
+        other_source = os.path.join(self.root, 'other')
+        shutil.copytree(self.source, other_source)
+        with graphfile.GraphFile(self.graph_filename,
+                                 base_path=other_source) as graph_file:
+            self.assertEqual(set([self.path('a.py', other_source)]),
+                             graph_file.dependencies(
+                                 self.path('test_a.py', other_source)))
+
+    def test_invalid_file(self):
+        with open(self.graph_filename, 'wb') as f:
+            f.write('x' * 64)
+        self.assertRaises(ValueError, graphfile.GraphFile, self.graph_filename)
+
+    def test_build_graph_main(self):
+        dependencies.main(['pydependencies', 'build-graph',
+                           '-o', self.graph_filename,
+                           '--base_path', self.source,
+                           self.path('test_a.py')])
+        with graphfile.GraphFile(self.graph_filename,
+                                 base_path=self.source) as graph_file:
+            self.assertEqual(
+                set([self.path('test_a.py'), self.path('a.py'),
+                     self.path('b.py')]),
+                graph_file.closure(self.path('test_a.py')))
+
+    def test_build_graph_main_template_dialects(self):
+        templates_path = os.path.join(self.source, 'templates')
+        os.makedirs(templates_path)
+        for name, content in (('index.html', '{% include "base.html" %}'),
+                              ('base.html', '')):
+            with open(os.path.join(templates_path, name), 'w') as f:
+                f.write(content)
+        dependencies.main(['pydependencies', 'build-graph',
+                           '-o', self.graph_filename,
+                           '--base_path', self.source,
+                           '--template-dialects', 'mako,jinja',
+                           os.path.join(templates_path, 'index.html')])
+        with graphfile.GraphFile(self.graph_filename,
+                                 base_path=self.source) as graph_file:
+            self.assertEqual(
+                set([os.path.join(templates_path, 'base.html')]),
+                graph_file.dependencies(
+                    os.path.join(templates_path, 'index.html')))
+
+    def test_dependency_graph_with_known(self):
+        known = {self.path('b.py'): set()}
+        graph = dependencies.dependency_graph(
+            [self.path('test_a.py')], start_path=self.source, known=known)
+        self.assertEqual(set(), graph[self.path('b.py')])
+        self.assertEqual(set([self.path('b.py')]), graph[self.path('a.py')])
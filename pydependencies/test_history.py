@@ -0,0 +1,65 @@
+import shutil
+import tempfile
+import unittest
+
+import history
+
+
+class Item(object):
+    def __init__(self, nodeid):
+        self.nodeid = nodeid
+        self.fspath = nodeid.split('::')[0]
+
+
+class TestRunHistory(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_update(self):
+        with history.RunHistory(self.path) as run_history:
+            self.assertEqual({}, run_history.load())
+            run_history.update({'a.py::test': (True, 2.0),
+                                'b.py::test': (False, 1.0)})
+        with history.RunHistory(self.path) as run_history:
+            run_history.update({'a.py::test': (False, 1.0)})
+            test_history = run_history.load()
+        failure_rate, duration = test_history['a.py::test']
+        self.assertAlmostEqual(1 - history.WEIGHT, failure_rate)
+        self.assertAlmostEqual(2.0 - history.WEIGHT, duration)
+        self.assertEqual((0.0, 1.0), test_history['b.py::test'])
+
+
+class TestPrioritize(unittest.TestCase):
+    def test_prioritize(self):
+        items = [Item(nodeid) for nodeid in [
+            'far.py::test', 'slow.py::test_1', 'slow.py::test_2',
+            'fast.py::test', 'flaky.py::test', 'new.py::test',
+            'unknown.py::test']]
+        distances = {'far.py': 2, 'slow.py': 1, 'fast.py': 1, 'flaky.py': 1,
+                     'new.py': 1}
+        test_history = {
+            'far.py::test': (1.0, 0.1),
+            'slow.py::test_1': (0.0, 1.0),
+            'slow.py::test_2': (0.0, 1.0),
+            'fast.py::test': (0.0, 0.5),
+            'flaky.py::test': (0.5, 3.0),
+            'unknown.py::test': (1.0, 0.1),
+        }
+        self.assertEqual(
+            ['new.py::test', 'flaky.py::test', 'fast.py::test',
+             'slow.py::test_1', 'slow.py::test_2', 'far.py::test',
+             'unknown.py::test'],
+            [item.nodeid for item in
+             history.prioritize(items, distances, test_history)])
+
+    def test_prioritize_keeps_order_without_information(self):
+        items = [Item(nodeid) for nodeid in ['b.py::test_2', 'b.py::test_1',
+                                             'a.py::test']]
+        self.assertEqual(items, history.prioritize(items, {}, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import dependencies
+import profiling
+
+
+class TestProfile(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        sources = {
+            'test_a.py': 'import a\n',
+            'a.py': 'import b\nrender("index.html")\n',
+            'b.py': '',
+            'templates/index.html': '<%include file="/base.html"/>\n',
+            'templates/base.html': '',
+        }
+        for name, content in sources.iteritems():
+            filename = os.path.join(self.root, name)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'w') as f:
+                f.write(content)
+        templates = os.path.join(self.root, 'templates')
+        self.options = dict(
+            start_path=self.root, template_path=templates,
+            functions=(('render', 0,
+                        lambda name: os.path.join(templates, name)),))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_transitive_dependencies(self):
+        profile = profiling.Profile(trace=True)
+        dependencies.transitive_dependencies(
+            [os.path.join(self.root, 'test_a.py')], profile=profile,
+            **self.options)
+        self.assertEqual(3, profile.counters['python_files'])
+        self.assertEqual(2, profile.counters['html_files'])
+        self.assertEqual(5, profile.counters['nodes'])
+        self.assertEqual(4, profile.counters['edges'])
+        self.assertGreater(profile.counters['stat_calls'], 0)
+        for phase in ('graph', 'analyse', 'read', 'parse', 'resolve',
+                      'html_scan', 'closure'):
+            self.assertIn(phase, profile.times)
+        self.assertEqual(5, profile.calls['analyse'])
+        self.assertEqual(5, len(profile.slowest_files(10)))
+        self.assertEqual(2, len(profile.slowest_files(2)))
+        self.assertIn('slowest files:', profile.summary())
+
+        json_filename = os.path.join(self.root, 'profile.json')
+        profile.write_json(json_filename)
+        with open(json_filename) as f:
+            self.assertEqual(5, json.load(f)['counters']['nodes'])
+        trace_filename = os.path.join(self.root, 'trace.json')
+        profile.write_trace(trace_filename)
+        with open(trace_filename) as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual(len(profile.events), len(events))
+        self.assertTrue(all(event['ph'] == 'X' for event in events))
+
+    def test_parallel(self):
+        profile = profiling.Profile()
+        dependencies.dependency_graph(
+            [os.path.join(self.root, 'test_a.py')], profile=profile,
+            workers=2, **self.options)
+        self.assertEqual(5, profile.calls['analyse'])
+        self.assertEqual(5, profile.counters['nodes'])
+
+    def test_cache_counters(self):
+        known = {os.path.join(self.root, 'b.py'): set()}
+        profile = profiling.Profile()
+        dependencies.dependency_graph(
+            [os.path.join(self.root, 'test_a.py')], profile=profile,
+            known=known, **self.options)
+        self.assertEqual(1, profile.counters['known_files'])
+        self.assertEqual(4, profile.calls['analyse'])
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import pytest_deps
+
+
+class TestWithRecorded(unittest.TestCase):
+    def test_recorded_distances(self):
+        distances = {'/test_a.py': 0, '/a.py': 0, '/b.py': 2}
+        recorded = {
+            '/test_a.py': set(['/data.txt']),
+            '/test_b.py': set(['/b.py', '/data.txt']),
+            '/test_c.py': set(['/b.py']),
+            '/test_d.py': set(['/other.txt']),
+        }
+        self.assertEqual(
+            {'/test_a.py': 0, '/a.py': 0, '/b.py': 2, '/test_b.py': 1,
+             '/test_c.py': 3},
+            pytest_deps.with_recorded(distances, recorded,
+                                      set(['/a.py', '/data.txt'])))
+
+
+class TestAnalyseTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, content):
+        filename = os.path.join(self.root, name)
+        with open(filename, 'w') as f:
+            f.write(content)
+        return filename
+
+    def test_unparsable_files_are_missing(self):
+        test_a = self.write('test_a.py', 'def test_a():\n    pass\n')
+        test_syntax = self.write('test_syntax.py', 'def test(:\n')
+        test_null = self.write('test_null.py', 'def test():\n    "\0"\n')
+        test_missing = os.path.join(self.root, 'test_missing.py')
+        self.assertEqual(
+            [test_a],
+            list(pytest_deps.analyse_tests(
+                [test_a, test_syntax, test_null, test_missing], self.root)))
+
+    def test_other_errors_propagate(self):
+        test_a = self.write('test_a.py', '')
+        with mock.patch.object(pytest_deps.dependencies,
+                               'python_test_dependencies',
+                               side_effect=TypeError):
+            with self.assertRaises(TypeError):
+                pytest_deps.analyse_tests([test_a], self.root)
+
+
+class TestRecording(unittest.TestCase):
+    def item(self, filename, file_recorder):
+        return mock.Mock(fspath=filename,
+                         config=mock.Mock(_deps_recorder=file_recorder))
+
+    def teardown(self, item, nextitem):
+        hook = pytest_deps.pytest_runtest_teardown(item, nextitem)
+        next(hook)
+        with self.assertRaises(StopIteration):
+            next(hook)
+
+    def test_flush_after_last_test_of_file(self):
+        file_recorder = mock.Mock()
+        test_a1 = self.item('/test_a.py', file_recorder)
+        test_a2 = self.item('/test_a.py', file_recorder)
+        test_b = self.item('/test_b.py', file_recorder)
+        self.teardown(test_a1, test_a2)
+        self.assertFalse(file_recorder.flush.called)
+        self.teardown(test_a2, test_b)
+        file_recorder.flush.assert_called_once_with('/test_a.py')
+        self.teardown(test_b, None)
+        file_recorder.flush.assert_called_with('/test_b.py')
+
+    def test_stop_at_session_finish(self):
+        file_recorder = mock.Mock()
+        session = mock.Mock(config=mock.Mock(_deps_recorder=file_recorder,
+                                             _deps_results=None))
+        pytest_deps.pytest_sessionfinish(session)
+        file_recorder.stop.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()
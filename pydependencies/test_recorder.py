@@ -0,0 +1,105 @@
+import codecs
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import recorder
+
+
+class TestRecorder(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.source = os.path.join(self.root, 'src')
+        self.cache_path = os.path.join(self.source, '.cache')
+        os.makedirs(self.source)
+        for name in ('data.txt', 'other.txt', 'recorded_module.py'):
+            with open(self.path(name), 'w') as f:
+                f.write('')
+        self.outside = os.path.join(self.root, 'outside.txt')
+        with open(self.outside, 'w') as f:
+            f.write('')
+        sys.path.insert(0, self.source)
+
+    def tearDown(self):
+        sys.path.remove(self.source)
+        sys.modules.pop('recorded_module', None)
+        recorder.uninstall()
+        shutil.rmtree(self.root)
+
+    def path(self, name):
+        return os.path.join(self.source, name)
+
+    def test_record(self):
+        database = recorder.RecordedDependencies(self.cache_path,
+                                                 base_path=self.source)
+        file_recorder = recorder.Recorder(database,
+                                          ignored_paths=[self.cache_path])
+        test_a, test_b = self.path('test_a.py'), self.path('test_b.py')
+        file_recorder.start(test_a)
+        open(self.path('data.txt')).close()
+        open(self.outside).close()
+        importlib.import_module('recorded_module')
+        file_recorder.stop()
+        open(self.path('other.txt')).close()
+        file_recorder.start(test_b)
+        open(self.path('other.txt')).close()
+        file_recorder.flush(test_b)
+        file_recorder.close()
+
+        self.assertIs(recorder._builtin_open, open)
+        self.assertEqual(
+            {test_a: set([self.path('data.txt'),
+                          self.path('recorded_module.py')]),
+             test_b: set([self.path('other.txt')])},
+            recorder.load_recorded(self.cache_path, self.source))
+        self.assertEqual(
+            [test_b],
+            list(recorder.load_recorded(self.cache_path, self.source,
+                                        [test_b])))
+
+    def recorded(self, function):
+        database = recorder.RecordedDependencies(self.cache_path,
+                                                 base_path=self.source)
+        file_recorder = recorder.Recorder(database)
+        test_a = self.path('test_a.py')
+        file_recorder.start(test_a)
+        function()
+        file_recorder.flush(test_a)
+        file_recorder.close()
+        return recorder.load_recorded(self.cache_path, self.source)[test_a]
+
+    def test_record_other_openers(self):
+        def read():
+            os.close(os.open(self.path('data.txt'), os.O_RDONLY))
+            codecs.open(self.path('other.txt'), encoding='utf-8').close()
+            if sys.version_info[0] == 2:
+                f = file(self.path('recorded_module.py'))
+                self.assertIsInstance(f, file)
+                self.assertIsInstance(sys.__stdout__, file)
+                f.close()
+            else:
+                open(self.path('recorded_module.py')).close()
+
+        self.assertEqual(set([self.path('data.txt'),
+                              self.path('other.txt'),
+                              self.path('recorded_module.py')]),
+                         self.recorded(read))
+        self.assertIs(recorder._os_open, os.open)
+
+    def test_record_relative_path(self):
+        def read():
+            cwd = os.getcwd()
+            os.chdir(self.source)
+            try:
+                open('data.txt').close()
+            finally:
+                os.chdir(cwd)
+
+        self.assertEqual(set([self.path('data.txt')]), self.recorded(read))
+
+    def test_load_recorded_without_database(self):
+        self.assertEqual({}, recorder.load_recorded(self.cache_path,
+                                                    self.source))
@@ -0,0 +1,64 @@
+import argparse
+import unittest
+
+import dependencies
+import shards
+
+
+class TestParseShard(unittest.TestCase):
+    def test_valid(self):
+        self.assertEqual((0, 4), shards.parse_shard('1/4'))
+        self.assertEqual((3, 4), shards.parse_shard('4/4'))
+
+    def test_invalid(self):
+        for value in ('', '1', '1/2/3', 'a/b', '0/4', '5/4'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                shards.parse_shard(value)
+
+
+class TestPlanShards(unittest.TestCase):
+    def setUp(self):
+        # test_a and test_b share a large module, test_c and test_d another.
+        self.graph = {
+            'test_a.py': set(['big1.py']),
+            'test_b.py': set(['big1.py']),
+            'test_c.py': set(['big2.py']),
+            'test_d.py': set(['big2.py']),
+            'big1.py': set(['m%d.py' % i for i in range(100)]),
+            'big2.py': set(['n%d.py' % i for i in range(100)]),
+        }
+        self.closures = dependencies.DependencyGraph(self.graph).closure()
+        self.tests = ['test_a.py', 'test_b.py', 'test_c.py', 'test_d.py']
+
+    def test_shared_dependencies(self):
+        plan = shards.plan_shards(self.tests, self.closures, {}, 2,
+                                  module_cost=0.1)
+        self.assertEqual(sorted([['test_a.py', 'test_b.py'],
+                                 ['test_c.py', 'test_d.py']]),
+                         sorted(plan))
+
+    def test_balance(self):
+        # test_c and test_d share dependencies, but are too long to run
+        # together.
+        durations = {'test_a.py': 10.0, 'test_b.py': 10.0,
+                     'test_c.py': 5.0, 'test_d.py': 5.0}
+        plan = shards.plan_shards(self.tests, self.closures, durations, 2,
+                                  module_cost=0.001)
+        self.assertEqual(sorted([['test_a.py', 'test_c.py'],
+                                 ['test_b.py', 'test_d.py']]),
+                         sorted(plan))
+
+    def test_deterministic(self):
+        plan = shards.plan_shards(self.tests, self.closures, {}, 3)
+        self.assertEqual(plan, shards.plan_shards(
+            reversed(self.tests), self.closures, {}, 3))
+        self.assertEqual(sorted(self.tests), sorted(sum(plan, [])))
+
+    def test_unknown_files(self):
+        plan = shards.plan_shards(['test_x.py', 'test_y.py'], self.closures,
+                                  {}, 3)
+        self.assertEqual([['test_x.py'], ['test_y.py'], []], plan)
+
+
+if __name__ == '__main__':
+    unittest.main()
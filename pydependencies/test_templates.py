@@ -0,0 +1,119 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import templates
+
+
+class TestTemplateDependencies(unittest.TestCase):
+    def setUp(self):
+        self.template_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.template_path)
+
+    def _write(self, name, content):
+        filename = os.path.join(self.template_path, name)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            f.write(content)
+        return filename
+
+    def test_mako(self):
+        filename = self._write('pages/index.html', '\n'.join([
+            '<%inherit file="/base.html"/>',
+            "<%include file='header.html' args='x'/>",
+            '<%namespace name="forms"\n    file="/lib/forms.html"/>',
+            '<%include file="../footer.html"/>',
+            '<div file="ignored.html"></div>',
+        ]))
+        self.assertEqual(
+            set([os.path.join(self.template_path, 'base.html'),
+                 os.path.join(self.template_path, 'header.html'),
+                 os.path.join(self.template_path, 'lib/forms.html'),
+                 os.path.join(self.template_path, 'footer.html')]),
+            templates.template_dependencies(
+                filename, template_path=self.template_path))
+
+    def test_jinja(self):
+        filename = self._write('index.html', '\n'.join([
+            '{% extends "base.html" %}',
+            "{%- include 'header.html' %}",
+            '{% from "macros.html" import field %}',
+            '<%include file="mako.html"/>',
+        ]))
+        self.assertEqual(
+            set([os.path.join(self.template_path, 'base.html'),
+                 os.path.join(self.template_path, 'header.html'),
+                 os.path.join(self.template_path, 'macros.html')]),
+            templates.template_dependencies(
+                filename, template_path=self.template_path,
+                dialects=('jinja',)))
+
+    def test_content(self):
+        self.assertEqual(
+            set([os.path.join(self.template_path, 'base.html')]),
+            templates.template_dependencies(
+                os.path.join(self.template_path, 'missing.html'),
+                template_path=self.template_path,
+                content='<%inherit file="/base.html"/>'))
+
+    def test_empty_file(self):
+        filename = self._write('empty.html', '')
+        self.assertEqual(set(), templates.template_dependencies(
+            filename, template_path=self.template_path))
+
+    def test_unknown_dialect(self):
+        filename = self._write('index.html', '')
+        with self.assertRaises(ValueError):
+            templates.template_dependencies(filename, dialects=('erb',))
+
+    def test_template_index(self):
+        self._write('base.html', '')
+        self._write('lib/forms.html', '')
+        filename = self._write('index.html', '\n'.join([
+            '<%inherit file="/base.html"/>',
+            '<%include file="lib/./forms.html"/>',
+            '<%include file="missing.html"/>',
+        ]))
+        index = templates.TemplateIndex(self.template_path)
+        self.assertEqual(3, len(index))
+        self.assertIn('/lib/forms.html', index)
+        self.assertNotIn('missing.html', index)
+        self.assertEqual(
+            set([os.path.join(self.template_path, 'base.html'),
+                 os.path.join(self.template_path, 'lib/forms.html'),
+                 os.path.join(self.template_path, 'missing.html')]),
+            templates.template_dependencies(filename,
+                                            template_index=index))
+
+    def test_template_index_equal_without_index(self):
+        self._write('base.html', '')
+        self._write('lib/forms.html', '')
+        filename = self._write('pages/index.html', '\n'.join([
+            '<%inherit file="/base.html"/>',
+            '<%include file="lib/./forms.html"/>',
+            '<%include file="lib/../base.html"/>',
+            '<%include file="lib/../../outside.html"/>',
+            '<%include file="../lib/forms.html"/>',
+            '<%include file="missing/./page.html"/>',
+        ]))
+        index = templates.TemplateIndex(self.template_path)
+        without_index = templates.template_dependencies(
+            filename, template_path=self.template_path)
+        self.assertEqual(
+            set([os.path.join(self.template_path, 'base.html'),
+                 os.path.join(self.template_path, 'lib/forms.html'),
+                 os.path.join(os.path.dirname(self.template_path),
+                              'outside.html'),
+                 os.path.join(self.template_path, 'missing/page.html')]),
+            without_index)
+        self.assertEqual(without_index,
+                         templates.template_dependencies(
+                             filename, template_index=index))
+
+
+if __name__ == '__main__':
+    unittest.main()
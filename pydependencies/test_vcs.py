@@ -0,0 +1,78 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import vcs
+
+
+class TestChangedFilenames(unittest.TestCase):
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.git('init', '-q')
+        for name in ('a.py', 'b.py', 'c.py', 'd.py'):
+            self.write(name, name)
+        self.commit()
+        self.git('branch', 'base')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def git(self, *arguments):
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(
+                ['git', '-c', 'user.name=test', '-c', 'user.email=test@test',
+                 '-c', 'commit.gpgsign=false'] + list(arguments),
+                cwd=self.root, stdout=devnull)
+
+    def commit(self):
+        self.git('add', '-A')
+        self.git('commit', '-q', '-m', 'commit')
+
+    def write(self, name, content):
+        filename = self.path(name)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            f.write(content)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def test_git_root(self):
+        os.makedirs(self.path('pkg'))
+        self.assertEqual(self.root, vcs.git_root(self.path('pkg')))
+        self.assertIsNone(vcs.git_root(tempfile.gettempdir()))
+
+    def test_working_tree(self):
+        self.assertEqual(set(), vcs.changed_filenames(self.root))
+        self.write('a.py', 'changed')
+        self.write('new dir/new file.py', '')
+        os.remove(self.path('b.py'))
+        self.git('mv', 'c.py', 'renamed.py')
+        self.assertEqual(
+            set(self.path(name) for name in [
+                'a.py', 'b.py', 'c.py', 'renamed.py', 'new dir/new file.py']),
+            vcs.changed_filenames(self.root))
+
+    def test_base(self):
+        self.git('mv', 'd.py', 'moved.py')
+        self.write('a.py', 'changed')
+        self.commit()
+        self.write('b.py', 'changed')
+        self.assertEqual(set([self.path('b.py')]),
+                         vcs.changed_filenames(self.root))
+        changed = vcs.changed_filenames(self.root, base='base')
+        self.assertEqual(
+            set(self.path(name)
+                for name in ['a.py', 'b.py', 'd.py', 'moved.py']),
+            changed)
+        self.assertTrue(all(filename is intern(filename)
+                            for filename in changed))
+        self.assertRaises(ValueError, vcs.changed_filenames, self.root,
+                          base='unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""Find the files changed in a git checkout.
+
+The changes are read with at most two git commands, whatever the number of
+files:
+
+    git diff --name-status -z BASE...HEAD   (only when a base is given)
+    git status --porcelain -z
+
+The first one lists the files changed by the commits since HEAD diverged from
+BASE, e.g. the merge base of a pull request, and the second one the staged,
+unstaged and untracked changes. Both old and new paths of the renames are
+reported, as tests may depend on either.
+
+Paths are returned absolute, normalized and interned, as the paths of the
+dependency graph, so comparing them with the graph is a set lookup.
+"""
+import os
+import subprocess
+
+
+__all__ = ('git_root', 'changed_filenames', 'normalize')
+
+
+def _git(arguments, cwd):
+    """Run git and return its output.
+
+    Raises:
+        OSError: if git is not installed.
+        ValueError: if git failed.
+    """
+    process = subprocess.Popen(['git'] + arguments, cwd=cwd,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, error = process.communicate()
+    if process.returncode:
+        raise ValueError('git %s failed: %s' % (arguments[0], error.strip()))
+    return output
+
+
+def git_root(path='.'):
+    """Return the root of the git checkout containing path, or None."""
+    try:
+        return _git(['rev-parse', '--show-toplevel'], path).rstrip('\n')
+    except (OSError, ValueError):
+        return None
+
+
+def normalize(root, path):
+    """Return the absolute, normalized and interned path of a git path."""
+    return intern(os.path.normpath(os.path.join(root, path)))
+
+
+def _parse_diff(output):
+    """Return the paths of the output of git diff --name-status -z."""
+    paths = []
+    fields = output.split('\0')
+    i = 0
+    while i < len(fields) and fields[i]:
+        status = fields[i]
+        # Renames and copies are followed by the old and the new path.
+        count = 2 if status[0] in 'RC' else 1
+        paths.extend(fields[i + 1:i + 1 + count])
+        i += 1 + count
+    return paths
+
+
+def _parse_status(output):
+    """Return the paths of the output of git status --porcelain -z."""
+    paths = []
+    fields = output.split('\0')
+    i = 0
+    while i < len(fields) and fields[i]:
+        entry = fields[i]
+        paths.append(entry[3:])
+        i += 1
+        # The new path of a rename is followed by the old one.
+        if 'R' in entry[:2] or 'C' in entry[:2]:
+            paths.append(fields[i])
+            i += 1
+    return paths
+
+
+def changed_filenames(root, base=None):
+    """Return the files changed in the checkout at root.
+
+    Args:
+        root: str: the root of the git checkout
+        base: str: if given, the files changed by the commits since HEAD
+        diverged from this ref are included
+
+    Returns:
+        a set of absolute paths, including the deleted files and both paths
+        of the renamed ones.
+
+    Raises:
+        ValueError: if git failed, e.g. base is not a valid ref.
+    """
+    paths = []
+    if base:
+        paths.extend(_parse_diff(_git(
+            ['diff', '--name-status', '-z', '-M', '%s...HEAD' % base], root)))
+    paths.extend(_parse_status(_git(
+        ['status', '--porcelain', '-z', '--untracked-files=all'], root)))
+    return set(normalize(root, path) for path in paths)